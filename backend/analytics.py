@@ -0,0 +1,233 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import date, datetime, timedelta
+import models
+import money
+
+# Spending analytics rollups.
+#
+# SpendingRollups holds the spend (in cents) and number of expenses of every
+# (group, granularity, bucket, payer) for day, week (starting Monday) and
+# month buckets. Every write path that creates expenses adjusts the rows in
+# the same transaction as the expenses, like the MemberBalances ledger, so a
+# chart over years of history reads a few hundred rows from one primary key
+# range instead of loading every expense.
+#
+# Groups whose history predates the rollups (or was imported straight into
+# the database) have expenses but no rollup rows; they are aggregated in SQL
+# from Expenses instead until "roomiepay.py analytics rebuild" backfills them.
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def bucket_start(value, granularity: str) -> date:
+    day = value.date() if isinstance(value, datetime) else value
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(bucket: date, granularity: str) -> date:
+    if granularity == "week":
+        return bucket + timedelta(weeks=1)
+    if granularity == "month":
+        return (bucket.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return bucket + timedelta(days=1)
+
+
+def _adjust(db: Session, group_id: int, granularity: str, bucket: date, user_id: int, cents: int, count: int):
+    # Relative UPDATE so concurrent writers never lose each other's increments
+    updated = db.query(models.SpendingRollup)\
+        .filter(
+            models.SpendingRollup.GroupID == group_id,
+            models.SpendingRollup.Granularity == granularity,
+            models.SpendingRollup.BucketStart == bucket,
+            models.SpendingRollup.UserID == user_id
+        ).update({
+            models.SpendingRollup.TotalCents: models.SpendingRollup.TotalCents + cents,
+            models.SpendingRollup.ExpenseCount: models.SpendingRollup.ExpenseCount + count
+        }, synchronize_session=False)
+    if not updated:
+        db.add(models.SpendingRollup(
+            GroupID=group_id,
+            Granularity=granularity,
+            BucketStart=bucket,
+            UserID=user_id,
+            TotalCents=cents,
+            ExpenseCount=count
+        ))
+        db.flush()
+
+
+def fold(expenses: Iterable[Tuple[int, int, date, int, int]]) -> Dict[tuple, List[int]]:
+    """
+    Sum (group, payer, date, cents, count) tuples into
+    {(group, granularity, bucket, payer): [cents, count]} for every granularity.
+    """
+    totals = {}
+    for group_id, user_id, day, cents, count in expenses:
+        for granularity in GRANULARITIES:
+            key = (group_id, granularity, bucket_start(day, granularity), user_id)
+            total = totals.setdefault(key, [0, 0])
+            total[0] += cents
+            total[1] += count
+    return totals
+
+
+def record_expenses(db: Session, expenses: Iterable[Tuple[int, int, datetime, int]]):
+    """
+    Add new expenses, as (GroupID, PaidByUserID, Date, AmountCents), to the
+    rollups; call before committing the write.
+    """
+    totals = fold((group_id, user_id, day, cents, 1) for group_id, user_id, day, cents in expenses)
+    for (group_id, granularity, bucket, user_id), (cents, count) in totals.items():
+        _adjust(db, group_id, granularity, bucket, user_id, cents, count)
+
+
+def _as_date(value) -> date:
+    # DATE() comes back as a string on SQLite
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return bucket_start(value, "day")
+
+
+def aggregate_daily(db, group_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    user_id: Optional[int] = None) -> List[Tuple[int, int, date, int, int]]:
+    """
+    Spend per payer and day aggregated in SQL from Expenses, within
+    [start, end). Works on a Session or a Connection.
+    """
+    day = func.date(models.Expense.Date)
+    query = select(
+        models.Expense.PaidByUserID,
+        day,
+        func.sum(models.Expense.AmountCents),
+        func.count(models.Expense.ExpenseID)
+    ).where(models.Expense.GroupID == group_id)
+    if start is not None:
+        query = query.where(models.Expense.Date >= start)
+    if end is not None:
+        query = query.where(models.Expense.Date < end)
+    if user_id is not None:
+        query = query.where(models.Expense.PaidByUserID == user_id)
+    rows = db.execute(query.group_by(models.Expense.PaidByUserID, day)).all()
+    return [(group_id, payer_id, _as_date(value), int(cents), count) for payer_id, value, cents, count in rows]
+
+
+def compute_group_rollups(db, group_id: int) -> Dict[tuple, List[int]]:
+    return fold(aggregate_daily(db, group_id))
+
+
+def rebuild_group(db, group_id: int) -> int:
+    """Replace the rollup rows of a group with values recomputed from Expenses"""
+    totals = compute_group_rollups(db, group_id)
+    db.execute(models.SpendingRollup.__table__.delete().where(models.SpendingRollup.GroupID == group_id))
+    if totals:
+        db.execute(models.SpendingRollup.__table__.insert(), [
+            {
+                "GroupID": group_id,
+                "Granularity": granularity,
+                "BucketStart": bucket,
+                "UserID": user_id,
+                "TotalCents": cents,
+                "ExpenseCount": count
+            }
+            for (_, granularity, bucket, user_id), (cents, count) in totals.items()
+        ])
+    return len(totals)
+
+
+def verify_group(db: Session, group_id: int) -> List[dict]:
+    """Return the rollup rows that disagree with the recomputed history"""
+    expected = compute_group_rollups(db, group_id)
+    stored = {
+        (row.GroupID, row.Granularity, row.BucketStart, row.UserID): [row.TotalCents, row.ExpenseCount]
+        for row in db.query(models.SpendingRollup)
+            .filter(models.SpendingRollup.GroupID == group_id).all()
+    }
+
+    mismatches = []
+    for key in set(expected) | set(stored):
+        # Empty buckets may keep a zero row
+        want = expected.get(key, [0, 0])
+        have = stored.get(key, [0, 0])
+        if want != have:
+            mismatches.append({"GroupID": group_id, "Bucket": key[1:], "expected": want, "stored": have})
+    return mismatches
+
+
+def _has_unrolled_history(db: Session, group_id: int) -> bool:
+    has_rollups = db.query(models.SpendingRollup.GroupID)\
+        .filter(models.SpendingRollup.GroupID == group_id)\
+        .first()
+    if has_rollups:
+        return False
+    return db.query(models.Expense.ExpenseID)\
+        .filter(models.Expense.GroupID == group_id)\
+        .first() is not None
+
+
+def group_spending(db: Session, group_id: int, granularity: str = "month", start: Optional[date] = None,
+                   end: Optional[date] = None, user_id: Optional[int] = None) -> dict:
+    """
+    Spend per bucket and payer for the buckets overlapping [start, end]
+    (inclusive dates), oldest first.
+    """
+    first_bucket = bucket_start(start, granularity) if start else None
+    last_bucket = bucket_start(end, granularity) if end else None
+
+    if _has_unrolled_history(db, group_id):
+        range_start = datetime.combine(first_bucket, datetime.min.time()) if first_bucket else None
+        range_end = datetime.combine(next_bucket(last_bucket, granularity), datetime.min.time()) if last_bucket else None
+        totals = fold(aggregate_daily(db, group_id, range_start, range_end, user_id))
+        rows = [
+            (bucket, payer_id, cents, count)
+            for (_, bucket_granularity, bucket, payer_id), (cents, count) in totals.items()
+            if bucket_granularity == granularity
+        ]
+    else:
+        query = db.query(
+            models.SpendingRollup.BucketStart,
+            models.SpendingRollup.UserID,
+            models.SpendingRollup.TotalCents,
+            models.SpendingRollup.ExpenseCount
+        ).filter(
+            models.SpendingRollup.GroupID == group_id,
+            models.SpendingRollup.Granularity == granularity
+        )
+        if first_bucket:
+            query = query.filter(models.SpendingRollup.BucketStart >= first_bucket)
+        if last_bucket:
+            query = query.filter(models.SpendingRollup.BucketStart <= last_bucket)
+        if user_id is not None:
+            query = query.filter(models.SpendingRollup.UserID == user_id)
+        rows = query.all()
+
+    buckets = {}
+    for bucket, payer_id, cents, count in rows:
+        if not count:
+            continue
+        entry = buckets.setdefault(bucket, {"TotalCents": 0, "ExpenseCount": 0, "Members": {}})
+        entry["TotalCents"] += cents
+        entry["ExpenseCount"] += count
+        entry["Members"][payer_id] = money.from_cents(cents)
+
+    return {
+        "GroupID": group_id,
+        "Granularity": granularity,
+        "Start": first_bucket,
+        "End": last_bucket,
+        "Total": money.from_cents(sum(entry["TotalCents"] for entry in buckets.values())),
+        "Buckets": [
+            {
+                "BucketStart": bucket,
+                "Total": money.from_cents(entry["TotalCents"]),
+                "ExpenseCount": entry["ExpenseCount"],
+                "Members": entry["Members"]
+            }
+            for bucket, entry in sorted(buckets.items())
+        ]
+    }
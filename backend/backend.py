@@ -1,78 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text, inspect
+from sqlalchemy import func, insert, update
 from typing import List, Dict, Optional
 import models, schemas
-from security import get_current_user, get_password_hash, verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
-from database import engine, get_db
+import ledger
+import analytics
+import money
+import inbox
+import settlement_planner
+import expense_import
+import expense_splits
+import settlement_totals
+import settlement_status
+import idempotency
+import metrics
+import instrumentation
+import membership
+import group_versions
+import pagination
+import loaders
+import settlement_scheduler
+import migrations
+import notification_hub
+from security import get_current_user, resolve_current_user, get_password_hash_async, verify_password_async, create_access_token, shutdown_password_pool, ACCESS_TOKEN_EXPIRE_MINUTES
+from database import get_engine, get_db, SessionLocal, run_blocking, after_commit
 import random
 import string
-from datetime import datetime, timedelta
-from decimal import Decimal
+from datetime import date, datetime, timedelta
 import asyncio
-import os
-import re
-
-# Create tables using SQL commands from cmds.txt
-def create_tables_from_sql():
-    try:
-        # Read SQL commands from cmds.txt
-        cmds_file_path = os.path.join(os.path.dirname(__file__), 'cmds.txt')
-        with open(cmds_file_path, 'r') as file:
-            sql_commands = file.read()
-        
-        # Check which tables already exist
-        inspector = inspect(engine)
-        existing_tables = inspector.get_table_names()
-        print(f"Existing tables: {existing_tables}")
-        
-        # Split into individual commands and execute
-        conn = engine.connect()
-        commands = sql_commands.split(';')
-        
-        for command in commands:
-            if command.strip():
-                # Skip the CREATE DATABASE and USE commands as we've already set up the database connection
-                if command.strip().startswith('CREATE DATABASE') or command.strip().startswith('USE'):
-                    continue
-                
-                # Check if this is a CREATE TABLE command and extract the table name
-                create_match = re.search(r'CREATE TABLE\s+(\w+)', command, re.IGNORECASE)
-                if create_match:
-                    table_name = create_match.group(1).lower()
-                    # Skip if table already exists
-                    if table_name in [t.lower() for t in existing_tables]:
-                        print(f"Table '{table_name}' already exists, skipping creation")
-                        continue
-                
-                # Execute the command
-                try:
-                    conn.execute(text(command))
-                    print(f"Executed SQL: {command[:50]}...")
-                except Exception as e:
-                    print(f"Error executing SQL command: {e}")
-        
-        conn.commit()
-        conn.close()
-        print("Table creation process completed")
-        
-    except Exception as e:
-        print(f"Error creating tables from SQL: {e}")
-        # Fall back to SQLAlchemy metadata creation
-        models.Base.metadata.create_all(bind=engine)
-        print("Tables created using SQLAlchemy metadata")
-
-# Create database tables
-try:
-    create_tables_from_sql()
-except Exception as e:
-    print(f"Error during table creation: {e}")
-    # Fall back to SQLAlchemy metadata creation
-    models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
 
+# Per-route latency/status metrics and per-request SQL metrics, see GET /metrics
+app.middleware("http")(instrumentation.metrics_middleware)
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
@@ -80,8 +43,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[pagination.NEXT_CURSOR_HEADER, "ETag", idempotency.REPLAYED_HEADER],
 )
 
+# Admin checks with endpoint-specific error messages
+require_period_admin = membership.require_membership(admin=True, detail="Must be group admin to set settlement period")
+require_invite_admin = membership.require_membership(admin=True, detail="Must be group admin to retrieve invite code")
+
 def generate_invite_code():
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
 
@@ -107,29 +75,36 @@ def validate_period_format(period: str) -> bool:
     # Check if unit is valid
     return unit in ['h', 'd', 'w', 'm']
 
-# Authentication endpoints
+def find_user_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.Email == email).first()
+
+def save_user(db: Session, db_user: models.User) -> models.User:
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    return db_user
+
+# Authentication endpoints; bcrypt runs in the password pool and the queries
+# in the threadpool, so these two stay coroutines
 @app.post("/register", response_model=schemas.User)
 async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.Email == user.Email).first()
+    db_user = await run_blocking(find_user_by_email, db, user.Email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = get_password_hash(user.Password)
+    hashed_password = await get_password_hash_async(user.Password)
     db_user = models.User(
         Name=user.Name,
         Email=user.Email,
         Password=hashed_password,
         Phone=user.Phone
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await run_blocking(save_user, db, db_user)
 
 @app.post("/token")
 async def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.Email == user_data.Email).first()
-    if not user or not verify_password(user_data.Password, user.Password):
+    user = await run_blocking(find_user_by_email, db, user_data.Email)
+    if not user or not await verify_password_async(user_data.Password, user.Password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -152,7 +127,7 @@ async def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
 
 # Group endpoints
 @app.post("/groups", response_model=schemas.Group)
-async def create_group(
+def create_group(
     group: schemas.GroupCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -174,12 +149,14 @@ async def create_group(
         IsAdmin=True
     )
     db.add(group_member)
+    ledger.ensure_member(db, db_group.GroupID, current_user.UserID)
     db.commit()
+    membership.invalidate_memberships(current_user.UserID)
     
     return db_group
 
 @app.get("/groups", response_model=List[schemas.Group])
-async def get_user_groups(
+def get_user_groups(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -189,32 +166,98 @@ async def get_user_groups(
         .all()
     return member_groups
 
+DASHBOARD_ITEMS = 10
+
+@app.get("/me/dashboard", response_model=schemas.Dashboard)
+def get_dashboard(
+    limit: int = DASHBOARD_ITEMS,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Everything the dashboard shows on first paint: the user's groups with
+    their balance in each, recent expenses, pending settlements and the unread
+    notification count. The number of queries doesn't grow with the groups.
+    """
+    if limit < 1 or limit > pagination.MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {pagination.MAX_PAGE_SIZE}")
+    
+    user_groups = db.query(models.GroupMember.GroupID)\
+        .filter(models.GroupMember.UserID == current_user.UserID)\
+        .scalar_subquery()
+    groups = db.query(models.UserGroup)\
+        .filter(models.UserGroup.GroupID.in_(user_groups))\
+        .all()
+    group_names = {group.GroupID: group.GroupName for group in groups}
+    balances = ledger.get_user_balances(db, current_user.UserID)
+    last_activity = dict(
+        db.query(models.Expense.GroupID, func.max(models.Expense.Date))
+            .filter(models.Expense.GroupID.in_(user_groups))
+            .group_by(models.Expense.GroupID)
+            .all()
+    )
+    
+    # Latest expenses across all groups, paid by current members as on the group page
+    recent = db.query(models.Expense, models.User.Name)\
+        .join(models.User, models.User.UserID == models.Expense.PaidByUserID)\
+        .join(models.GroupMember,
+            (models.GroupMember.GroupID == models.Expense.GroupID) &
+            (models.GroupMember.UserID == models.Expense.PaidByUserID)
+        )\
+        .filter(models.Expense.GroupID.in_(user_groups))\
+        .order_by(models.Expense.Date.desc(), models.Expense.ExpenseID.desc())\
+        .limit(limit)\
+        .all()
+    
+    loader = loaders.NameLoader(db)
+    loader.prime_groups(group_names)
+    pending_settlements, _ = load_pending_settlements(db, current_user.UserID, limit, loader=loader)
+    
+    return {
+        "Groups": [
+            {
+                **schemas.Group.model_validate(group).model_dump(),
+                "MemberCount": balances.get(group.GroupID, {}).get("MemberCount", 0),
+                "NetBalance": balances.get(group.GroupID, {}).get("NetBalance", money.from_cents(0)),
+                "LastActivity": last_activity.get(group.GroupID)
+            }
+            for group in groups
+        ],
+        "RecentExpenses": [
+            {
+                "ExpenseID": expense.ExpenseID,
+                "GroupID": expense.GroupID,
+                "GroupName": group_names.get(expense.GroupID, "Unknown"),
+                "PaidByUserID": expense.PaidByUserID,
+                "PaidByName": payer_name,
+                "Amount": expense.Amount,
+                "Description": expense.Description,
+                "Date": expense.Date,
+                "IsSettled": expense.IsSettled
+            }
+            for expense, payer_name in recent
+        ],
+        "PendingSettlements": pending_settlements,
+        "UnreadNotifications": inbox.unread_count(db, current_user.UserID)
+    }
+
 # Expense endpoints
 @app.post("/expenses", response_model=schemas.ExpenseResponse)
-async def create_expense(
+@idempotency.idempotent(schemas.ExpenseResponse)
+def create_expense(
     expense: schemas.ExpenseCreate,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == expense.GroupID,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
+    membership.ensure_member(db, current_user.UserID, expense.GroupID)
 
     # Use current_user's ID if PaidByUserID is not provided
     paid_by_user_id = expense.PaidByUserID if expense.PaidByUserID is not None else current_user.UserID
     
     # Verify the PaidByUserID is also a member of the group
-    payer_member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == expense.GroupID,
-            models.GroupMember.UserID == paid_by_user_id
-        ).first()
-    if not payer_member:
+    if not membership.is_member(db, paid_by_user_id, expense.GroupID):
         raise HTTPException(status_code=400, detail="Payer must be a member of the group")
     
     db_expense = models.Expense(
@@ -222,12 +265,16 @@ async def create_expense(
         PaidByUserID=paid_by_user_id,
         Amount=expense.Amount,
         Description=expense.Description,
+        Date=datetime.utcnow(),
         IsSettled=False
     )
     
     try:
         db.add(db_expense)
-        db.commit()
+        ledger.record_expense(db, expense.GroupID, paid_by_user_id, db_expense.AmountCents)
+        analytics.record_expenses(db, [(expense.GroupID, paid_by_user_id, db_expense.Date, db_expense.AmountCents)])
+        group_versions.bump(db, expense.GroupID)
+        db.flush()  # Committed by the idempotency wrapper
         db.refresh(db_expense)
         
         # Get user details for the response
@@ -236,33 +283,62 @@ async def create_expense(
             .first()
             
         return {
-            **db_expense.__dict__,
+            **schemas.Expense.model_validate(db_expense).model_dump(),
             "PaidByUser": paid_by_user
         }
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/groups/{group_id}/expenses")
-async def get_group_expenses(
+@app.post("/groups/{group_id}/expenses/import", response_model=schemas.ExpenseImportResult)
+async def import_group_expenses(
     group_id: int,
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-    period: Optional[str] = None,
+    request: Request,
+    format: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print(f"Getting expenses for group {group_id}, user: {current_user.UserID} ({current_user.Name})")
+    """
+    Bulk import expenses from a streamed CSV or NDJSON body.
+    Valid rows are inserted in batches, invalid rows are reported per row
+    and a batch that fails to write is reported with its row range.
+    """
+    try:
+        import_format = expense_import.detect_format(request.headers.get("content-type"), format)
+    except expense_import.ImportFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     
-    # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
+    # One membership prefetch validates the caller and every payer
+    members = await run_blocking(expense_import.load_members, db, group_id)
+    if current_user.UserID not in members:
         raise HTTPException(status_code=403, detail="Not a member of this group")
     
+    try:
+        result = await expense_import.import_expenses(
+            db, group_id, current_user.UserID, request.stream(), import_format, members
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Import failed: {str(e)}")
+    
+    expense_import.logger.debug("Imported %s expenses into group %s, %s rows failed",
+                                result["Imported"], group_id, result["Failed"])
+    return result
+
+@app.get("/groups/{group_id}/expenses", dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get(skip_params=("period",))
+def get_group_expenses(
+    group_id: int,
+    request: Request,
+    response: Response,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    period: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
     # Modified query to include user details in a single query, properly scoped to the group
     query = db.query(models.Expense, models.User)\
         .join(models.User, models.User.UserID == models.Expense.PaidByUserID)\
@@ -273,8 +349,7 @@ async def get_group_expenses(
         .filter(
             models.Expense.GroupID == group_id,
             models.GroupMember.GroupID == group_id  # Ensure expenses are only from group members
-        )\
-        .order_by(models.Expense.Date.desc())
+        )
     
     if start_date:
         query = query.filter(models.Expense.Date >= start_date)
@@ -293,8 +368,11 @@ async def get_group_expenses(
         if start_date:
             query = query.filter(models.Expense.Date >= start_date)
     
-    results = query.all()
-    print(f"Found {len(results)} expenses")
+    # Newest first, one keyset page when limit/cursor is given
+    limit = pagination.page_size(limit, cursor)
+    query = pagination.keyset(query, models.Expense.Date, models.Expense.ExpenseID, cursor, limit)
+    results, next_cursor = pagination.split_page(query.all(), limit, lambda row: (row[0].Date, row[0].ExpenseID))
+    pagination.set_next_cursor(response, next_cursor)
     
     # Transform the results to include user details
     expenses = []
@@ -314,277 +392,157 @@ async def get_group_expenses(
                 "Phone": user.Phone
             }
         }
-        print(f"Expense {expense.ExpenseID}: {expense.Amount} paid by {user.Name} ({user.UserID})")
         expenses.append(expense_dict)
     
     return expenses
 
-@app.get("/groups/{group_id}/balances", response_model=schemas.GroupBalance)
-async def get_group_balances(
+@app.get("/groups/{group_id}/balances", response_model=schemas.GroupBalance, dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get()
+def get_group_balances(
     group_id: int,
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
     # Get group info
     group = db.query(models.UserGroup)\
-        .join(models.GroupMember)\
-        .filter(
-            models.UserGroup.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
+        .filter(models.UserGroup.GroupID == group_id)\
+        .first()
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
     
-    # Get all members of THIS group only
-    members = db.query(models.User)\
-        .join(models.GroupMember)\
-        .filter(models.GroupMember.GroupID == group_id)\
-        .all()
-    
-    member_balances = {}
-    for member in members:
-        member_balances[member.UserID] = {
-            "UserID": member.UserID,
-            "Name": member.Name,
-            "OwesAmount": Decimal("0"),
-            "IsOwedAmount": Decimal("0"),
-            "NetBalance": Decimal("0")
-        }
-    
-    # Calculate what each person paid ONLY for this group
-    paid_amounts = db.query(
-        models.Expense.PaidByUserID,
-        func.sum(models.Expense.Amount).label('total_paid')
-    ).join(
-        models.GroupMember,
-        (models.GroupMember.GroupID == models.Expense.GroupID) &
-        (models.GroupMember.UserID == models.Expense.PaidByUserID)
-    ).filter(
-        models.Expense.GroupID == group_id,
-        models.GroupMember.GroupID == group_id  # Additional check to ensure expenses are from group members
-    ).group_by(models.Expense.PaidByUserID).all()
-    
-    # Convert all amounts to Decimal for consistency
-    total_expenses = sum((Decimal(str(amount)) for _, amount in paid_amounts), Decimal('0'))
-    share_per_person = total_expenses / Decimal(str(len(members))) if members else Decimal('0')
-    
-    print(f"Total expenses: {total_expenses}, Share per person: {share_per_person}")
-    
-    # Initialize base balances - what they paid and their share
-    for user_id, amount_paid in paid_amounts:
-        amount_paid = Decimal(str(amount_paid))
-        member_balances[user_id]["IsOwedAmount"] = amount_paid
-        member_balances[user_id]["NetBalance"] = amount_paid - share_per_person
-        
-        print(f"User {user_id} paid {amount_paid}, balance: {member_balances[user_id]['NetBalance']}")
-    
-    # Make sure everyone who hasn't paid anything still has their share calculated
-    for member_id in member_balances:
-        if member_id not in [user_id for user_id, _ in paid_amounts]:
-            member_balances[member_id]["NetBalance"] = -share_per_person
-            print(f"User {member_id} paid nothing, balance: {member_balances[member_id]['NetBalance']}")
-    
-    # Update balances based on settlements (confirmed payments)
-    confirmed_settlements = db.query(models.Settlement)\
-        .filter(
-            models.Settlement.GroupID == group_id,
-            models.Settlement.Status == "Confirmed"
-        ).all()
-    
-    print(f"Found {len(confirmed_settlements)} confirmed settlements for group {group_id}")
-    
-    for settlement in confirmed_settlements:
-        payer_id = settlement.PayerUserID
-        receiver_id = settlement.ReceiverUserID
-        amount = Decimal(str(settlement.Amount))
-        
-        print(f"Settlement: {payer_id} paid {amount} to {receiver_id}")
-        
-        # Adjust balances for payer and receiver
-        if payer_id in member_balances:
-            member_balances[payer_id]["NetBalance"] += amount
-            print(f"After settlement, payer {payer_id} balance: {member_balances[payer_id]['NetBalance']}")
-            
-        if receiver_id in member_balances:
-            member_balances[receiver_id]["NetBalance"] -= amount
-            print(f"After settlement, receiver {receiver_id} balance: {member_balances[receiver_id]['NetBalance']}")
-    
-    # Now calculate OwesAmount and IsOwedAmount based on the final NetBalance
-    for member_id, balance_data in member_balances.items():
-        # Reset these values to recalculate them properly
-        balance_data["OwesAmount"] = Decimal("0")
-        balance_data["IsOwedAmount"] = Decimal("0")
-        
-        # If NetBalance is negative, they owe money
-        if balance_data["NetBalance"] < 0:
-            balance_data["OwesAmount"] = abs(balance_data["NetBalance"])
-        
-        # The IsOwedAmount should be what they paid (their contribution)
-        paid_amount = Decimal("0")
-        for user_id, amount in paid_amounts:
-            if user_id == member_id:
-                paid_amount = Decimal(str(amount))
-                break
-        
-        balance_data["IsOwedAmount"] = paid_amount
-        
-        print(f"Final for user {member_id}: Net={balance_data['NetBalance']}, " +
-              f"Owes={balance_data['OwesAmount']}, IsOwed={balance_data['IsOwedAmount']}")
+    # Balances are read from the materialized ledger, one row per member
+    member_balances = ledger.get_member_balances(db, group_id)
     
     return schemas.GroupBalance(
         GroupID=group_id,
         GroupName=group.GroupName,
-        Members=list(member_balances.values())
+        Members=member_balances
     )
 
+@app.get("/groups/{group_id}/analytics", response_model=schemas.GroupAnalytics, dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get()
+def get_group_analytics(
+    group_id: int,
+    request: Request,
+    response: Response,
+    granularity: str = "month",
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Spend per day, week or month and payer, from the incrementally maintained rollups"""
+    if granularity not in analytics.GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(analytics.GRANULARITIES)}")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+    
+    return analytics.group_spending(db, group_id, granularity, start_date, end_date, user_id)
+
 @app.post("/expenses/split", response_model=schemas.Expense)
-async def create_split_expense(
+@idempotency.idempotent(schemas.Expense)
+def create_split_expense(
     expense: schemas.SplitExpense,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    print(f"Creating split expense: {expense.model_dump()}")
-    print(f"Current user: {current_user.UserID} ({current_user.Name})")
-    
     # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == expense.GroupID,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
-    print(f"User {current_user.Name} is member of group {expense.GroupID}")
+    membership.ensure_member(db, current_user.UserID, expense.GroupID)
     
-    # Get total number of group members for equal split
-    member_count = db.query(models.GroupMember)\
-        .filter(models.GroupMember.GroupID == expense.GroupID)\
-        .count()
+    # One membership fetch serves the payer check and the split
+    member_ids = [user_id for (user_id,) in db.query(models.GroupMember.UserID)
+                  .filter(models.GroupMember.GroupID == expense.GroupID)
+                  .all()]
     
-    if not member_count:
-        raise HTTPException(status_code=400, detail="No members in group")
-    
-    print(f"Group has {member_count} members")
+    paid_by_user_id = expense.PaidByUserID if expense.PaidByUserID is not None else current_user.UserID
+    if paid_by_user_id not in member_ids:
+        raise HTTPException(status_code=400, detail="Payer must be a member of the group")
     
-    # Create the expense with the provided PaidByUserID
     db_expense = models.Expense(
         GroupID=expense.GroupID,
-        PaidByUserID=expense.PaidByUserID,  # Use the provided PaidByUserID
+        PaidByUserID=paid_by_user_id,
         Amount=expense.Amount,
-        Description=expense.Description
+        Description=expense.Description,
+        Date=datetime.utcnow(),
+        IsSettled=False
     )
-    print(f"Creating expense with PaidByUserID: {db_expense.PaidByUserID}")
-    
-    db.add(db_expense)
-    db.commit()
-    db.refresh(db_expense)
-    
-    # Create settlements based on split type
-    if expense.SplitType == "EQUAL":
-        share_amount = expense.Amount / member_count
-        print(f"Equal split: {share_amount} per member")
-        members = db.query(models.GroupMember)\
-            .filter(models.GroupMember.GroupID == expense.GroupID)\
-            .all()
-        
-        for member in members:
-            if member.UserID != db_expense.PaidByUserID:  # Compare with the expense's PaidByUserID
-                settlement = models.Settlement(
-                    GroupID=expense.GroupID,
-                    PayerUserID=member.UserID,
-                    ReceiverUserID=db_expense.PaidByUserID,
-                    Amount=share_amount
-                )
-                db.add(settlement)
-                print(f"Created settlement: {member.UserID} pays {share_amount} to {db_expense.PaidByUserID}")
+    try:
+        shares = expense_splits.compute_shares(expense.SplitType, db_expense.AmountCents, member_ids, expense.Splits)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    elif expense.SplitType == "PERCENTAGE" and expense.Splits:
-        total_percentage = sum(expense.Splits.values())
-        if abs(total_percentage - 100.0) > 0.01:
-            raise HTTPException(status_code=400, detail="Split percentages must sum to 100")
-            
-        for user_id, percentage in expense.Splits.items():
-            if user_id != db_expense.PaidByUserID:
-                amount = expense.Amount * (percentage / 100.0)
-                settlement = models.Settlement(
-                    GroupID=expense.GroupID,
-                    PayerUserID=user_id,
-                    ReceiverUserID=db_expense.PaidByUserID,
-                    Amount=amount
-                )
-                db.add(settlement)
-                print(f"Created percentage settlement: {user_id} pays {amount} to {db_expense.PaidByUserID}")
+    # Expense, settlements and ledger in one transaction
+    try:
+        expense_splits.create_split_expense(db, db_expense, shares)
+        db.flush()  # Committed by the idempotency wrapper
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Failed to save split expense: {str(e)}")
     
-    db.commit()
     return db_expense
 
 @app.get("/users/{user_id}/pending_settlements", response_model=List[schemas.DetailedSettlement])
-async def get_pending_settlements(
+def get_pending_settlements(
     user_id: int,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     if user_id != current_user.UserID:
         raise HTTPException(status_code=403, detail="Can only view your own settlements")
     
-    settlements = db.query(models.Settlement)\
-        .join(models.User, models.User.UserID == models.Settlement.PayerUserID)\
-        .add_columns(models.User.Name.label('PayerName'))\
-        .join(models.User, models.User.UserID == models.Settlement.ReceiverUserID, isouter=True)\
-        .add_columns(models.User.Name.label('ReceiverName'))\
-        .filter(
-            (models.Settlement.PayerUserID == user_id) | 
-            (models.Settlement.ReceiverUserID == user_id),
-            models.Settlement.Status == "Pending"
-        ).all()
-    
-    # Convert to DetailedSettlement objects
-    detailed_settlements = []
-    for settlement_tuple in settlements:
-        settlement, payer_name, receiver_name = settlement_tuple
-        detailed = schemas.DetailedSettlement(
-            **{k: v for k, v in settlement.__dict__.items() if not k.startswith('_')},
-            PayerName=payer_name,
-            ReceiverName=receiver_name
-        )
-        detailed_settlements.append(detailed)
-    
+    limit = pagination.page_size(limit, cursor)
+    detailed_settlements, next_cursor = load_pending_settlements(db, user_id, limit, cursor)
+    pagination.set_next_cursor(response, next_cursor)
     return detailed_settlements
 
+def load_pending_settlements(db: Session, user_id: int, limit: Optional[int], cursor: Optional[str] = None,
+                             loader: Optional[loaders.NameLoader] = None):
+    """Pending settlements the user pays or receives, newest first, with names"""
+    # One keyset query per side so each can use its (user, status, date) index
+    sides = []
+    for user_column in (models.Settlement.PayerUserID, models.Settlement.ReceiverUserID):
+        query = db.query(models.Settlement)\
+            .filter(
+                user_column == user_id,
+                models.Settlement.Status == "Pending"
+            )
+        sides.append(pagination.keyset(query, models.Settlement.Date, models.Settlement.SettlementID, cursor, limit).all())
+    
+    settlement_key = lambda settlement: (settlement.Date, settlement.SettlementID)
+    settlements = pagination.merge_pages(sides, limit, settlement_key)
+    settlements, next_cursor = pagination.split_page(settlements, limit, settlement_key)
+    
+    return loaders.detailed_settlements(loader or loaders.NameLoader(db), settlements), next_cursor
+
 # Settlement endpoints
 @app.post("/settlements", response_model=schemas.Settlement)
-async def create_settlement(
+@idempotency.idempotent(schemas.Settlement)
+def create_settlement(
     settlement: schemas.SettlementCreate,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == settlement.GroupID,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
+    membership.ensure_member(db, current_user.UserID, settlement.GroupID)
     
     db_settlement = models.Settlement(**settlement.model_dump())
     db.add(db_settlement)
-    db.commit()
+    settlement_totals.record_created(db, settlement.GroupID, [db_settlement.AmountCents])
+    group_versions.bump(db, settlement.GroupID)
+    db.flush()  # Committed by the idempotency wrapper
     db.refresh(db_settlement)
     return db_settlement
 
 @app.put("/settlements/{settlement_id}/confirm")
-async def confirm_settlement(
+def confirm_settlement(
     settlement_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
@@ -598,28 +556,32 @@ async def confirm_settlement(
     if settlement.ReceiverUserID != current_user.UserID:
         raise HTTPException(status_code=403, detail="Only the receiver can confirm the settlement")
     
-    settlement.Status = "Confirmed"
+    if settlement.Status == "Confirmed":
+        raise HTTPException(status_code=409, detail="Settlement has already been confirmed")
+    
+    # Conditional update; only one of several concurrent confirmations wins
+    if not settlement_status.confirm(db, settlement):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Settlement was changed by another request")
+    group_versions.bump(db, settlement.GroupID)
     db.commit()
     return {"message": "Settlement confirmed successfully"}
 
-@app.get("/groups/{group_id}/settlements/summary", response_model=schemas.SettlementSummary)
-async def get_settlements_summary(
+@app.get("/groups/{group_id}/settlements/summary", response_model=schemas.SettlementSummary, dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get(skip_params=("period",))
+def get_settlements_summary(
     group_id: int,
+    request: Request,
+    response: Response,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
     period: Optional[str] = None,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
+    """Total of the group's settlements and one page of them, newest first"""
     query = db.query(models.Settlement).filter(models.Settlement.GroupID == group_id)
     
     if start_date:
@@ -639,133 +601,138 @@ async def get_settlements_summary(
         if start_date:
             query = query.filter(models.Settlement.Date >= start_date)
     
-    settlements = query.all()
-    total_amount = sum(s.Amount for s in settlements)
+    if start_date or end_date:
+        # Summed in SQL over the same filters
+        total_cents = query.with_entities(func.coalesce(func.sum(models.Settlement.AmountCents), 0)).scalar()
+    else:
+        # All of the group's settlements, from the maintained total
+        total_cents = db.query(models.SettlementPeriod.TotalSettlementCents)\
+            .filter(models.SettlementPeriod.GroupID == group_id)\
+            .scalar() or 0
+    
+    # Only one page of rows, always; the rest via X-Next-Cursor or /groups/{group_id}/settlements
+    limit = pagination.page_size(limit, cursor) or pagination.DEFAULT_PAGE_SIZE
+    query = pagination.keyset(query, models.Settlement.Date, models.Settlement.SettlementID, cursor, limit)
+    settlements, next_cursor = pagination.split_page(
+        query.all(), limit, lambda settlement: (settlement.Date, settlement.SettlementID)
+    )
+    pagination.set_next_cursor(response, next_cursor)
     
     return schemas.SettlementSummary(
         Period=period or "custom",
-        TotalAmount=total_amount,
+        TotalAmount=money.from_cents(total_cents),
         Settlements=settlements
     )
 
+@app.get("/groups/{group_id}/settlements/pending", response_model=schemas.PendingSettlementSummary, dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get()
+def get_pending_settlements_summary(
+    group_id: int,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Unpaid settlement total and the last periodic settlement run, from the maintained totals"""
+    return settlement_totals.pending_summary(db, group_id)
+
+@app.get("/groups/{group_id}/settlement-batches", response_model=List[schemas.SettlementBatch], dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get()
+def get_settlement_batches(
+    group_id: int,
+    request: Request,
+    response: Response,
+    limit: int = pagination.DEFAULT_PAGE_SIZE,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Totals of the most recent periodic settlement runs, newest first"""
+    if limit < 1 or limit > pagination.MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {pagination.MAX_PAGE_SIZE}")
+    
+    batches = db.query(models.SettlementBatch)\
+        .filter(models.SettlementBatch.GroupID == group_id)\
+        .order_by(models.SettlementBatch.CreatedAt.desc())\
+        .limit(limit)\
+        .all()
+    return [settlement_totals.batch_summary(batch) for batch in batches]
+
+@app.get("/groups/{group_id}/settlement-batches/{batch_id}", response_model=schemas.SettlementBatch, dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get()
+def get_settlement_batch(
+    group_id: int,
+    batch_id: str,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    batch = db.query(models.SettlementBatch)\
+        .filter(
+            models.SettlementBatch.BatchID == batch_id,
+            models.SettlementBatch.GroupID == group_id
+        ).first()
+    if not batch:
+        raise HTTPException(status_code=404, detail="Settlement batch not found")
+    return settlement_totals.batch_summary(batch)
+
 @app.get("/settlements/history", response_model=List[schemas.DetailedSettlement])
-async def get_settlement_history(
+def get_settlement_history(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get settlement history for the current user"""
     user_id = current_user.UserID
     
-    # Get all settlements where the user is either payer or receiver
-    settlements = db.query(models.Settlement)\
-        .filter(
-            (models.Settlement.PayerUserID == user_id) | 
-            (models.Settlement.ReceiverUserID == user_id)
-        ).all()
-    
-    # Get the names of all users involved in these settlements
-    user_ids = set()
-    for settlement in settlements:
-        user_ids.add(settlement.PayerUserID)
-        user_ids.add(settlement.ReceiverUserID)
-    
-    users = db.query(models.User)\
-        .filter(models.User.UserID.in_(user_ids))\
-        .all()
-    
-    user_map = {user.UserID: user.Name for user in users}
-    
-    # Get group information
-    group_ids = set(settlement.GroupID for settlement in settlements)
-    groups = db.query(models.UserGroup)\
-        .filter(models.UserGroup.GroupID.in_(group_ids))\
-        .all()
-    
-    group_map = {group.GroupID: group.GroupName for group in groups}
+    # Get settlements where the user is either payer or receiver, one keyset query per side
+    limit = pagination.page_size(limit, cursor)
+    sides = []
+    for user_column in (models.Settlement.PayerUserID, models.Settlement.ReceiverUserID):
+        query = db.query(models.Settlement).filter(user_column == user_id)
+        sides.append(pagination.keyset(query, models.Settlement.Date, models.Settlement.SettlementID, cursor, limit).all())
     
-    # Build response with detailed settlements
-    detailed_settlements = []
-    for settlement in settlements:
-        detailed = {
-            **settlement.__dict__,
-            "PayerName": user_map.get(settlement.PayerUserID, "Unknown"),
-            "ReceiverName": user_map.get(settlement.ReceiverUserID, "Unknown"),
-            "GroupName": group_map.get(settlement.GroupID, "Unknown")
-        }
-        # Remove SQLAlchemy state
-        if "_sa_instance_state" in detailed:
-            detailed.pop("_sa_instance_state")
-            
-        detailed_settlements.append(detailed)
+    settlement_key = lambda settlement: (settlement.Date, settlement.SettlementID)
+    settlements = pagination.merge_pages(sides, limit, settlement_key)
+    settlements, next_cursor = pagination.split_page(settlements, limit, settlement_key)
+    pagination.set_next_cursor(response, next_cursor)
     
-    return detailed_settlements
+    return loaders.detailed_settlements(loaders.NameLoader(db), settlements)
 
-@app.get("/groups/{group_id}/settlements", response_model=List[schemas.DetailedSettlement])
-async def get_group_settlements(
+@app.get("/groups/{group_id}/settlements", response_model=List[schemas.DetailedSettlement], dependencies=[Depends(membership.require_member)])
+@group_versions.conditional_get()
+def get_group_settlements(
     group_id: int,
+    request: Request,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Get all settlements for a specific group"""
-    # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
-    # Get all settlements for the group
-    settlements = db.query(models.Settlement)\
-        .filter(models.Settlement.GroupID == group_id)\
-        .all()
-    
-    # Get all member names
-    user_ids = set()
-    for settlement in settlements:
-        user_ids.add(settlement.PayerUserID)
-        user_ids.add(settlement.ReceiverUserID)
-    
-    users = db.query(models.User)\
-        .filter(models.User.UserID.in_(user_ids))\
-        .all()
-    
-    user_map = {user.UserID: user.Name for user in users}
-    
-    # Build response with detailed settlements
-    detailed_settlements = []
-    for settlement in settlements:
-        detailed = {
-            **settlement.__dict__,
-            "PayerName": user_map.get(settlement.PayerUserID, "Unknown"),
-            "ReceiverName": user_map.get(settlement.ReceiverUserID, "Unknown"),
-            "GroupName": "Group" # Already filtered by group_id
-        }
-        # Remove SQLAlchemy state
-        if "_sa_instance_state" in detailed:
-            detailed.pop("_sa_instance_state")
-            
-        detailed_settlements.append(detailed)
+    # Get the settlements for the group, newest first
+    limit = pagination.page_size(limit, cursor)
+    query = db.query(models.Settlement).filter(models.Settlement.GroupID == group_id)
+    query = pagination.keyset(query, models.Settlement.Date, models.Settlement.SettlementID, cursor, limit)
+    settlements, next_cursor = pagination.split_page(
+        query.all(), limit, lambda settlement: (settlement.Date, settlement.SettlementID)
+    )
+    pagination.set_next_cursor(response, next_cursor)
     
-    return detailed_settlements
+    return loaders.detailed_settlements(loaders.NameLoader(db), settlements)
 
 # Invitation endpoints
 @app.post("/invitations", response_model=schemas.Invitation)
-async def create_invitation(
+def create_invitation(
     invitation: schemas.InvitationCreate,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     # Verify user is admin in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == invitation.GroupID,
-            models.GroupMember.UserID == current_user.UserID,
-            models.GroupMember.IsAdmin == True
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Must be group admin to send invitations")
+    membership.ensure_member(db, current_user.UserID, invitation.GroupID, detail="Must be group admin to send invitations", admin=True)
     
     db_invitation = models.Invitation(
         **invitation.model_dump(),
@@ -778,14 +745,12 @@ async def create_invitation(
     return db_invitation
 
 @app.post("/groups/join/{invite_code}")
-async def join_group(
+def join_group(
     invite_code: str,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     try:
-        print(f"User {current_user.Name} (ID: {current_user.UserID}) attempting to join group with code {invite_code}")
-        
         # Validate invite code format
         if not invite_code or len(invite_code) != 8:
             raise HTTPException(
@@ -803,17 +768,8 @@ async def join_group(
                 detail="Invalid invite code. Group not found."
             )
         
-        print(f"Found group: {group.GroupName} (ID: {group.GroupID})")
-        
         # Check if user is already a member
-        existing_member = db.query(models.GroupMember)\
-            .filter(
-                models.GroupMember.GroupID == group.GroupID,
-                models.GroupMember.UserID == current_user.UserID
-            ).first()
-            
-        if existing_member:
-            print(f"User is already a member of this group")
+        if membership.is_member(db, current_user.UserID, group.GroupID):
             return {
                 "message": "Already a member of this group",
                 "GroupID": group.GroupID
@@ -826,13 +782,14 @@ async def join_group(
             IsAdmin=False
         )
         db.add(new_member)
+        ledger.ensure_member(db, group.GroupID, current_user.UserID)
+        group_versions.bump(db, group.GroupID)
         
         try:
             db.commit()
-            print(f"Successfully added user to group")
+            membership.invalidate_memberships(current_user.UserID)
         except Exception as e:
             db.rollback()
-            print(f"Failed to add user to group: {str(e)}")
             raise HTTPException(
                 status_code=400,
                 detail=f"Failed to join group: {str(e)}"
@@ -846,29 +803,18 @@ async def join_group(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Unexpected error while joining group: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
-@app.post("/groups/{group_id}/settlement-period")
-async def set_settlement_period(
+@app.post("/groups/{group_id}/settlement-period", dependencies=[Depends(require_period_admin)])
+def set_settlement_period(
     group_id: int,
     period: str,  # "1h", "1d", "1w", "1m"
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Verify user is admin in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID,
-            models.GroupMember.IsAdmin == True
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Must be group admin to set settlement period")
-    
     # Validate period format
     if not validate_period_format(period):
         raise HTTPException(status_code=400, detail="Invalid period format. Use format like '1h', '1d', '1w', '1m'")
@@ -876,14 +822,7 @@ async def set_settlement_period(
     try:
         # Calculate next settlement time
         now = datetime.utcnow()
-        if period.endswith('h'):
-            next_settlement = now + timedelta(hours=int(period[:-1]))
-        elif period.endswith('d'):
-            next_settlement = now + timedelta(days=int(period[:-1]))
-        elif period.endswith('w'):
-            next_settlement = now + timedelta(weeks=int(period[:-1]))
-        elif period.endswith('m'):
-            next_settlement = now + timedelta(days=int(period[:-1]) * 30)
+        next_settlement = settlement_scheduler.next_settlement_time(period, now)
         
         db_period = db.query(models.SettlementPeriod)\
             .filter(models.SettlementPeriod.GroupID == group_id)\
@@ -900,7 +839,9 @@ async def set_settlement_period(
             )
             db.add(db_period)
         
+        group_versions.bump(db, group_id)
         db.commit()
+        scheduler.schedule(group_id, db_period.NextSettlement)
         return {"message": f"Settlement period set to {period}", "next_settlement": next_settlement}
     
     except Exception as e:
@@ -908,38 +849,115 @@ async def set_settlement_period(
         raise HTTPException(status_code=500, detail=f"Failed to update settlement period: {str(e)}")
 
 @app.get("/notifications", response_model=List[schemas.Notification])
-async def get_notifications(
+def get_notifications(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    notifications = db.query(models.Notification)\
+    limit = pagination.page_size(limit, cursor)
+    query = db.query(models.Notification)\
         .filter(
             models.Notification.UserID == current_user.UserID,
             models.Notification.IsRead == False
-        ).all()
+        )
+    query = pagination.keyset(query, models.Notification.CreatedAt, models.Notification.NotificationID, cursor, limit)
+    notifications, next_cursor = pagination.split_page(
+        query.all(), limit, lambda notification: (notification.CreatedAt, notification.NotificationID)
+    )
+    pagination.set_next_cursor(response, next_cursor)
     return notifications
 
+def open_notification_stream(token: str, last_event_id: Optional[int]):
+    # Short-lived session: the stream itself must not hold a pooled connection
+    db = SessionLocal()
+    try:
+        current_user = resolve_current_user(token, db)
+        backlog = []
+        if last_event_id is not None:
+            # Reconnecting client: unread notifications it hasn't seen yet
+            backlog = db.query(models.Notification)\
+                .filter(
+                    models.Notification.UserID == current_user.UserID,
+                    models.Notification.IsRead == False,
+                    models.Notification.NotificationID > last_event_id
+                )\
+                .order_by(models.Notification.NotificationID)\
+                .limit(notification_hub.NOTIFICATION_QUEUE_SIZE)\
+                .all()
+        return current_user, [notification_hub.notification_event(notification) for notification in backlog]
+    finally:
+        db.close()
+
+@app.get("/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    token: Optional[str] = None,
+    last_event_id: Optional[int] = Header(None)
+):
+    """
+    Server-sent events with the user's new notifications. EventSource can't
+    set headers, so the token may also be passed as ?token=.
+    """
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    current_user, backlog = await run_blocking(open_notification_stream, token, last_event_id)
+    return StreamingResponse(
+        notification_hub.hub.stream(current_user.UserID, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/notifications/unread-count", response_model=schemas.UnreadCount)
+def get_unread_count(
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return {"UnreadCount": inbox.unread_count(db, current_user.UserID)}
+
+@app.put("/notifications/read")
+def mark_notifications_read(
+    read: schemas.NotificationsRead,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """Mark the listed notifications, or all created up to Before, as read"""
+    if read.NotificationIDs is None and read.Before is None:
+        raise HTTPException(status_code=400, detail="Give NotificationIDs or Before")
+    
+    updated = inbox.mark_read(db, current_user.UserID, read.NotificationIDs, read.Before)
+    db.commit()
+    return {"message": f"{updated} notifications marked as read", "Updated": updated}
+
 @app.put("/notifications/{notification_id}/read")
-async def mark_notification_read(
+def mark_notification_read(
     notification_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    notification = db.query(models.Notification)\
-        .filter(
-            models.Notification.NotificationID == notification_id,
-            models.Notification.UserID == current_user.UserID
-        ).first()
-    
-    if not notification:
-        raise HTTPException(status_code=404, detail="Notification not found")
+    if not inbox.mark_read(db, current_user.UserID, [notification_id]):
+        exists = db.query(models.Notification.NotificationID)\
+            .filter(
+                models.Notification.NotificationID == notification_id,
+                models.Notification.UserID == current_user.UserID
+            ).first()
+        if not exists:
+            raise HTTPException(status_code=404, detail="Notification not found")
     
-    notification.IsRead = True
     db.commit()
     return {"message": "Notification marked as read"}
 
-@app.post("/groups/{group_id}/finalize-splits", response_model=List[schemas.DetailedSettlement])
-async def finalize_group_splits(
+@app.post("/groups/{group_id}/finalize-splits", response_model=List[schemas.DetailedSettlement], dependencies=[Depends(membership.require_member)])
+def finalize_group_splits(
     group_id: int,
     request: dict,
     db: Session = Depends(get_db),
@@ -950,23 +968,11 @@ async def finalize_group_splits(
     If include_all=True, return all potential settlements including ones not yet created.
     If force_create=True, create new settlements in the database.
     """
-    print(f"Finalizing splits for group {group_id}, request: {request}")
-    
-    # Verify user is in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Not a member of this group")
-    
     include_all = request.get('include_all', False)
     force_create = request.get('force_create', False)
-    
-    # Get current balances (these already account for confirmed settlements)
-    balances_response = await get_group_balances(group_id, db, current_user)
-    members = balances_response.Members
+    exact = request.get('exact')
+    if exact is not None and not isinstance(exact, bool):
+        raise HTTPException(status_code=400, detail="exact must be true, false or null")
     
     # Get group name
     group = db.query(models.UserGroup).filter(models.UserGroup.GroupID == group_id).first()
@@ -974,173 +980,82 @@ async def finalize_group_splits(
         raise HTTPException(status_code=404, detail="Group not found")
     group_name = group.GroupName
     
-    # Find members who owe money (negative balance) and who are owed money (positive balance)
-    debtors = [m for m in members if m.NetBalance < 0]
-    creditors = [m for m in members if m.NetBalance > 0]
-    
-    # Sort by amount (largest debt and credit first)
-    debtors.sort(key=lambda x: x.NetBalance)  # Ascending: most negative first
-    creditors.sort(key=lambda x: x.NetBalance, reverse=True)  # Descending: most positive first
+    # Get current balances (these already account for confirmed settlements)
+    members = ledger.get_member_net_cents(db, group_id)
+    names = {m["UserID"]: m["Name"] for m in members}
     
-    print(f"Debtors: {len(debtors)}, Creditors: {len(creditors)}")
-    for d in debtors:
-        print(f"Debtor: {d.Name} ({d.UserID}) owes ${abs(d.NetBalance)}")
-    for c in creditors:
-        print(f"Creditor: {c.Name} ({c.UserID}) is owed ${c.NetBalance}")
+    # Plan the transfers on integer cents (exact planner for small groups)
+    try:
+        transfers = settlement_planner.plan_settlements(
+            {m["UserID"]: m["NetCents"] for m in members},
+            exact=exact
+        )
+    except ValueError as e:
+        # Exact planning is limited to EXACT_MAX_PARTICIPANTS members with a balance
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Create settlements
     settlements = []
     due_date = datetime.utcnow() + timedelta(days=7)  # Default due date is a week from now
-
-    # Get ALL existing settlements for this group to avoid duplicates and consider confirmed ones
-    existing_settlements = db.query(models.Settlement)\
-        .filter(models.Settlement.GroupID == group_id)\
-        .all()
     
-    # Track existing settlement pairs (both pending and confirmed)
-    existing_pairs = {}
-    for settlement in existing_settlements:
-        pair_key = (settlement.PayerUserID, settlement.ReceiverUserID)
-        if pair_key not in existing_pairs:
-            existing_pairs[pair_key] = []
-        existing_pairs[pair_key].append({
-            "status": settlement.Status,
-            "amount": settlement.Amount,
-            "settlement": settlement
-        })
-    
-    # Track newly created settlements to avoid duplicates within this operation
-    new_settlement_pairs = set()
-    
-    for debtor in debtors:
-        remaining_debt = abs(debtor.NetBalance)
+    persisted = {}
+    if force_create and transfers:
+        # Write the whole plan in a single transaction
+        try:
+            persisted = settlement_planner.persist_plan(db, group_id, transfers, due_date)
+            group_versions.bump(db, group_id)
+            db.commit()
+        except settlement_status.SettlementConflict as e:
+            db.rollback()
+            raise HTTPException(status_code=409, detail=str(e))
+        except Exception as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=f"Failed to save settlements: {str(e)}")
+    
+    for transfer in transfers:
+        settlement_data = {
+            "GroupID": group_id,
+            "PayerUserID": transfer.PayerUserID,
+            "ReceiverUserID": transfer.ReceiverUserID,
+            "Amount": transfer.Amount,
+            "DueDate": due_date,
+            "Status": "Pending",
+            "PayerName": names.get(transfer.PayerUserID, "Unknown"),
+            "ReceiverName": names.get(transfer.ReceiverUserID, "Unknown"),
+            "GroupName": group_name  # Add the required GroupName field
+        }
         
-        # Skip if no debt
-        if remaining_debt < 0.01:
-            continue
-            
-        for creditor in creditors:
-            if remaining_debt < 0.01:
-                break
-                
-            # Skip if creditor has no credit left
-            if creditor.NetBalance < 0.01:
-                continue
-                
-            # Calculate how much can be settled
-            amount = min(remaining_debt, creditor.NetBalance)
-            
-            if amount < 0.01:
-                continue
-            
-            pair_key = (debtor.UserID, creditor.UserID)
-            
-            # Skip if there's already a confirmed settlement between these users from this operation
-            if pair_key in new_settlement_pairs:
-                print(f"Skipping duplicate settlement: {debtor.UserID} -> {creditor.UserID}")
-                continue
-            
-            # Check for existing settlements between these users
-            existing_pair_settlements = existing_pairs.get(pair_key, [])
-            pending_settlement = None
-            
-            # Find if there's a pending settlement we could update
-            for settlement_info in existing_pair_settlements:
-                if settlement_info["status"] == "Pending":
-                    pending_settlement = settlement_info["settlement"]
-                    break
-            
-            # Create or update settlement
-            settlement_data = {
-                "GroupID": group_id,
-                "PayerUserID": debtor.UserID,
-                "ReceiverUserID": creditor.UserID,
-                "Amount": amount,
-                "DueDate": due_date,
-                "Status": "Pending",
-                "PayerName": debtor.Name,
-                "ReceiverName": creditor.Name,
-                "GroupName": group_name  # Add the required GroupName field
-            }
-            
-            if force_create:
-                if pending_settlement:
-                    # Update existing pending settlement
-                    pending_settlement.Amount = amount
-                    pending_settlement.DueDate = due_date
-                    db.commit()
-                    db.refresh(pending_settlement)
-                    
-                    settlement_data["SettlementID"] = pending_settlement.SettlementID
-                    settlement_data["Date"] = pending_settlement.Date
-                else:
-                    # Create new settlement in database
-                    db_settlement = models.Settlement(
-                        GroupID=group_id,
-                        PayerUserID=debtor.UserID,
-                        ReceiverUserID=creditor.UserID,
-                        Amount=amount,
-                        DueDate=due_date,
-                        Status="Pending"
-                    )
-                    db.add(db_settlement)
-                    db.commit()
-                    db.refresh(db_settlement)
-                    
-                    settlement_data["SettlementID"] = db_settlement.SettlementID
-                    settlement_data["Date"] = db_settlement.Date
-                
-                # Remember this pair to avoid duplicates
-                new_settlement_pairs.add(pair_key)
-                
-            # Add to list of settlements to return
-            settlements.append(schemas.DetailedSettlement(**settlement_data))
-            
-            # Update remaining amounts for next iterations
-            remaining_debt -= amount
-            creditor.NetBalance -= amount
+        db_settlement = persisted.get((transfer.PayerUserID, transfer.ReceiverUserID))
+        if db_settlement:
+            settlement_data["SettlementID"] = db_settlement.SettlementID
+            settlement_data["Date"] = db_settlement.Date
+            settlement_data["DueDate"] = db_settlement.DueDate
+        
+        # Add to list of settlements to return
+        settlements.append(schemas.DetailedSettlement(**settlement_data))
     
     # If include_all flag is true, also include existing settlements
     if include_all:
-        for settlement in existing_settlements:
-            # Only include if we don't already have this settlement in our results
-            skip = False
-            for s in settlements:
-                if (hasattr(s, 'SettlementID') and s.SettlementID == settlement.SettlementID):
-                    skip = True
-                    break
-            
-            if skip:
-                continue
-                
-            # Get user names
-            payer = db.query(models.User).filter(models.User.UserID == settlement.PayerUserID).first()
-            receiver = db.query(models.User).filter(models.User.UserID == settlement.ReceiverUserID).first()
-            
-            settlement_data = {
-                "SettlementID": settlement.SettlementID,
-                "GroupID": settlement.GroupID,
-                "PayerUserID": settlement.PayerUserID,
-                "ReceiverUserID": settlement.ReceiverUserID,
-                "Amount": settlement.Amount,
-                "Date": settlement.Date,
-                "DueDate": settlement.DueDate,
-                "Status": settlement.Status,
-                "PaymentMethod": settlement.PaymentMethod,
-                "PaymentDate": settlement.PaymentDate,
-                "PayerName": payer.Name if payer else "Unknown",
-                "ReceiverName": receiver.Name if receiver else "Unknown",
-                "GroupName": group_name  # Add the required GroupName field
-            }
-            
-            settlements.append(schemas.DetailedSettlement(**settlement_data))
+        # Only include settlements we don't already have in our results
+        included = {s.SettlementID for s in settlements if s.SettlementID is not None}
+        existing_settlements = db.query(models.Settlement)\
+            .filter(models.Settlement.GroupID == group_id)\
+            .all()
+        loader = loaders.NameLoader(db)
+        loader.prime_groups({group_id: group_name})
+        settlements.extend(loaders.detailed_settlements(
+            loader,
+            [settlement for settlement in existing_settlements if settlement.SettlementID not in included]
+        ))
     
     return settlements
 
 @app.post("/settlements/{settlement_id}/process-payment")
-async def process_payment(
+@idempotency.idempotent()
+def process_payment(
     settlement_id: int,
     payment_data: schemas.PaymentProcess,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -1156,134 +1071,184 @@ async def process_payment(
         raise HTTPException(status_code=400, detail="Settlement has already been confirmed")
     
     # Verify payment amount matches settlement amount
-    if payment_data.amount != settlement.Amount:
+    if money.to_cents(payment_data.amount) != settlement.AmountCents:
         raise HTTPException(status_code=400, detail="Payment amount must match settlement amount")
     
-    # Update settlement status
-    settlement.Status = "Confirmed"
-    settlement.PaymentDate = datetime.utcnow()
+    # Conditional update; a concurrent payment or confirmation makes this one fail
+    if not settlement_status.confirm(db, settlement, payment_date=datetime.utcnow()):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Settlement was changed by another request")
     
     # Create notification for receiver
-    receiver = db.query(models.User)\
-        .filter(models.User.UserID == settlement.ReceiverUserID)\
-        .first()
-        
     notification = models.Notification(
         UserID=settlement.ReceiverUserID,
         Message=f"Payment of ${settlement.Amount:.2f} has been received from {current_user.Name}",
         Type="PAYMENT_RECEIVED"
     )
     db.add(notification)
+    inbox.record_created(db, [notification.UserID])
+    group_versions.bump(db, settlement.GroupID)
     
-    db.commit()
+    # Committed by the idempotency wrapper; the stream push waits for it
+    db.flush()
+    after_commit(db, notification_hub.hub.publish, notification.UserID, notification_hub.notification_event(notification))
     return {"message": "Payment processed successfully"}
 
-async def check_settlements(background_tasks: BackgroundTasks):
-    while True:
-        try:
-            db = next(get_db())
-            now = datetime.utcnow()
+def settle_due_group(group_id: int) -> Optional[datetime]:
+    """
+    Run the periodic settlement of one group in its own transaction.
+    Returns the group's next due time, or None if it has no period any more.
+    """
+    db = next(get_db())
+    try:
+        now = datetime.utcnow()
+        
+        # Lock the period row so concurrent workers don't settle the group twice
+        period = db.query(models.SettlementPeriod)\
+            .filter(models.SettlementPeriod.GroupID == group_id)\
+            .with_for_update()\
+            .first()
+        if not period or not period.NextSettlement:
+            return None
+        if period.NextSettlement > now:
+            # Already settled elsewhere, or the period was changed
+            return period.NextSettlement
+        
+        # Stored without microseconds, as DATETIME columns keep it
+        created_at = now.replace(microsecond=0)
+        events = []
+        
+        # What each member paid since the last run, up to a high-water mark so
+        # expenses added while this runs are left for the next run
+        paid_rows = db.query(
+                models.Expense.PaidByUserID,
+                func.sum(models.Expense.AmountCents),
+                func.max(models.Expense.ExpenseID)
+            )\
+            .filter(
+                models.Expense.GroupID == group_id,
+                models.Expense.IsSettled == False
+            )\
+            .group_by(models.Expense.PaidByUserID)\
+            .all()
+        
+        if paid_rows:
+            total_paid = {user_id: int(amount) for user_id, amount, _ in paid_rows}
+            last_expense_id = max(max_id for _, _, max_id in paid_rows)
             
-            # Find groups with due settlements
-            due_periods = db.query(models.SettlementPeriod)\
-                .filter(models.SettlementPeriod.NextSettlement <= now)\
-                .all()
+            member_ids = [user_id for (user_id,) in db.query(models.GroupMember.UserID)
+                          .filter(models.GroupMember.GroupID == group_id)
+                          .order_by(models.GroupMember.UserID)
+                          .all()]
             
-            for period in due_periods:
-                # Get all unsettled expenses in the group
-                expenses = db.query(models.Expense)\
-                    .filter(
-                        models.Expense.GroupID == period.GroupID,
-                        models.Expense.IsSettled == False
-                    ).all()
-                
-                if expenses:
-                    # Calculate total expenses and shares
-                    total_paid = {}  # who paid how much
-                    for expense in expenses:
-                        total_paid[expense.PaidByUserID] = total_paid.get(expense.PaidByUserID, 0) + expense.Amount
-                    
-                    # Get group members
-                    members = db.query(models.GroupMember)\
-                        .filter(models.GroupMember.GroupID == period.GroupID)\
-                        .all()
-                    
-                    # Calculate equal share per person
-                    total_amount = sum(total_paid.values())
-                    share_per_person = total_amount / len(members)
-                    
-                    # Create settlements and notifications
-                    for member in members:
-                        amount_paid = total_paid.get(member.UserID, 0)
-                        amount_owed = share_per_person - amount_paid
-                        
-                        if amount_owed > 0:  # This person needs to pay
-                            # Find who to pay to (person who paid the most)
-                            max_payer = max(total_paid.items(), key=lambda x: x[1])[0]
-                            
-                            # Create settlement
-                            settlement = models.Settlement(
-                                GroupID=period.GroupID,
-                                PayerUserID=member.UserID,
-                                ReceiverUserID=max_payer,
-                                Amount=amount_owed,
-                                Status='Pending',
-                                DueDate=now + timedelta(days=7)  # 1 week to pay
-                            )
-                            db.add(settlement)
-                            
-                            # Create notification for the payer
-                            notification = models.Notification(
-                                UserID=member.UserID,
-                                Message=f'You need to pay ${amount_owed:.2f} for group expenses',
-                                Type='SETTLEMENT_DUE'
-                            )
-                            db.add(notification)
-                    
-                    # Mark expenses as settled
-                    for expense in expenses:
-                        expense.IsSettled = True
-                
-                # Update next settlement time based on period
-                if period.Period.endswith('h'):
-                    period.NextSettlement = now + timedelta(hours=int(period.Period[:-1]))
-                elif period.Period.endswith('d'):
-                    period.NextSettlement = now + timedelta(days=int(period.Period[:-1]))
-                elif period.Period.endswith('w'):
-                    period.NextSettlement = now + timedelta(weeks=int(period.Period[:-1]))
-                elif period.Period.endswith('m'):
-                    period.NextSettlement = now + timedelta(days=int(period.Period[:-1]) * 30)
-                
-                period.LastSettlement = now
+            # Equal shares in cents; everyone who owes pays the person who paid the most
+            shares = money.split_equal(sum(total_paid.values()), len(member_ids))
+            max_payer = max(total_paid.items(), key=lambda x: x[1])[0]
+            due_date = now + timedelta(days=7)  # 1 week to pay
+            batch_id = settlement_totals.new_batch_id()
             
-            db.commit()
-        except Exception as e:
-            print(f"Error in settlement check: {e}")
-        finally:
-            db.close()
+            settlement_rows = []
+            notifications = []
+            for user_id, share in zip(member_ids, shares):
+                cents_owed = share - total_paid.get(user_id, 0)
+                if cents_owed > 0:  # This person needs to pay
+                    amount_owed = money.from_cents(cents_owed)
+                    settlement_rows.append({
+                        "GroupID": group_id,
+                        "PayerUserID": user_id,
+                        "ReceiverUserID": max_payer,
+                        "AmountCents": cents_owed,
+                        "Status": "Pending",
+                        "Date": now,
+                        "DueDate": due_date,
+                        "BatchID": batch_id
+                    })
+                    notifications.append(models.Notification(
+                        UserID=user_id,
+                        Message=f'You need to pay ${amount_owed:.2f} for group expenses',
+                        Type="SETTLEMENT_DUE",
+                        IsRead=False,
+                        CreatedAt=created_at
+                    ))
+            
+            if settlement_rows:
+                db.execute(insert(models.Settlement), settlement_rows)
+                # Added as objects so the flush hands back exactly this run's
+                # NotificationIDs for the stream (batched where the database
+                # supports INSERT ... RETURNING)
+                db.add_all(notifications)
+                db.flush()
+                inbox.record_created(db, [notification.UserID for notification in notifications])
+                events = [notification_hub.notification_event(notification) for notification in notifications]
+            
+            # Every run that settles expenses is a batch, even when nobody owes anything
+            settlement_totals.record_batch(db, period, batch_id, created_at, [row["AmountCents"] for row in settlement_rows])
+            
+            # Mark the aggregated expenses as settled in one statement
+            db.execute(
+                update(models.Expense)
+                .where(
+                    models.Expense.GroupID == group_id,
+                    models.Expense.IsSettled == False,
+                    models.Expense.ExpenseID <= last_expense_id
+                )
+                .values(IsSettled=True)
+                .execution_options(synchronize_session=False)
+            )
+        
+        # Update next settlement time based on period
+        period.NextSettlement = settlement_scheduler.next_settlement_time(period.Period, now)
+        period.LastSettlement = now
         
-        await asyncio.sleep(60)  # Check every minute
+        group_versions.bump(db, group_id)
+        db.commit()
+        notification_hub.hub.publish_many(events)
+        return period.NextSettlement
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def load_settlement_schedule():
+    db = next(get_db())
+    try:
+        scheduler.load(db)
+    finally:
+        db.close()
+
+scheduler = settlement_scheduler.SettlementScheduler(settle_due_group)
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(check_settlements(BackgroundTasks()))
+    # Schema bootstrap is "python roomiepay.py db init/upgrade"; workers only check the version
+    engine = get_engine()
+    instrumentation.instrument_engine(engine)
+    try:
+        await run_blocking(migrations.startup_schema_check, engine)
+    except Exception as e:
+        print(f"Error checking schema version: {e}")
+    await notification_hub.hub.start()
+    asyncio.create_task(scheduler.run(load_settlement_schedule))
+    asyncio.create_task(inbox.run_retention(SessionLocal))
+    asyncio.create_task(idempotency.run_sweeper(SessionLocal))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    scheduler.stop()
+    await notification_hub.hub.stop()
+    shutdown_password_pool()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return metrics.render_prometheus()
 
-@app.get("/groups/{group_id}/invite-code")
-async def get_group_invite_code(
+@app.get("/groups/{group_id}/invite-code", dependencies=[Depends(require_invite_admin)])
+def get_group_invite_code(
     group_id: int,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    # Verify user is admin in group
-    member = db.query(models.GroupMember)\
-        .filter(
-            models.GroupMember.GroupID == group_id,
-            models.GroupMember.UserID == current_user.UserID,
-            models.GroupMember.IsAdmin == True
-        ).first()
-    if not member:
-        raise HTTPException(status_code=403, detail="Must be group admin to retrieve invite code")
-    
     # Get the group
     group = db.query(models.UserGroup)\
         .filter(models.UserGroup.GroupID == group_id)\
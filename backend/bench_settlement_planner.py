@@ -0,0 +1,174 @@
+"""
+Benchmark the finalize-splits settlement planners on synthetic groups.
+
+Compares the legacy debtor x creditor loop that finalize_group_splits used to
+run against the heap-based greedy planner and, for small groups, the exact
+minimum-transfer planner. Each plan is also written to an in-memory SQLite
+database the way finalize-splits writes it: the legacy path loads the group's
+settlements and commits and refreshes every settlement on its own, the
+planners go through settlement_planner.persist_plan and one commit. The
+"create" phase writes the plan into a group without settlements, the "update"
+phase writes it again over the pending settlements it created. Reports the
+number of transfers, the SQL statements counted with an engine event (an
+executemany counts once), and the median planning and database wall time.
+
+Usage:
+    python bench_settlement_planner.py [--sizes 10 50 100 500 1000] [--runs 5] [--seed 42]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import group_versions
+import models
+import money
+import settlement_planner
+
+
+def legacy_plan(balances):
+    # The pre-planner algorithm from finalize_group_splits, without the DB writes
+    debtors = [[user_id, amount] for user_id, amount in balances.items() if amount < 0]
+    creditors = [[user_id, amount] for user_id, amount in balances.items() if amount > 0]
+    debtors.sort(key=lambda x: x[1])
+    creditors.sort(key=lambda x: x[1], reverse=True)
+
+    transfers = []
+    for debtor_id, debt in debtors:
+        remaining_debt = abs(debt)
+        if remaining_debt < 0.01:
+            continue
+        for creditor in creditors:
+            if remaining_debt < 0.01:
+                break
+            if creditor[1] < 0.01:
+                continue
+            amount = min(remaining_debt, creditor[1])
+            if amount < 0.01:
+                continue
+            transfers.append((debtor_id, creditor[0], amount))
+            remaining_debt -= amount
+            creditor[1] -= amount
+    return transfers
+
+
+def synthetic_group(members, rng):
+    # Equal-share net balances in cents, like ledger.get_member_net_cents produces them
+    paid = [rng.randint(0, 50000) for _ in range(members)]
+    shares = money.split_equal(sum(paid), members)
+    return {user_id: amount - share for user_id, (amount, share) in enumerate(zip(paid, shares), start=1)}
+
+
+def setup_group(session_factory, members):
+    db = session_factory()
+    db.add_all([models.User(UserID=user_id, Name=f"user{user_id}", Email=f"user{user_id}@example.com", Password="x")
+                for user_id in range(1, members + 1)])
+    db.add(models.UserGroup(GroupID=1, GroupName="bench", InviteCode="BENCH", CreatedByUserID=1))
+    db.add_all([models.GroupMember(UserID=user_id, GroupID=1) for user_id in range(1, members + 1)])
+    db.commit()
+    db.close()
+
+
+def legacy_persist(db, transfers, due_date):
+    # The pre-planner writes of finalize_group_splits with force_create
+    existing = db.query(models.Settlement).filter(models.Settlement.GroupID == 1).all()
+    pending = {}
+    for settlement in existing:
+        if settlement.Status == "Pending":
+            pending.setdefault((settlement.PayerUserID, settlement.ReceiverUserID), settlement)
+    for payer_id, receiver_id, amount in transfers:
+        settlement = pending.get((payer_id, receiver_id))
+        if settlement:
+            settlement.Amount = amount
+            settlement.DueDate = due_date
+        else:
+            settlement = models.Settlement(GroupID=1, PayerUserID=payer_id, ReceiverUserID=receiver_id,
+                                           Amount=amount, DueDate=due_date, Status="Pending")
+            db.add(settlement)
+        db.commit()
+        db.refresh(settlement)
+
+
+def planner_persist(db, transfers, due_date):
+    settlement_planner.persist_plan(db, 1, transfers, due_date)
+    group_versions.bump(db, 1)
+    db.commit()
+
+
+def run_once(plan, persist, balances, members):
+    """Plan and persist twice in a fresh database; returns the transfers and per-phase (statements, plan s, db s)"""
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    setup_group(session_factory, members)
+    statements = [0]
+    event.listen(engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+
+    phases = []
+    due_date = datetime.utcnow() + timedelta(days=7)
+    for _ in ("create", "update"):
+        start = time.perf_counter()
+        transfers = plan(balances)
+        planned = time.perf_counter()
+        db = session_factory()
+        statements[0] = 0
+        persist(db, transfers, due_date)
+        phases.append((statements[0], planned - start, time.perf_counter() - planned))
+        db.close()
+    engine.dispose()
+    return transfers, phases
+
+
+def timed(plan, persist, balances, members, runs):
+    samples = [run_once(plan, persist, balances, members) for _ in range(runs)]
+    transfers = samples[0][0]
+    phases = []
+    for phase in range(2):
+        statements = max(sample[1][phase][0] for sample in samples)
+        plan_ms = statistics.median(sample[1][phase][1] for sample in samples) * 1000
+        db_ms = statistics.median(sample[1][phase][2] for sample in samples) * 1000
+        phases.append((statements, plan_ms, db_ms))
+    return transfers, phases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 500, 1000])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    header = f"{'members':>8} {'planner':>8} {'phase':>7} {'transfers':>10} {'statements':>11} {'plan ms':>9} {'db ms':>9}"
+    print(header)
+    print("-" * len(header))
+
+    for size in args.sizes:
+        balances = synthetic_group(size, rng)
+        amounts = {user_id: money.from_cents(cents) for user_id, cents in balances.items()}
+
+        planners = [
+            ("legacy", lambda b: legacy_plan(amounts), legacy_persist),
+            ("greedy", lambda b: settlement_planner.plan_settlements(b, exact=False), planner_persist),
+        ]
+        if size <= settlement_planner.EXACT_MAX_PARTICIPANTS:
+            planners.append(("exact", lambda b: settlement_planner.plan_settlements(b, exact=True), planner_persist))
+
+        for name, plan, persist in planners:
+            transfers, phases = timed(plan, persist, balances, size, args.runs)
+            for phase, (statements, plan_ms, db_ms) in zip(("create", "update"), phases):
+                print(f"{size:>8} {name:>8} {phase:>7} {len(transfers):>10} {statements:>11} {plan_ms:>9.2f} {db_ms:>9.2f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
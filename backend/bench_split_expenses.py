@@ -0,0 +1,125 @@
+"""
+Benchmark split-expense creation on synthetic groups.
+
+Compares the legacy create_split_expense path (commit the expense, count the
+members, query them again and add one Settlement object per member before a
+second commit) against expense_splits, which fetches the members once and
+writes the expense, one multi-row INSERT of the shares and the ledger update
+in a single transaction. Runs against an in-memory SQLite database and
+reports the SQL statements and wall time per expense.
+
+Usage:
+    python bench_split_expenses.py [--sizes 10 100 1000] [--runs 5] [--split-type EQUAL]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import expense_splits
+import ledger
+import models
+import money
+
+
+def setup_group(session_factory, members):
+    db = session_factory()
+    db.add_all([models.User(UserID=user_id, Name=f"user{user_id}", Email=f"user{user_id}@example.com", Password="x")
+                for user_id in range(1, members + 1)])
+    db.add(models.UserGroup(GroupID=1, GroupName="bench", InviteCode="BENCH", CreatedByUserID=1))
+    db.add_all([models.GroupMember(UserID=user_id, GroupID=1) for user_id in range(1, members + 1)])
+    db.commit()
+    db.close()
+
+
+def legacy_split(db, amount, split_type, splits):
+    # The pre-rewrite create_split_expense, without the HTTP layer
+    db.query(models.GroupMember).filter(models.GroupMember.GroupID == 1).count()
+    expense = models.Expense(GroupID=1, PaidByUserID=1, Amount=amount, Description="bench")
+    db.add(expense)
+    ledger.record_expense(db, 1, 1, expense.AmountCents)
+    db.commit()
+    db.refresh(expense)
+
+    member_ids = [user_id for (user_id,) in db.query(models.GroupMember.UserID)
+                  .filter(models.GroupMember.GroupID == 1)
+                  .order_by(models.GroupMember.UserID)
+                  .all()]
+    shares = expense_splits.compute_shares(split_type, expense.AmountCents, member_ids, splits)
+    for user_id, share in shares.items():
+        if user_id != expense.PaidByUserID and share > 0:
+            db.add(models.Settlement(GroupID=1, PayerUserID=user_id, ReceiverUserID=1, AmountCents=share))
+    db.commit()
+
+
+def bulk_split(db, amount, split_type, splits):
+    member_ids = [user_id for (user_id,) in db.query(models.GroupMember.UserID)
+                  .filter(models.GroupMember.GroupID == 1)
+                  .all()]
+    expense = models.Expense(GroupID=1, PaidByUserID=1, Amount=amount, Description="bench", Date=datetime.utcnow(), IsSettled=False)
+    shares = expense_splits.compute_shares(split_type, expense.AmountCents, member_ids, splits)
+    expense_splits.create_split_expense(db, expense, shares)
+    db.commit()
+
+
+def synthetic_splits(split_type, members):
+    if split_type == "PERCENTAGE":
+        # Whole hundredths of a percent, the last member takes the rest
+        each = 10000 // members
+        values = [each] * (members - 1) + [10000 - each * (members - 1)]
+        return {user_id: money.from_cents(value) for user_id, value in enumerate(values, start=1)}
+    if split_type == "SHARES":
+        return {user_id: user_id % 3 + 1 for user_id in range(1, members + 1)}
+    return None
+
+
+def timed(func, session_factory, statements, runs, *args):
+    samples, counts = [], []
+    for _ in range(runs):
+        db = session_factory()
+        statements[0] = 0
+        start = time.perf_counter()
+        func(db, *args)
+        samples.append(time.perf_counter() - start)
+        counts.append(statements[0])
+        db.close()
+    return statistics.median(samples) * 1000, max(counts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--split-type", choices=["EQUAL", "PERCENTAGE", "SHARES"], default="EQUAL")
+    args = parser.parse_args(argv)
+
+    header = f"{'members':>8} {'path':>8} {'statements':>11} {'ms':>9}"
+    print(header)
+    print("-" * len(header))
+
+    for size in args.sizes:
+        engine = create_engine("sqlite://")
+        models.Base.metadata.create_all(engine)
+        statements = [0]
+        event.listen(engine, "before_cursor_execute", lambda *_: statements.__setitem__(0, statements[0] + 1))
+        session_factory = sessionmaker(bind=engine, autoflush=False)
+        setup_group(session_factory, size)
+
+        splits = synthetic_splits(args.split_type, size)
+        for name, func in (("legacy", legacy_split), ("bulk", bulk_split)):
+            ms, count = timed(func, session_factory, statements, args.runs, "1234.56", args.split_type, splits)
+            print(f"{size:>8} {name:>8} {count:>11} {ms:>9.2f}")
+        engine.dispose()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
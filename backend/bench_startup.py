@@ -0,0 +1,80 @@
+"""
+Measure how long a worker takes to import the application.
+
+Each run imports backend in a fresh interpreter (as a new uvicorn worker or a
+--reload would) and records the wall time of "import backend" plus the
+cumulative import time of every module, from python -X importtime. Reports
+the median over the runs, the slowest modules and whether the median stays
+within the budget; exits with status 1 when it does not.
+
+Importing backend must not touch the database, so the run works without one.
+
+Usage:
+    python bench_startup.py [--runs 5] [--budget-ms 1500] [--top 10]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+PROBE = (
+    "import time; start = time.perf_counter(); import backend; "
+    "print('IMPORT_MS', (time.perf_counter() - start) * 1000)"
+)
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def run_once():
+    environment = dict(os.environ)
+    environment.setdefault("SECRET_KEY", "bench")
+    environment.setdefault("ALGORITHM", "HS256")
+    environment.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=environment, capture_output=True, text=True, check=True
+    )
+    import_ms = float(re.search(r"IMPORT_MS ([\d.]+)", result.stdout).group(1))
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2)) / 1000  # cumulative, in ms
+    return import_ms, modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    samples = []
+    module_samples = {}
+    for _ in range(args.runs):
+        import_ms, modules = run_once()
+        samples.append(import_ms)
+        for name, cumulative_ms in modules.items():
+            module_samples.setdefault(name, []).append(cumulative_ms)
+
+    median_ms = statistics.median(samples)
+    print(f"import backend: median {median_ms:.0f} ms, min {min(samples):.0f} ms, max {max(samples):.0f} ms ({args.runs} runs)")
+
+    print(f"\nSlowest top-level imports (median cumulative ms):")
+    slowest = sorted(module_samples.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, values in [item for item in slowest if "." not in item[0]][:args.top]:
+        print(f"  {statistics.median(values):>8.1f}  {name}")
+
+    within = median_ms <= args.budget_ms
+    print(f"\nBudget {args.budget_ms:.0f} ms: {'OK' if within else 'EXCEEDED'}")
+    return 0 if within else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
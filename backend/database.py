@@ -1,10 +1,11 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 import urllib.parse
-import pymysql
+import threading
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 
@@ -24,8 +25,10 @@ if needs_encoding:
 else:
     encoded_password = DB_PASSWORD
 
-# Create database if it doesn't exist
+# Create database if it doesn't exist; run by "roomiepay.py db init", not on import
 def create_database():
+    import pymysql
+
     try:
         # Create a connection without specifying a database
         connection = pymysql.connect(
@@ -49,73 +52,99 @@ def create_database():
         print(f"Error creating database: {e}")
         raise
 
-# Fix missing columns in tables that already exist
-def fix_database_schema():
-    try:
-        # Create a connection to the database
-        connection = pymysql.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
+# DATABASE_URL overrides the MySQL settings above, e.g. "sqlite:///./roomiepay.db" for local runs
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+# Now create the SQLAlchemy connection URL with the database
+SQLALCHEMY_DATABASE_URL = DATABASE_URL or f"mysql+pymysql://{DB_USER}:{encoded_password}@{DB_HOST}/{DB_NAME}"
+
+# Connection pool settings. Every worker process has its own pool, so the
+# database must accept workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds; keep below MySQL's wait_timeout
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no')
+
+def engine_options(url: str) -> dict:
+    options = {
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    # In-memory SQLite uses a single shared connection and takes no pool sizing
+    if not (url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":"))):
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
         )
-        
-        cursor = connection.cursor()
-        
-        # Check if SettlementPeriods table needs updating
-        cursor.execute("SHOW COLUMNS FROM SettlementPeriods LIKE 'TotalPendingAmount'")
-        if not cursor.fetchone():
-            print("Adding missing columns to SettlementPeriods table...")
-            cursor.execute("ALTER TABLE SettlementPeriods ADD COLUMN TotalPendingAmount DECIMAL(10,2) DEFAULT 0")
-            cursor.execute("ALTER TABLE SettlementPeriods ADD COLUMN LastBatchID VARCHAR(36)")
-            print("Added missing columns to SettlementPeriods table")
-            
-        # Check if Settlements table needs updating
-        cursor.execute("SHOW COLUMNS FROM Settlements LIKE 'DueDate'")
-        if not cursor.fetchone():
-            print("Adding missing columns to Settlements table...")
-            cursor.execute("ALTER TABLE Settlements ADD COLUMN DueDate DATETIME")
-            cursor.execute("ALTER TABLE Settlements ADD COLUMN PaymentDate DATETIME")
-            print("Added missing columns to Settlements table")
-
-        # Check if Notifications table exists
-        cursor.execute("SHOW TABLES LIKE 'Notifications'")
-        if not cursor.fetchone():
-            print("Creating Notifications table...")
-            cursor.execute("""
-            CREATE TABLE Notifications (
-                NotificationID INT AUTO_INCREMENT PRIMARY KEY,
-                UserID INT NOT NULL,
-                Message TEXT NOT NULL,
-                Type VARCHAR(50) NOT NULL,
-                IsRead BOOLEAN NOT NULL DEFAULT FALSE,
-                CreatedAt DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (UserID) REFERENCES Users(UserID) ON DELETE CASCADE
-            )
-            """)
-            print("Created Notifications table")
+    return options
 
-        connection.commit()
-        cursor.close()
-        connection.close()
-        
-        print("Database schema fixes applied successfully.")
-        
-    except Exception as e:
-        print(f"Error fixing database schema: {e}")
+# Importing this module has no side effects: the engine (and with it the
+# database driver) is only created on first use, and schema bootstrap is done
+# by "python roomiepay.py db init/upgrade".
+_engine = None
+_engine_lock = threading.Lock()
+_sessionmaker = sessionmaker(autocommit=False, autoflush=False)
 
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+                _sessionmaker.configure(bind=_engine)
+    return _engine
 
-# Create the database before establishing the SQLAlchemy connection
-create_database()
+def SessionLocal():
+    get_engine()
+    return _sessionmaker()
 
-# Apply any needed fixes to the database schema
-fix_database_schema()
+def __getattr__(name):
+    # Keeps "from database import engine" working, building the engine on first access
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Now create the SQLAlchemy connection URL with the database
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{encoded_password}@{DB_HOST}/{DB_NAME}"
+# Work that must only happen once a write is durable (e.g. pushing a
+# notification to live streams) is queued on the session with after_commit
+# and run after its next successful commit; a rollback drops it.
+def after_commit(db, func, *args):
+    db.info.setdefault("after_commit", []).append((func, args))
+
+@event.listens_for(_sessionmaker, "after_commit")
+def _run_after_commit(session):
+    for func, args in session.info.pop("after_commit", []):
+        func(*args)
+
+@event.listens_for(_sessionmaker, "after_rollback")
+def _drop_after_commit(session):
+    session.info.pop("after_commit", None)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Counter rows (ledger balances, unread counts) are changed with one upsert:
+# the row is inserted with the increments as its values, or the increments are
+# added to the existing row. Two writers creating the same row never race into
+# a duplicate key error and never lose each other's increments.
+def increment_row(db, model, keys: dict, increments: dict):
+    table = model.__table__
+    statement_values = {**keys, **increments}
+    if db.get_bind().dialect.name == "mysql":
+        from sqlalchemy.dialects.mysql import insert as upsert
+        statement = upsert(table).values(statement_values)
+        statement = statement.on_duplicate_key_update({
+            name: table.c[name] + statement.inserted[name] for name in increments
+        })
+    else:
+        if db.get_bind().dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        statement = upsert(table).values(statement_values)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + statement.excluded[name] for name in increments}
+        )
+    db.execute(statement)
 
 Base = declarative_base()
 
@@ -126,3 +155,13 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Handlers that use the synchronous Session are plain functions, which FastAPI
+# runs in its threadpool (as it does the get_db dependency), so a slow query
+# only blocks its own thread and never the event loop. Coroutines that have to
+# stay async (streamed bodies, notification streams, password hashing, the
+# background jobs) hand their database work to the same threadpool.
+
+async def run_blocking(func, *args, **kwargs):
+    """Run blocking database work from a coroutine in the threadpool"""
+    return await run_in_threadpool(func, *args, **kwargs)
@@ -0,0 +1,250 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from typing import AsyncIterator, Dict, List, Optional
+from decimal import Decimal, InvalidOperation
+from datetime import datetime
+import codecs
+import csv
+import json
+import logging
+import os
+import models
+import ledger
+import analytics
+import money
+import group_versions
+from database import run_blocking
+
+# Streaming bulk expense import.
+#
+# The request body is consumed line by line, so memory use is bounded by the
+# batch size rather than the file size. Payers are validated against a single
+# prefetch of the group's members, valid rows are inserted with one
+# executemany per batch (together with the matching ledger updates) and
+# invalid rows are reported back with their row number. Each batch is its own
+# transaction: a batch that fails to write is rolled back and reported with
+# its row range, and the import carries on with the next one, so Imported
+# always counts exactly the rows that were committed.
+#
+# Accepted formats:
+#   CSV    - header row with Amount, Description and optionally PaidByUserID or
+#            PaidByEmail and Date (ISO 8601). Quoted fields must not span lines.
+#   NDJSON - one JSON object per line with the same keys.
+# Rows without a payer are attributed to the importing user.
+
+IMPORT_BATCH_SIZE = int(os.getenv("EXPENSE_IMPORT_BATCH_SIZE", "1000"))
+MAX_REPORTED_ERRORS = int(os.getenv("EXPENSE_IMPORT_MAX_ERRORS", "1000"))
+
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(content_type: Optional[str], requested: Optional[str] = None) -> str:
+    if requested:
+        if requested.lower() not in ("csv", "ndjson"):
+            raise ImportFormatError("format must be 'csv' or 'ndjson'")
+        return requested.lower()
+
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in CSV_CONTENT_TYPES:
+        return "csv"
+    if media_type in NDJSON_CONTENT_TYPES:
+        return "ndjson"
+    raise ImportFormatError("Unsupported Content-Type, send text/csv or application/x-ndjson")
+
+
+# Import summaries go to the "roomiepay.expense_import" logger at DEBUG;
+# enable that level when tracing imports
+logger = logging.getLogger("roomiepay.expense_import")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Incremental decoding so multi-byte characters split across chunks survive
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_records(lines: AsyncIterator[str], import_format: str):
+    """Yield (row_number, record, error) for every non-blank data line"""
+    header = None
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+
+        if import_format == "csv":
+            if header is None:
+                header = [column.strip() for column in next(csv.reader([line]))]
+                continue
+            row_number += 1
+            values = next(csv.reader([line]))
+            if len(values) != len(header):
+                yield row_number, None, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            yield row_number, dict(zip(header, values)), None
+        else:
+            row_number += 1
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield row_number, None, "Each line must be a JSON object"
+                continue
+            yield row_number, record, None
+
+
+def load_members(db: Session, group_id: int) -> Dict[int, str]:
+    """Prefetch the group's members once, as UserID -> lowercased Email"""
+    rows = db.query(models.User.UserID, models.User.Email)\
+        .join(models.GroupMember, models.GroupMember.UserID == models.User.UserID)\
+        .filter(models.GroupMember.GroupID == group_id)\
+        .all()
+    return {user_id: email.lower() for user_id, email in rows}
+
+
+def _blank(value) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def validate_record(record: dict, group_id: int, default_payer_id: int,
+                    members: Dict[int, str], members_by_email: Dict[str, int]) -> dict:
+    """Turn a parsed record into an Expenses row, raising ValueError when invalid"""
+    try:
+        amount = Decimal(str(record.get("Amount", "")).strip())
+    except InvalidOperation:
+        raise ValueError("Amount must be a number")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError("Amount must be greater than zero")
+    if amount != money.quantize(amount):
+        raise ValueError("Amount can have at most two decimal places")
+
+    description = record.get("Description")
+    if _blank(description):
+        raise ValueError("Description is required")
+    description = str(description).strip()
+    if len(description) > 255:
+        raise ValueError("Description must be at most 255 characters")
+
+    if not _blank(record.get("PaidByUserID")):
+        try:
+            payer_id = int(record["PaidByUserID"])
+        except (TypeError, ValueError):
+            raise ValueError("PaidByUserID must be an integer")
+        if payer_id not in members:
+            raise ValueError(f"Payer {payer_id} is not a member of the group")
+    elif not _blank(record.get("PaidByEmail")):
+        payer_id = members_by_email.get(str(record["PaidByEmail"]).strip().lower())
+        if payer_id is None:
+            raise ValueError(f"Payer {record['PaidByEmail']} is not a member of the group")
+    else:
+        payer_id = default_payer_id
+
+    if not _blank(record.get("Date")):
+        try:
+            date = datetime.fromisoformat(str(record["Date"]).strip())
+        except ValueError:
+            raise ValueError("Date must be an ISO 8601 date or datetime")
+    else:
+        date = datetime.utcnow()
+
+    return {
+        "GroupID": group_id,
+        "PaidByUserID": payer_id,
+        "AmountCents": money.to_cents(amount),
+        "Description": description,
+        "Date": date,
+        "IsSettled": False
+    }
+
+
+def write_batch(db: Session, group_id: int, rows: List[dict]):
+    """Insert one batch and its ledger and analytics updates in a single transaction"""
+    try:
+        db.execute(insert(models.Expense), rows)
+
+        paid_by = {}
+        for row in rows:
+            paid_by[row["PaidByUserID"]] = paid_by.get(row["PaidByUserID"], 0) + row["AmountCents"]
+        for user_id, amount_cents in paid_by.items():
+            ledger.record_expense(db, group_id, user_id, amount_cents)
+        analytics.record_expenses(db, [(group_id, row["PaidByUserID"], row["Date"], row["AmountCents"]) for row in rows])
+        group_versions.bump(db, group_id)
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+async def import_expenses(db: Session, group_id: int, current_user_id: int,
+                          chunks: AsyncIterator[bytes], import_format: str,
+                          members: Dict[int, str]) -> dict:
+    members_by_email = {email: user_id for user_id, email in members.items()}
+
+    imported = 0
+    failed = 0
+    errors = []
+    batch = []
+    first_row = None
+    row_number = 0
+
+    def record_error(row_number, message, last_row=None):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"Row": row_number, "LastRow": last_row, "Error": message})
+
+    async def flush(last_row):
+        nonlocal imported, failed, batch
+        try:
+            await run_blocking(write_batch, db, group_id, batch)
+            imported += len(batch)
+        except Exception as e:
+            # Earlier batches stay committed; report this one and carry on
+            failed += len(batch)
+            record_error(first_row, f"Batch not imported: {e}", last_row)
+        batch = []
+
+    try:
+        async for row_number, record, error in iter_records(iter_lines(chunks), import_format):
+            if error is None:
+                try:
+                    batch.append(validate_record(record, group_id, current_user_id, members, members_by_email))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                failed += 1
+                record_error(row_number, error)
+                continue
+
+            if len(batch) == 1:
+                first_row = row_number
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush(row_number)
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Unreadable body: keep what was read so far and report where it stopped
+        failed += 1
+        record_error(row_number + 1, f"Import stopped: {e}")
+
+    if batch:
+        await flush(row_number)
+
+    return {
+        "GroupID": group_id,
+        "Imported": imported,
+        "Failed": failed,
+        "Errors": errors,
+        "ErrorsTruncated": failed > len(errors)
+    }
@@ -0,0 +1,95 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import insert
+from typing import Dict, List, Optional
+from decimal import Decimal
+from datetime import datetime, timedelta
+import models
+import money
+import ledger
+import analytics
+import settlement_totals
+import group_versions
+
+# Split expenses.
+#
+# An expense is split into integer-cent shares that always add up to the
+# exact amount (see money.py), and every participant other than the payer
+# gets a pending settlement for their share. The expense, its settlements and
+# the ledger update are written in one transaction, the settlements with a
+# single multi-row INSERT, so a failure never leaves an expense without its
+# shares. Split types, with Splits mapping UserID to a value:
+#   - EQUAL: equal shares between the given users, or all members without Splits
+#   - PERCENTAGE: percentages that sum to 100
+#   - EXACT: amounts that sum to the expense amount
+#   - SHARES: relative weights, e.g. {1: 2, 2: 1} pays two thirds and one third
+
+SPLIT_TYPES = ("EQUAL", "PERCENTAGE", "EXACT", "SHARES")
+
+SPLIT_DUE_DAYS = 7  # Settlements of a split expense are due a week later, like finalize-splits
+
+
+def compute_shares(split_type: str, amount_cents: int, member_ids: List[int],
+                   splits: Optional[Dict[int, Decimal]] = None) -> Dict[int, int]:
+    """
+    Split amount_cents between group members, in UserID order so the odd cents
+    always go to the same people. Raises ValueError for invalid splits.
+    """
+    if split_type not in SPLIT_TYPES:
+        raise ValueError(f"SplitType must be one of {', '.join(SPLIT_TYPES)}")
+    if split_type != "EQUAL" and not splits:
+        raise ValueError(f"{split_type} splits need Splits")
+
+    splits = dict(sorted((splits or {}).items()))
+    outsiders = set(splits) - set(member_ids)
+    if outsiders:
+        raise ValueError(f"Users {sorted(outsiders)} are not members of the group")
+    if any(value < 0 for value in splits.values()):
+        raise ValueError("Split values can't be negative")
+
+    if split_type == "EQUAL":
+        user_ids = list(splits) or sorted(member_ids)
+        return dict(zip(user_ids, money.split_equal(amount_cents, len(user_ids))))
+
+    # Percentages and share counts are weighted in hundredths, amounts in cents
+    weights = {user_id: money.to_cents(value) for user_id, value in splits.items()}
+    if split_type == "PERCENTAGE":
+        if abs(sum(weights.values()) - 10000) > 1:
+            raise ValueError("Split percentages must sum to 100")
+    elif split_type == "EXACT":
+        if sum(weights.values()) != amount_cents:
+            raise ValueError(f"Split amounts must sum to {money.from_cents(amount_cents)}")
+        return weights
+    elif not sum(weights.values()):
+        raise ValueError("Split shares must not all be zero")
+    return dict(zip(weights, money.allocate(amount_cents, list(weights.values()))))
+
+
+def create_split_expense(db: Session, expense: models.Expense, shares: Dict[int, int]) -> models.Expense:
+    """
+    Write the expense, one pending settlement per non-zero share owed to the
+    payer and the ledger, analytics and pending total updates. The caller commits.
+    """
+    db.add(expense)
+    db.flush()
+
+    due_date = datetime.utcnow().replace(microsecond=0) + timedelta(days=SPLIT_DUE_DAYS)
+    settlement_rows = [
+        {
+            "GroupID": expense.GroupID,
+            "PayerUserID": user_id,
+            "ReceiverUserID": expense.PaidByUserID,
+            "AmountCents": share,
+            "Status": "Pending",
+            "DueDate": due_date
+        }
+        for user_id, share in shares.items()
+        if user_id != expense.PaidByUserID and share > 0
+    ]
+    if settlement_rows:
+        db.execute(insert(models.Settlement), settlement_rows)
+        settlement_totals.record_created(db, expense.GroupID, [row["AmountCents"] for row in settlement_rows])
+
+    ledger.record_expense(db, expense.GroupID, expense.PaidByUserID, expense.AmountCents)
+    analytics.record_expenses(db, [(expense.GroupID, expense.PaidByUserID, expense.Date, expense.AmountCents)])
+    group_versions.bump(db, expense.GroupID)
+    return expense
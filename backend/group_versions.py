@@ -0,0 +1,141 @@
+from fastapi import Response
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from typing import Optional
+import functools
+import hashlib
+import os
+import threading
+import metrics
+import models
+
+# Per-group change versions for conditional GETs.
+#
+# UserGroups.Version is incremented by every write that changes what the
+# group-scoped GET endpoints return (expenses, settlements, payments,
+# membership, periodic settlement runs), in the same transaction as the write.
+# A group GET first reads the version with a primary key lookup and derives a
+# weak ETag from it; a request whose If-None-Match still matches gets a 304
+# without running the handler's queries. Otherwise the handler's result is
+# served from an in-process cache keyed by request and user when it was
+# produced at the current version, and computed (and cached) when not.
+#
+# The version lives in the database, so workers never serve a stale cached
+# response: a write made through another worker changes the version every
+# worker reads.
+
+GROUP_CACHE_SIZE = int(os.getenv("GROUP_CACHE_SIZE", "1000"))  # cached responses per worker, 0 disables
+
+group_cache_requests = metrics.Counter(
+    "roomiepay_group_cache_requests_total",
+    "Group-scoped GETs by outcome: not_modified (304), hit or miss",
+    labels=("result",)
+)
+
+
+def bump(db: Session, group_id: int):
+    """Mark the group as changed; call before committing the write"""
+    # Relative UPDATE so concurrent writers each get their own increment
+    db.query(models.UserGroup)\
+        .filter(models.UserGroup.GroupID == group_id)\
+        .update({models.UserGroup.Version: models.UserGroup.Version + 1}, synchronize_session=False)
+
+
+def current_version(db: Session, group_id: int) -> Optional[int]:
+    return db.query(models.UserGroup.Version)\
+        .filter(models.UserGroup.GroupID == group_id)\
+        .scalar()
+
+
+def make_etag(group_id: int, version: int, variant: str) -> str:
+    # The variant (path, query and user) keeps different views of a group apart
+    digest = hashlib.sha1(variant.encode()).hexdigest()[:12]
+    return f'W/"{group_id}.{version}.{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" are the same
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return etag.replace("W/", "") in [tag.replace("W/", "") for tag in tags]
+
+
+class ResponseCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (version, result, headers)
+        self._lock = threading.Lock()
+
+    def get(self, key, version: int):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version: int, result, headers: dict):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, result, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache(GROUP_CACHE_SIZE)
+
+# Response headers set by handlers that belong to the cached result
+CACHED_HEADERS = ("x-next-cursor",)
+
+
+def conditional_get(skip_params=()):
+    """
+    Decorate a (sync) group GET handler with group_id, request, response, db and
+    current_user parameters to answer with ETag/304 and the response cache.
+    Requests using any of skip_params (e.g. a period relative to now) depend
+    on more than the version and are passed straight to the handler.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            request = kwargs["request"]
+            if any(param in request.query_params for param in skip_params):
+                return handler(*args, **kwargs)
+
+            group_id = kwargs["group_id"]
+            version = current_version(kwargs["db"], group_id)
+            if version is None:
+                return handler(*args, **kwargs)
+
+            variant = f"{request.url.path}?{sorted(request.query_params.multi_items())}#{kwargs['current_user'].UserID}"
+            etag = make_etag(group_id, version, variant)
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                group_cache_requests.inc(result="not_modified")
+                return Response(status_code=304, headers=headers)
+
+            response = kwargs["response"]
+            cached = response_cache.get(variant, version)
+            if cached is not None:
+                group_cache_requests.inc(result="hit")
+                response.headers.update({**cached[2], **headers})
+                return cached[1]
+
+            group_cache_requests.inc(result="miss")
+            result = handler(*args, **kwargs)
+            response_cache.put(variant, version, result, {
+                name: response.headers[name] for name in CACHED_HEADERS if name in response.headers
+            })
+            response.headers.update(headers)
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,209 @@
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from typing import Optional
+from datetime import datetime, timedelta
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import metrics
+import models
+from database import run_blocking
+
+# Idempotency keys for write endpoints.
+#
+# A client that may retry a POST sends an Idempotency-Key header (any unique
+# string, e.g. a UUID, per logical request). The first request with a key
+# claims it by inserting an IdempotencyKeys row in the same transaction as the
+# handler's write. The handler only flushes; once it returns, the response is
+# stored on the row and the decorator commits (or rolls back) the write, the
+# claim and the response together, so a crash can never leave a committed
+# write whose key has no response to replay. A repeat of the key by the
+# same user gets the stored response back, with an Idempotent-Replayed header,
+# without running the handler again. A repeat while the first request is still
+# running gets 409, and reusing a key for a different request gets 422.
+#
+# Keys expire after IDEMPOTENCY_KEY_TTL_HOURS; a background job in every
+# worker deletes expired rows in batches.
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_SWEEP_BATCH = int(os.getenv("IDEMPOTENCY_SWEEP_BATCH", "500"))
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "3600"))  # seconds
+
+idempotent_requests = metrics.Counter(
+    "roomiepay_idempotent_requests_total",
+    "Writes sent with an Idempotency-Key by outcome: executed, replayed, in_progress or mismatch",
+    labels=("result",)
+)
+idempotency_keys_purged = metrics.Counter(
+    "roomiepay_idempotency_keys_purged_total",
+    "Expired idempotency keys deleted by the sweeper"
+)
+
+
+def fingerprint(method: str, path: str, body: bytes) -> str:
+    digest = hashlib.sha256(f"{method} {path}\n".encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def _find(db: Session, user_id: int, key: str, now: datetime) -> Optional[models.IdempotencyKey]:
+    return db.query(models.IdempotencyKey)\
+        .filter(
+            models.IdempotencyKey.UserID == user_id,
+            models.IdempotencyKey.Key == key,
+            models.IdempotencyKey.ExpiresAt > now
+        ).first()
+
+
+def _replay(stored: models.IdempotencyKey, request_hash: str):
+    if stored.RequestHash != request_hash:
+        idempotent_requests.inc(result="mismatch")
+        raise HTTPException(status_code=422, detail=f"{IDEMPOTENCY_HEADER} was already used for a different request")
+    if stored.StatusCode is None:
+        idempotent_requests.inc(result="in_progress")
+        raise HTTPException(status_code=409, detail=f"A request with this {IDEMPOTENCY_HEADER} is still being processed")
+    idempotent_requests.inc(result="replayed")
+    return JSONResponse(
+        content=json.loads(stored.ResponseBody),
+        status_code=stored.StatusCode,
+        headers={REPLAYED_HEADER: "true"}
+    )
+
+
+def _commit(handler, args, kwargs):
+    """Run a handler without a key and commit its write; runs in the threadpool"""
+    result = handler(*args, **kwargs)
+    kwargs["db"].commit()
+    return result
+
+
+def _execute(handler, args, kwargs, key: str, request_hash: str, response_model):
+    """Claim the key, run the handler and store its response; runs in the threadpool"""
+    db = kwargs["db"]
+    user_id = kwargs["current_user"].UserID
+    now = datetime.utcnow()
+
+    stored = _find(db, user_id, key, now)
+    if stored:
+        return _replay(stored, request_hash)
+
+    # Claim the key inside the handler's transaction; an expired row
+    # with the same key is replaced
+    db.query(models.IdempotencyKey)\
+        .filter(
+            models.IdempotencyKey.UserID == user_id,
+            models.IdempotencyKey.Key == key,
+            models.IdempotencyKey.ExpiresAt <= now
+        ).delete(synchronize_session=False)
+    claim = models.IdempotencyKey(
+        UserID=user_id,
+        Key=key,
+        RequestHash=request_hash,
+        CreatedAt=now,
+        ExpiresAt=now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    )
+    db.add(claim)
+    try:
+        db.flush()
+    except IntegrityError:
+        # A concurrent request claimed it first
+        db.rollback()
+        stored = _find(db, user_id, key, now)
+        if stored:
+            return _replay(stored, request_hash)
+        raise HTTPException(status_code=409, detail=f"A request with this {IDEMPOTENCY_HEADER} is still being processed")
+
+    # The handler only flushes, so its write, the claim and the response
+    # are committed together below
+    result = handler(*args, **kwargs)
+
+    body = response_model.model_validate(result) if response_model else result
+    db.query(models.IdempotencyKey)\
+        .filter(
+            models.IdempotencyKey.UserID == user_id,
+            models.IdempotencyKey.Key == key
+        ).update({
+            models.IdempotencyKey.StatusCode: 200,
+            models.IdempotencyKey.ResponseBody: json.dumps(jsonable_encoder(body))
+        }, synchronize_session=False)
+    db.commit()
+    idempotent_requests.inc(result="executed")
+    return result
+
+
+def idempotent(response_model=None):
+    """
+    Decorate a sync write handler with request, db and current_user
+    parameters to honour the Idempotency-Key header. The handler flushes its
+    write and leaves the commit to the decorator, which commits it together
+    with the key and the response; side effects that must wait for the commit
+    are queued with database.after_commit. response_model serializes the
+    result for replays. The request body is read on the event loop, the
+    handler runs in the threadpool.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            request = kwargs["request"]
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if key is None:
+                return await run_blocking(_commit, handler, args, kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters")
+
+            request_hash = fingerprint(request.method, request.url.path, await request.body())
+            return await run_blocking(_execute, handler, args, kwargs, key, request_hash, response_model)
+        return wrapper
+    return decorate
+
+
+def purge_expired_keys(db: Session, batch_size: int = IDEMPOTENCY_SWEEP_BATCH) -> int:
+    """Delete expired idempotency keys, about one batch per transaction"""
+    now = datetime.utcnow()
+    purged = 0
+    while True:
+        # Expiry of the last key in this batch; None when the rest fits in one
+        boundary = db.query(models.IdempotencyKey.ExpiresAt)\
+            .filter(models.IdempotencyKey.ExpiresAt <= now)\
+            .order_by(models.IdempotencyKey.ExpiresAt)\
+            .offset(batch_size - 1)\
+            .limit(1)\
+            .scalar()
+        deleted = db.query(models.IdempotencyKey)\
+            .filter(models.IdempotencyKey.ExpiresAt <= (boundary or now))\
+            .delete(synchronize_session=False)
+        db.commit()
+        purged += deleted
+        idempotency_keys_purged.inc(deleted)
+        if boundary is None or not deleted:
+            return purged
+
+
+async def run_sweeper(session_factory):
+    """Background loop deleting expired idempotency keys every IDEMPOTENCY_SWEEP_INTERVAL"""
+    loop = asyncio.get_running_loop()
+
+    def purge():
+        db = session_factory()
+        try:
+            return purge_expired_keys(db)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            purged = await loop.run_in_executor(None, purge)
+            if purged:
+                print(f"Purged {purged} expired idempotency keys")
+        except Exception as e:
+            print(f"Error purging idempotency keys: {e}")
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_INTERVAL)
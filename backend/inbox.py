@@ -0,0 +1,155 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select
+from typing import Dict, Iterable, List, Optional
+from collections import Counter
+from datetime import datetime, timedelta
+from database import increment_row
+import asyncio
+import os
+import metrics
+import models
+
+# Notification inbox bookkeeping.
+#
+# The unread count of every user is kept in NotificationCounters and adjusted
+# in the same transaction as the write that creates or reads notifications,
+# like the MemberBalances ledger, so the badge count is a primary key lookup
+# instead of a COUNT over the user's notifications. Marking read is one UPDATE
+# whose row count is subtracted from the counter. Migration 4 backfilled the
+# counters, so a user without one has no unread notifications and reading
+# the count never writes.
+#
+# Read notifications are never shown again, so a retention job deletes the
+# ones older than NOTIFICATION_RETENTION_DAYS in batches, committing after each
+# batch so no long-running transaction holds locks on the table.
+
+NOTIFICATION_RETENTION_DAYS = float(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))  # 0 keeps everything
+NOTIFICATION_RETENTION_BATCH = int(os.getenv("NOTIFICATION_RETENTION_BATCH", "500"))
+NOTIFICATION_RETENTION_INTERVAL = float(os.getenv("NOTIFICATION_RETENTION_INTERVAL", "3600"))  # seconds
+
+notifications_purged = metrics.Counter(
+    "roomiepay_notifications_purged_total",
+    "Read notifications deleted by the retention job"
+)
+
+
+def _adjust(db: Session, user_id: int, delta: int):
+    # One upsert, so concurrent writers never lose each other's increments;
+    # a user without a counter has no unread notifications
+    increment_row(db, models.NotificationCounter, {"UserID": user_id}, {"UnreadCount": delta})
+
+
+def record_created(db: Session, user_ids: Iterable[int]):
+    """Count new unread notifications, one user id per notification"""
+    for user_id, created in Counter(user_ids).items():
+        _adjust(db, user_id, created)
+
+
+def mark_read(db: Session, user_id: int, notification_ids: Optional[List[int]] = None, before: Optional[datetime] = None) -> int:
+    """Mark the user's unread notifications read with one UPDATE; returns how many changed"""
+    query = db.query(models.Notification)\
+        .filter(
+            models.Notification.UserID == user_id,
+            models.Notification.IsRead == False
+        )
+    if notification_ids is not None:
+        query = query.filter(models.Notification.NotificationID.in_(notification_ids))
+    if before is not None:
+        query = query.filter(models.Notification.CreatedAt <= before)
+    # Only rows that were still unread match, so concurrent requests can't count a row twice
+    updated = query.update({models.Notification.IsRead: True}, synchronize_session=False)
+    if updated:
+        _adjust(db, user_id, -updated)
+    return updated
+
+
+def unread_count(db: Session, user_id: int) -> int:
+    count = db.query(models.NotificationCounter.UnreadCount)\
+        .filter(models.NotificationCounter.UserID == user_id)\
+        .scalar()
+    return count or 0
+
+
+def compute_unread_counts(db: Session) -> Dict[int, int]:
+    rows = db.query(models.Notification.UserID, func.count(models.Notification.NotificationID))\
+        .filter(models.Notification.IsRead == False)\
+        .group_by(models.Notification.UserID).all()
+    return {user_id: count for user_id, count in rows}
+
+
+def rebuild_counters(db: Session) -> int:
+    """Replace every counter with a count of the unread notifications"""
+    db.query(models.NotificationCounter).delete(synchronize_session=False)
+    db.execute(insert(models.NotificationCounter).from_select(
+        ["UserID", "UnreadCount"],
+        select(models.Notification.UserID, func.count(models.Notification.NotificationID))
+            .where(models.Notification.IsRead == False)
+            .group_by(models.Notification.UserID)
+    ))
+    return db.query(models.NotificationCounter).count()
+
+
+def verify_counters(db: Session) -> List[dict]:
+    """Return the counters that disagree with the unread notifications"""
+    expected = compute_unread_counts(db)
+    stored = {row.UserID: row.UnreadCount for row in db.query(models.NotificationCounter).all()}
+
+    mismatches = []
+    for user_id in set(expected) | set(stored):
+        want = expected.get(user_id, 0)
+        have = stored.get(user_id, 0)
+        if have != want:
+            mismatches.append({"UserID": user_id, "expected": want, "stored": have})
+    return mismatches
+
+
+def purge_read_notifications(db: Session, older_than_days: float = NOTIFICATION_RETENTION_DAYS,
+                             batch_size: int = NOTIFICATION_RETENTION_BATCH) -> int:
+    """Delete read notifications older than the retention age, one batch per transaction"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    purged = 0
+    while True:
+        notification_ids = [notification_id for (notification_id,) in db.query(models.Notification.NotificationID)
+            .filter(
+                models.Notification.IsRead == True,
+                models.Notification.CreatedAt < cutoff
+            )
+            .order_by(models.Notification.CreatedAt, models.Notification.NotificationID)
+            .limit(batch_size)
+            .all()]
+        if not notification_ids:
+            return purged
+
+        deleted = db.query(models.Notification)\
+            .filter(
+                models.Notification.NotificationID.in_(notification_ids),
+                models.Notification.IsRead == True
+            ).delete(synchronize_session=False)
+        db.commit()
+        purged += deleted
+        notifications_purged.inc(deleted)
+        if len(notification_ids) < batch_size:
+            return purged
+
+
+async def run_retention(session_factory):
+    """Background loop purging old read notifications every NOTIFICATION_RETENTION_INTERVAL"""
+    if NOTIFICATION_RETENTION_DAYS <= 0:
+        return
+    loop = asyncio.get_running_loop()
+
+    def purge():
+        db = session_factory()
+        try:
+            return purge_read_notifications(db)
+        finally:
+            db.close()
+
+    while True:
+        try:
+            purged = await loop.run_in_executor(None, purge)
+            if purged:
+                print(f"Purged {purged} read notifications older than {NOTIFICATION_RETENTION_DAYS:g} days")
+        except Exception as e:
+            print(f"Error purging notifications: {e}")
+        await asyncio.sleep(NOTIFICATION_RETENTION_INTERVAL)
@@ -0,0 +1,188 @@
+from fastapi import Request
+from sqlalchemy import event, exc
+from contextvars import ContextVar
+from typing import Optional
+import time
+import metrics
+
+# Request and SQL instrumentation, rendered by GET /metrics.
+#
+# The HTTP middleware records per-route latency, status counts and in-flight
+# requests. Engine event hooks time every query and every pool checkout; while
+# a request is being served they also add to that request's RequestStats, which
+# the middleware turns into per-route query-count and DB-time histograms.
+# RequestStats is a mutable object held in a context variable, so work that
+# runs in the threadpool (which copies the request's context) is counted too.
+#
+# Routes are labelled with their path template (e.g. /groups/{group_id}), not
+# the raw URL, to keep the number of series bounded.
+
+http_requests = metrics.Counter(
+    "roomiepay_http_requests_total",
+    "HTTP requests by route and status code",
+    labels=("method", "route", "status")
+)
+http_request_seconds = metrics.Histogram(
+    "roomiepay_http_request_duration_seconds",
+    "Time to produce the response of an HTTP request",
+    labels=("method", "route")
+)
+http_requests_in_flight = metrics.Gauge(
+    "roomiepay_http_requests_in_flight",
+    "HTTP requests currently being served"
+)
+db_queries_per_request = metrics.Histogram(
+    "roomiepay_db_queries_per_request",
+    "SQL statements executed while serving an HTTP request",
+    labels=("method", "route"),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+)
+db_seconds_per_request = metrics.Histogram(
+    "roomiepay_db_seconds_per_request",
+    "Total SQL execution time while serving an HTTP request",
+    labels=("method", "route")
+)
+db_pool_wait_per_request = metrics.Histogram(
+    "roomiepay_db_pool_wait_seconds_per_request",
+    "Total time spent waiting for pooled connections while serving an HTTP request",
+    labels=("method", "route")
+)
+db_query_seconds = metrics.Histogram(
+    "roomiepay_db_query_seconds",
+    "Execution time of individual SQL statements"
+)
+db_pool_checkout_seconds = metrics.Histogram(
+    "roomiepay_db_pool_checkout_seconds",
+    "Time spent waiting for a connection from the pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0)
+)
+db_pool_timeouts = metrics.Counter(
+    "roomiepay_db_pool_timeouts_total",
+    "Connection checkouts that gave up after DB_POOL_TIMEOUT"
+)
+db_pool_invalidations = metrics.Counter(
+    "roomiepay_db_pool_invalidations_total",
+    "Pooled connections discarded as broken or stale (e.g. failed pre-ping)"
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "checkout_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.checkout_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _route_label(request: Request) -> str:
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+async def metrics_middleware(request: Request, call_next):
+    stats = RequestStats()
+    token = _request_stats.set(stats)
+    http_requests_in_flight.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        http_requests_in_flight.dec()
+        _request_stats.reset(token)
+
+        method = request.method
+        route = _route_label(request)
+        http_requests.inc(method=method, route=route, status=status_code)
+        http_request_seconds.observe(elapsed, method=method, route=route)
+        db_queries_per_request.observe(stats.queries, method=method, route=route)
+        db_seconds_per_request.observe(stats.db_seconds, method=method, route=route)
+        db_pool_wait_per_request.observe(stats.checkout_seconds, method=method, route=route)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    db_query_seconds.observe(elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def instrument_engine(engine):
+    """Attach query timing and pool checkout timing to a sync Engine"""
+    if getattr(engine, "_roomiepay_instrumented", False):
+        return
+    engine._roomiepay_instrumented = True
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+    # The pool has no "checkout started" event, so time the call that every
+    # Connection makes to obtain its DBAPI connection (including pool waits)
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        start = time.perf_counter()
+        try:
+            return raw_connection()
+        except exc.TimeoutError:
+            db_pool_timeouts.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            db_pool_checkout_seconds.observe(elapsed)
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.checkout_seconds += elapsed
+
+    engine.raw_connection = timed_raw_connection
+
+    event.listen(engine, "invalidate", lambda dbapi_connection, record, exception: db_pool_invalidations.inc())
+
+    # Pool state, read from engine.pool at scrape time so a dispose() is followed
+    pool = engine.pool
+    if hasattr(pool, "checkedout"):
+        metrics.Gauge(
+            "roomiepay_db_pool_checked_out",
+            "Connections currently checked out of the pool",
+            callback=lambda: engine.pool.checkedout()
+        )
+    if hasattr(pool, "overflow"):
+        metrics.Gauge(
+            "roomiepay_db_pool_size",
+            "Configured number of persistent pool connections",
+            callback=lambda: engine.pool.size()
+        )
+        metrics.Gauge(
+            "roomiepay_db_pool_checked_in",
+            "Idle connections in the pool",
+            callback=lambda: engine.pool.checkedin()
+        )
+        metrics.Gauge(
+            "roomiepay_db_pool_overflow",
+            "Connections open beyond the pool size (negative while the pool is not full)",
+            callback=lambda: engine.pool.overflow()
+        )
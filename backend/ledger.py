@@ -0,0 +1,219 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import case, func
+from typing import Dict, List, Optional
+from database import increment_row
+import models
+import money
+
+# Materialized per-member balance ledger.
+#
+# Every write path that changes a group's balances (new expenses, confirmed
+# settlements) adjusts the MemberBalances row of the affected members inside
+# the same transaction as the write itself, so GET /groups/{id}/balances only
+# has to read one row per member instead of re-aggregating the group history.
+#
+# Only the additive parts of a balance are stored, in integer cents. A
+# member's share is the group's total spend split equally between the current
+# members, which changes whenever someone joins, so it is derived at read time
+# from the ledger rows. The split uses money.split_equal over the members in
+# UserID order, so the net balances of a group always sum to exactly zero.
+#
+# Reads never write. Migration 12 backfilled the rows for history that
+# predates the ledger, and a member without a row has paid and settled
+# nothing yet, so it counts as zero. "python roomiepay.py ledger verify"
+# compares the rows with the history.
+
+
+def _adjust(db: Session, group_id: int, user_id: int, paid: int = 0, settled: int = 0):
+    # One upsert, so concurrent writers never lose each other's increments
+    # and never race each other into creating the same row
+    increment_row(
+        db, models.MemberBalance,
+        {"GroupID": group_id, "UserID": user_id},
+        {"TotalPaid": paid, "SettledNet": settled}
+    )
+
+
+def ensure_member(db: Session, group_id: int, user_id: int):
+    """Create an empty ledger row for a new group member"""
+    _adjust(db, group_id, user_id)
+
+
+def record_expense(db: Session, group_id: int, paid_by_user_id: int, amount_cents: int):
+    _adjust(db, group_id, paid_by_user_id, paid=amount_cents)
+
+
+def record_confirmed_settlement(db: Session, settlement: models.Settlement):
+    # Paying a settlement raises the payer's net balance and lowers the receiver's
+    amount = settlement.AmountCents
+    _adjust(db, settlement.GroupID, settlement.PayerUserID, settled=amount)
+    _adjust(db, settlement.GroupID, settlement.ReceiverUserID, settled=-amount)
+
+
+def compute_group_totals(db: Session, group_id: int) -> Dict[int, Dict[str, int]]:
+    """Aggregate the ledger values for a group straight from Expenses and Settlements"""
+    totals = {}
+
+    paid_amounts = db.query(
+        models.Expense.PaidByUserID,
+        func.sum(models.Expense.AmountCents)
+    ).filter(models.Expense.GroupID == group_id)\
+        .group_by(models.Expense.PaidByUserID).all()
+    for user_id, amount in paid_amounts:
+        totals.setdefault(user_id, {"TotalPaidCents": 0, "SettledNetCents": 0})
+        totals[user_id]["TotalPaidCents"] += int(amount or 0)
+
+    paid_out = db.query(
+        models.Settlement.PayerUserID,
+        func.sum(models.Settlement.AmountCents)
+    ).filter(
+        models.Settlement.GroupID == group_id,
+        models.Settlement.Status == "Confirmed"
+    ).group_by(models.Settlement.PayerUserID).all()
+    for user_id, amount in paid_out:
+        totals.setdefault(user_id, {"TotalPaidCents": 0, "SettledNetCents": 0})
+        totals[user_id]["SettledNetCents"] += int(amount or 0)
+
+    received = db.query(
+        models.Settlement.ReceiverUserID,
+        func.sum(models.Settlement.AmountCents)
+    ).filter(
+        models.Settlement.GroupID == group_id,
+        models.Settlement.Status == "Confirmed"
+    ).group_by(models.Settlement.ReceiverUserID).all()
+    for user_id, amount in received:
+        totals.setdefault(user_id, {"TotalPaidCents": 0, "SettledNetCents": 0})
+        totals[user_id]["SettledNetCents"] -= int(amount or 0)
+
+    member_ids = db.query(models.GroupMember.UserID)\
+        .filter(models.GroupMember.GroupID == group_id).all()
+    for (user_id,) in member_ids:
+        totals.setdefault(user_id, {"TotalPaidCents": 0, "SettledNetCents": 0})
+
+    return totals
+
+
+def rebuild_group(db: Session, group_id: int):
+    """Replace the ledger rows of a group with values recomputed from history"""
+    totals = compute_group_totals(db, group_id)
+    db.query(models.MemberBalance)\
+        .filter(models.MemberBalance.GroupID == group_id)\
+        .delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.MemberBalance, [
+        {"GroupID": group_id, "UserID": user_id, **values}
+        for user_id, values in totals.items()
+    ])
+    return totals
+
+
+def verify_group(db: Session, group_id: int) -> List[dict]:
+    """Return the ledger rows that disagree with the recomputed history"""
+    expected = compute_group_totals(db, group_id)
+    stored = {
+        row.UserID: row
+        for row in db.query(models.MemberBalance)
+            .filter(models.MemberBalance.GroupID == group_id).all()
+    }
+
+    mismatches = []
+    for user_id in set(expected) | set(stored):
+        want = expected.get(user_id, {"TotalPaidCents": 0, "SettledNetCents": 0})
+        row = stored.get(user_id)
+        have = {
+            "TotalPaidCents": row.TotalPaidCents if row else None,
+            "SettledNetCents": row.SettledNetCents if row else None
+        }
+        if have != want:
+            mismatches.append({"GroupID": group_id, "UserID": user_id, "expected": want, "stored": have})
+    return mismatches
+
+
+def get_member_net_cents(db: Session, group_id: int) -> List[dict]:
+    """
+    Paid and net balance in cents of the current group members, from the
+    ledger. A member without a ledger row has paid and settled nothing yet.
+    """
+    rows = db.query(
+        models.User.UserID,
+        models.User.Name,
+        func.coalesce(models.MemberBalance.TotalPaidCents, 0),
+        func.coalesce(models.MemberBalance.SettledNetCents, 0)
+    ).join(
+        models.GroupMember,
+        models.GroupMember.UserID == models.User.UserID
+    ).outerjoin(
+        models.MemberBalance,
+        (models.MemberBalance.GroupID == models.GroupMember.GroupID) &
+        (models.MemberBalance.UserID == models.GroupMember.UserID)
+    ).filter(models.GroupMember.GroupID == group_id)\
+        .order_by(models.User.UserID).all()
+
+    if not rows:
+        return []
+
+    # Only expenses paid by current members count towards the group total
+    shares = money.split_equal(sum(paid for _, _, paid, _ in rows), len(rows))
+    return [
+        {"UserID": user_id, "Name": name, "PaidCents": paid, "NetCents": paid - share + settled}
+        for (user_id, name, paid, settled), share in zip(rows, shares)
+    ]
+
+
+def get_member_balances(db: Session, group_id: int) -> List[dict]:
+    """Balances of the current group members in currency units, for the API"""
+    return [
+        {
+            "UserID": member["UserID"],
+            "Name": member["Name"],
+            "OwesAmount": money.from_cents(max(-member["NetCents"], 0)),
+            "IsOwedAmount": money.from_cents(member["PaidCents"]),
+            "NetBalance": money.from_cents(member["NetCents"])
+        }
+        for member in get_member_net_cents(db, group_id)
+    ]
+
+
+def get_user_balances(db: Session, user_id: int) -> Dict[int, dict]:
+    """
+    Member count and the user's net balance in every group they belong to,
+    with two aggregate queries regardless of the number of groups.
+    """
+    user_groups = db.query(models.GroupMember.GroupID)\
+        .filter(models.GroupMember.UserID == user_id)
+    group_rows = db.query(
+        models.GroupMember.GroupID,
+        func.count(models.GroupMember.UserID),
+        func.sum(models.MemberBalance.TotalPaidCents),
+        # The user's position in UserID order decides their share of the odd cents
+        func.sum(case((models.GroupMember.UserID < user_id, 1), else_=0))
+    ).outerjoin(
+        models.MemberBalance,
+        (models.MemberBalance.GroupID == models.GroupMember.GroupID) &
+        (models.MemberBalance.UserID == models.GroupMember.UserID)
+    ).filter(models.GroupMember.GroupID.in_(user_groups.scalar_subquery()))\
+        .group_by(models.GroupMember.GroupID).all()
+
+    own_rows = db.query(
+        models.MemberBalance.GroupID,
+        models.MemberBalance.TotalPaidCents,
+        models.MemberBalance.SettledNetCents
+    ).filter(models.MemberBalance.UserID == user_id).all()
+    own = {group_id: (paid, settled) for group_id, paid, settled in own_rows}
+
+    balances = {}
+    for group_id, members, total_paid, position in group_rows:
+        paid, settled = own.get(group_id, (0, 0))
+        share, extra = divmod(int(total_paid or 0), members)
+        if int(position) < extra:
+            share += 1  # Same split as money.split_equal in get_member_net_cents
+        balances[group_id] = {
+            "MemberCount": members,
+            "NetBalance": money.from_cents(paid - share + settled)
+        }
+    return balances
+
+
+def group_ids(db: Session, group_id: Optional[int] = None) -> List[int]:
+    if group_id is not None:
+        return [group_id]
+    return [gid for (gid,) in db.query(models.UserGroup.GroupID).order_by(models.UserGroup.GroupID).all()]
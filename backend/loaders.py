@@ -0,0 +1,77 @@
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List
+import models
+import schemas
+
+# Batched name resolution for response serializers.
+#
+# A NameLoader lives for one request. Serializers first tell it every user and
+# group id they are going to need, then read the names; each entity type is
+# fetched with one IN (...) query for all ids not seen before, so a list
+# endpoint runs the same number of queries whatever the length of the list.
+
+UNKNOWN = "Unknown"
+
+
+class NameLoader:
+    def __init__(self, db: Session):
+        self.db = db
+        self._users: Dict[int, str] = {}
+        self._groups: Dict[int, str] = {}
+
+    def prime_groups(self, names: Dict[int, str]):
+        """Record group names the caller has already loaded"""
+        self._groups.update(names)
+
+    def load(self, user_ids: Iterable[int] = (), group_ids: Iterable[int] = ()):
+        missing_users = set(user_ids) - set(self._users)
+        if missing_users:
+            rows = self.db.query(models.User.UserID, models.User.Name)\
+                .filter(models.User.UserID.in_(missing_users))\
+                .all()
+            self._users.update({user_id: name for user_id, name in rows})
+            # Remember misses too, so they are not queried again
+            self._users.update({user_id: UNKNOWN for user_id in missing_users - {row[0] for row in rows}})
+
+        missing_groups = set(group_ids) - set(self._groups)
+        if missing_groups:
+            rows = self.db.query(models.UserGroup.GroupID, models.UserGroup.GroupName)\
+                .filter(models.UserGroup.GroupID.in_(missing_groups))\
+                .all()
+            self._groups.update({group_id: name for group_id, name in rows})
+            self._groups.update({group_id: UNKNOWN for group_id in missing_groups - {row[0] for row in rows}})
+
+    def user_name(self, user_id: int) -> str:
+        if user_id not in self._users:
+            self.load(user_ids=[user_id])
+        return self._users[user_id]
+
+    def group_name(self, group_id: int) -> str:
+        if group_id not in self._groups:
+            self.load(group_ids=[group_id])
+        return self._groups[group_id]
+
+
+def detailed_settlements(loader: NameLoader, settlements: List[models.Settlement]) -> List[schemas.DetailedSettlement]:
+    """Serialize settlements with payer, receiver and group names, batch-loaded"""
+    loader.load(
+        user_ids=[user_id for settlement in settlements for user_id in (settlement.PayerUserID, settlement.ReceiverUserID)],
+        group_ids=[settlement.GroupID for settlement in settlements]
+    )
+    return [
+        schemas.DetailedSettlement(
+            SettlementID=settlement.SettlementID,
+            GroupID=settlement.GroupID,
+            PayerUserID=settlement.PayerUserID,
+            ReceiverUserID=settlement.ReceiverUserID,
+            Amount=settlement.Amount,
+            Status=settlement.Status,
+            Date=settlement.Date,
+            DueDate=settlement.DueDate,
+            PaymentDate=settlement.PaymentDate,
+            PayerName=loader.user_name(settlement.PayerUserID),
+            ReceiverName=loader.user_name(settlement.ReceiverUserID),
+            GroupName=loader.group_name(settlement.GroupID)
+        )
+        for settlement in settlements
+    ]
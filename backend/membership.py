@@ -0,0 +1,118 @@
+from fastapi import Depends, HTTPException
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from typing import Dict, Optional
+import os
+import threading
+import time
+import models
+from database import get_db
+from security import get_current_user
+
+# Group membership authorization.
+#
+# Each user's memberships are loaded with one query as {GroupID: IsAdmin} and
+# kept in an in-process TTL/LRU cache, so group-scoped endpoints no longer
+# query GroupMembers on every request. join_group and create_group invalidate
+# the affected user. A cached "not a member" answer is re-checked against the
+# database once before access is denied, so a membership created by another
+# worker is visible immediately instead of after the TTL.
+
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "300"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "10000"))
+
+
+class MembershipCache:
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # UserID -> (expires_at, {GroupID: IsAdmin})
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[int, bool]]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user_id: int, memberships: Dict[int, bool]):
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl_seconds, memberships)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+membership_cache = MembershipCache(MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+
+
+def load_memberships(db: Session, user_id: int, refresh: bool = False) -> Dict[int, bool]:
+    """Return {GroupID: IsAdmin} for every group the user belongs to"""
+    if not refresh:
+        cached = membership_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+    rows = db.query(models.GroupMember.GroupID, models.GroupMember.IsAdmin)\
+        .filter(models.GroupMember.UserID == user_id)\
+        .all()
+    memberships = {group_id: bool(is_admin) for group_id, is_admin in rows}
+    membership_cache.put(user_id, memberships)
+    return memberships
+
+
+def invalidate_memberships(user_id: int):
+    membership_cache.invalidate(user_id)
+
+
+def is_member(db: Session, user_id: int, group_id: int, admin: bool = False) -> bool:
+    memberships = load_memberships(db, user_id)
+    if group_id not in memberships or (admin and not memberships[group_id]):
+        # Possibly stale: confirm with the database before saying no
+        memberships = load_memberships(db, user_id, refresh=True)
+    if group_id not in memberships:
+        return False
+    return memberships[group_id] or not admin
+
+
+def ensure_member(db: Session, user_id: int, group_id: int,
+                  detail: str = "Not a member of this group", admin: bool = False):
+    """Raise 403 unless the user belongs to the group (as admin if requested)"""
+    if not is_member(db, user_id, group_id, admin=admin):
+        raise HTTPException(status_code=403, detail=detail)
+
+
+def require_membership(admin: bool = False, detail: Optional[str] = None):
+    """
+    Build a dependency for endpoints with a group_id path parameter that
+    rejects callers who are not members (or admins) of the group.
+    """
+    detail = detail or ("Must be group admin" if admin else "Not a member of this group")
+
+    def dependency(
+        group_id: int,
+        db: Session = Depends(get_db),
+        current_user: models.User = Depends(get_current_user)
+    ):
+        ensure_member(db, current_user.UserID, group_id, detail=detail, admin=admin)
+
+    return dependency
+
+
+require_member = require_membership()
+require_admin = require_membership(admin=True)
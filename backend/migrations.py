@@ -0,0 +1,342 @@
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, Numeric, String, Table, bindparam, func, inspect, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from typing import Callable, List, NamedTuple, Optional
+from datetime import date, datetime, timedelta
+import os
+import re
+import models
+
+# Versioned schema migrations.
+#
+# Every migration has a version number and is applied once, in order, in its
+# own transaction; applied versions are recorded in SchemaMigrations. The
+# migrations inspect the schema before changing it, so databases bootstrapped
+# by older releases (cmds.txt, the old SHOW COLUMNS fixes) are upgraded
+# without errors. New schema changes are added as a new migration at the end
+# of MIGRATIONS; never edit one that has shipped.
+#
+# Migrations are run by "python roomiepay.py db init/upgrade". On startup the
+# server only compares the recorded version with LATEST_VERSION
+# (SCHEMA_ON_STARTUP=check), unless told to upgrade or skip the check.
+
+SCHEMA_ON_STARTUP = os.getenv("SCHEMA_ON_STARTUP", "check").lower()  # "check", "upgrade" or "off"
+
+schema_metadata = MetaData()
+
+schema_migrations = Table(
+    "SchemaMigrations", schema_metadata,
+    Column("Version", Integer, primary_key=True, autoincrement=False),
+    Column("Name", String(200), nullable=False),
+    Column("AppliedAt", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _table_names(connection: Connection):
+    return {name.lower(): name for name in inspect(connection).get_table_names()}
+
+
+def _create_baseline_tables(connection: Connection):
+    existing = _table_names(connection)
+
+    # On MySQL, tables are created from cmds.txt as before so CHECK constraints
+    # and ENUM columns match databases created by earlier releases
+    if connection.dialect.name == "mysql":
+        cmds_file_path = os.path.join(os.path.dirname(__file__), "cmds.txt")
+        with open(cmds_file_path, "r") as file:
+            sql_commands = file.read()
+        for command in sql_commands.split(";"):
+            create_match = re.search(r"CREATE TABLE\s+(\w+)", command, re.IGNORECASE)
+            if not create_match or create_match.group(1).lower() in existing:
+                continue
+            connection.execute(text(command))
+            print(f"Created table {create_match.group(1)}")
+
+    # Anything cmds.txt doesn't define (or every table, on other databases)
+    models.Base.metadata.create_all(bind=connection, checkfirst=True)
+
+
+def _add_columns(columns):
+    def apply(connection: Connection):
+        inspector = inspect(connection)
+        tables = _table_names(connection)
+        for table_name, table_columns in columns.items():
+            if table_name.lower() not in tables:
+                continue
+            actual_name = tables[table_name.lower()]
+            existing = {column["name"].lower() for column in inspector.get_columns(actual_name)}
+            for column_name, column_type in table_columns:
+                if column_name.lower() not in existing:
+                    connection.execute(text(f"ALTER TABLE {actual_name} ADD COLUMN {column_name} {column_type}"))
+                    print(f"Added column {actual_name}.{column_name}")
+    return apply
+
+
+# Columns that used to be patched in by database.fix_database_schema
+LEGACY_COLUMNS = {
+    "SettlementPeriods": [
+        ("TotalPendingAmount", "DECIMAL(10,2) DEFAULT 0"),
+        ("LastBatchID", "VARCHAR(36)"),
+    ],
+    "Settlements": [
+        ("DueDate", "DATETIME"),
+        ("PaymentDate", "DATETIME"),
+    ],
+}
+
+
+# Composite indexes for the hot access paths: (name, table, columns)
+HOT_PATH_INDEXES = [
+    ("ix_expenses_group_date", "Expenses", ("GroupID", "Date", "ExpenseID")),
+    ("ix_expenses_group_settled", "Expenses", ("GroupID", "IsSettled", "ExpenseID")),
+    ("ix_settlements_group_date", "Settlements", ("GroupID", "Date", "SettlementID")),
+    ("ix_settlements_group_status", "Settlements", ("GroupID", "Status")),
+    ("ix_settlements_payer_date", "Settlements", ("PayerUserID", "Date", "SettlementID")),
+    ("ix_settlements_receiver_date", "Settlements", ("ReceiverUserID", "Date", "SettlementID")),
+    ("ix_settlements_payer_status_date", "Settlements", ("PayerUserID", "Status", "Date", "SettlementID")),
+    ("ix_settlements_receiver_status_date", "Settlements", ("ReceiverUserID", "Status", "Date", "SettlementID")),
+    ("ix_notifications_user_read_created", "Notifications", ("UserID", "IsRead", "CreatedAt", "NotificationID")),
+    ("ix_group_members_group", "GroupMembers", ("GroupID", "UserID")),
+    ("ix_settlement_periods_next", "SettlementPeriods", ("NextSettlement",)),
+]
+
+
+def _create_indexes(indexes):
+    def apply(connection: Connection):
+        inspector = inspect(connection)
+        tables = _table_names(connection)
+        for index_name, table_name, columns in indexes:
+            actual_name = tables.get(table_name.lower())
+            if actual_name is None:
+                continue
+            existing = {index["name"] for index in inspector.get_indexes(actual_name)}
+            if index_name in existing:
+                continue
+            connection.execute(text(f"CREATE INDEX {index_name} ON {actual_name} ({', '.join(columns)})"))
+            print(f"Created index {index_name} on {actual_name}")
+    return apply
+
+
+def _create_notification_counters(connection: Connection):
+    models.NotificationCounter.__table__.create(bind=connection, checkfirst=True)
+    # Backfill from the unread notifications
+    connection.execute(models.NotificationCounter.__table__.delete())
+    connection.execute(insert(models.NotificationCounter.__table__).from_select(
+        ["UserID", "UnreadCount"],
+        select(models.Notification.UserID, func.count(models.Notification.NotificationID))
+            .where(models.Notification.IsRead == False)
+            .group_by(models.Notification.UserID)
+    ))
+    _create_indexes([
+        ("ix_notifications_read_created", "Notifications", ("IsRead", "CreatedAt", "NotificationID")),
+    ])(connection)
+
+
+# Money columns converted from DECIMAL to BIGINT cents: (table, column, BIGINT column definition)
+MONEY_COLUMNS = [
+    ("Expenses", "Amount", "BIGINT NOT NULL"),
+    ("Settlements", "Amount", "BIGINT NOT NULL"),
+    ("SettlementPeriods", "TotalPendingAmount", "BIGINT DEFAULT 0"),
+    ("MemberBalances", "TotalPaid", "BIGINT NOT NULL DEFAULT 0"),
+    ("MemberBalances", "SettledNet", "BIGINT NOT NULL DEFAULT 0"),
+]
+
+
+def _convert_money_to_cents(connection: Connection):
+    inspector = inspect(connection)
+    tables = _table_names(connection)
+    for table_name, column_name, definition in MONEY_COLUMNS:
+        actual_name = tables.get(table_name.lower())
+        if actual_name is None:
+            continue
+        column = next((column for column in inspector.get_columns(actual_name)
+                       if column["name"].lower() == column_name.lower()), None)
+        # Tables created from the current models already store cents
+        if column is None or not isinstance(column["type"], Numeric):
+            continue
+
+        if connection.dialect.name == "mysql":
+            # Widen first so amounts times 100 still fit, then switch to integers
+            wide = definition.replace("BIGINT", "DECIMAL(20,2)")
+            connection.execute(text(f"ALTER TABLE {actual_name} MODIFY {column_name} {wide}"))
+            connection.execute(text(f"UPDATE {actual_name} SET {column_name} = ROUND({column_name} * 100)"))
+            connection.execute(text(f"ALTER TABLE {actual_name} MODIFY {column_name} {definition}"))
+        else:
+            # SQLite can't change a column type; its NUMERIC columns store the integers as is
+            connection.execute(text(
+                f"UPDATE {actual_name} SET {column_name} = CAST(ROUND({column_name} * 100) AS INTEGER)"
+            ))
+        print(f"Converted {actual_name}.{column_name} to cents")
+
+
+def _create_spending_rollups(connection: Connection):
+    models.SpendingRollup.__table__.create(bind=connection, checkfirst=True)
+    # Backfill from the existing expenses. The SQL and the day/week/month
+    # buckets are frozen here, not taken from analytics.py, so this migration
+    # writes the same rows whatever analytics.py looks like later.
+    rows = connection.execute(text(
+        "SELECT GroupID, PaidByUserID, DATE(Date), SUM(Amount), COUNT(*) FROM Expenses "
+        "GROUP BY GroupID, PaidByUserID, DATE(Date)"
+    )).all()
+    totals = {}
+    for group_id, user_id, day, cents, count in rows:
+        if isinstance(day, str):
+            day = date.fromisoformat(day[:10])  # DATE() is a string on SQLite
+        buckets = (("day", day), ("week", day - timedelta(days=day.weekday())), ("month", day.replace(day=1)))
+        for granularity, bucket in buckets:
+            total = totals.setdefault((group_id, granularity, bucket, user_id), [0, 0])
+            total[0] += int(cents)
+            total[1] += count
+
+    connection.execute(text("DELETE FROM SpendingRollups"))
+    if totals:
+        connection.execute(
+            text(
+                "INSERT INTO SpendingRollups (GroupID, Granularity, BucketStart, UserID, TotalCents, ExpenseCount) "
+                "VALUES (:group_id, :granularity, :bucket, :user_id, :cents, :count)"
+            ).bindparams(bindparam("bucket", type_=Date)),
+            [
+                {"group_id": group_id, "granularity": granularity, "bucket": bucket, "user_id": user_id,
+                 "cents": cents, "count": count}
+                for (group_id, granularity, bucket, user_id), (cents, count) in totals.items()
+            ]
+        )
+    print(f"Backfilled {len(totals)} spending rollup rows")
+
+
+def _create_settlement_batches(connection: Connection):
+    _add_columns({"Settlements": [("BatchID", "VARCHAR(36)")]})(connection)
+    _create_indexes([("ix_settlements_batch", "Settlements", ("BatchID",))])(connection)
+    models.SettlementBatch.__table__.create(bind=connection, checkfirst=True)
+    # Backfill the pending totals with frozen SQL; settlements from earlier
+    # runs have no batch, so the new SettlementBatches table stays empty
+    connection.execute(text(
+        "UPDATE SettlementPeriods SET TotalPendingAmount = COALESCE(("
+        "SELECT SUM(s.Amount) FROM Settlements s "
+        "WHERE s.GroupID = SettlementPeriods.GroupID AND s.Status IN ('Pending', 'Overdue')), 0)"
+    ))
+    inserted = connection.execute(text(
+        "INSERT INTO SettlementPeriods (GroupID, Period, TotalPendingAmount) "
+        "SELECT s.GroupID, '1m', SUM(s.Amount) FROM Settlements s "
+        "WHERE s.Status IN ('Pending', 'Overdue') "
+        "AND s.GroupID NOT IN (SELECT p.GroupID FROM SettlementPeriods p) "
+        "GROUP BY s.GroupID HAVING SUM(s.Amount) <> 0"
+    )).rowcount
+    print(f"Backfilled pending settlement totals ({inserted} new settlement periods)")
+
+
+def _create_idempotency_keys(connection: Connection):
+    models.IdempotencyKey.__table__.create(bind=connection, checkfirst=True)
+
+
+def _add_settlement_totals(connection: Connection):
+    _add_columns({"SettlementPeriods": [("TotalSettlementAmount", "BIGINT NOT NULL DEFAULT 0")]})(connection)
+    # Backfill with frozen SQL, like the pending totals in migration 8
+    connection.execute(text(
+        "UPDATE SettlementPeriods SET TotalSettlementAmount = COALESCE(("
+        "SELECT SUM(s.Amount) FROM Settlements s WHERE s.GroupID = SettlementPeriods.GroupID), 0)"
+    ))
+    inserted = connection.execute(text(
+        "INSERT INTO SettlementPeriods (GroupID, Period, TotalSettlementAmount) "
+        "SELECT s.GroupID, '1m', SUM(s.Amount) FROM Settlements s "
+        "WHERE s.GroupID NOT IN (SELECT p.GroupID FROM SettlementPeriods p) "
+        "GROUP BY s.GroupID HAVING SUM(s.Amount) <> 0"
+    )).rowcount
+    print(f"Backfilled settlement totals ({inserted} new settlement periods)")
+
+
+def _backfill_member_balances(connection: Connection):
+    # Rebuilds every ledger row from the expenses and confirmed settlements, so
+    # history that predates the ledger is covered and reads never have to
+    connection.execute(text("DELETE FROM MemberBalances"))
+    connection.execute(text(
+        "INSERT INTO MemberBalances (GroupID, UserID, TotalPaid, SettledNet, UpdatedAt) "
+        "SELECT m.GroupID, m.UserID, "
+        "COALESCE((SELECT SUM(e.Amount) FROM Expenses e "
+        "WHERE e.GroupID = m.GroupID AND e.PaidByUserID = m.UserID), 0), "
+        "COALESCE((SELECT SUM(s.Amount) FROM Settlements s "
+        "WHERE s.GroupID = m.GroupID AND s.PayerUserID = m.UserID AND s.Status = 'Confirmed'), 0) - "
+        "COALESCE((SELECT SUM(s.Amount) FROM Settlements s "
+        "WHERE s.GroupID = m.GroupID AND s.ReceiverUserID = m.UserID AND s.Status = 'Confirmed'), 0), "
+        "CURRENT_TIMESTAMP "
+        "FROM ("
+        "SELECT GroupID, UserID FROM GroupMembers "
+        "UNION SELECT GroupID, PaidByUserID FROM Expenses "
+        "UNION SELECT GroupID, PayerUserID FROM Settlements WHERE Status = 'Confirmed' "
+        "UNION SELECT GroupID, ReceiverUserID FROM Settlements WHERE Status = 'Confirmed'"
+        ") m"
+    ))
+    rows = connection.execute(text("SELECT COUNT(*) FROM MemberBalances")).scalar()
+    print(f"Backfilled {rows} member balance rows")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline tables", _create_baseline_tables),
+    Migration(2, "settlement due/payment dates and period batch columns", _add_columns(LEGACY_COLUMNS)),
+    Migration(3, "composite indexes for hot queries", _create_indexes(HOT_PATH_INDEXES)),
+    Migration(4, "notification unread counters and retention index", _create_notification_counters),
+    Migration(5, "group change versions", _add_columns({"UserGroups": [("Version", "INTEGER NOT NULL DEFAULT 0")]})),
+    Migration(6, "money columns as integer cents", _convert_money_to_cents),
+    Migration(7, "spending analytics rollups", _create_spending_rollups),
+    Migration(8, "pending settlement totals and settlement batches", _create_settlement_batches),
+    Migration(9, "idempotency keys", _create_idempotency_keys),
+    Migration(10, "settlement versions", _add_columns({"Settlements": [("Version", "INTEGER NOT NULL DEFAULT 0")]})),
+    Migration(11, "settlement totals of every status", _add_settlement_totals),
+    Migration(12, "member balance ledger backfill", _backfill_member_balances),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection: Connection) -> int:
+    """Highest applied migration, 0 for an empty or unversioned database"""
+    if "schemamigrations" not in _table_names(connection):
+        return 0
+    version = connection.execute(select(schema_migrations.c.Version).order_by(schema_migrations.c.Version.desc())).scalar()
+    return version or 0
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    with engine.connect() as connection:
+        version = current_version(connection)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[Migration]:
+    """Apply every pending migration up to target (default: latest)"""
+    with engine.begin() as connection:
+        schema_metadata.create_all(bind=connection, checkfirst=True)
+
+    applied = []
+    for migration in pending_migrations(engine):
+        if target is not None and migration.version > target:
+            break
+        with engine.begin() as connection:
+            migration.apply(connection)
+            connection.execute(insert(schema_migrations).values(
+                Version=migration.version,
+                Name=migration.name,
+                AppliedAt=datetime.utcnow()
+            ))
+        print(f"Applied migration {migration.version}: {migration.name}")
+        applied.append(migration)
+    return applied
+
+
+def startup_schema_check(engine: Engine):
+    """Cheap schema version check run when a worker starts"""
+    if SCHEMA_ON_STARTUP == "off":
+        return
+    if SCHEMA_ON_STARTUP == "upgrade":
+        upgrade(engine)
+        return
+    with engine.connect() as connection:
+        version = current_version(connection)
+    if version < LATEST_VERSION:
+        print(f"Database schema is at version {version}, latest is {LATEST_VERSION}; "
+              f"run 'python roomiepay.py db upgrade'")
@@ -1,6 +1,19 @@
-from sqlalchemy import Boolean, Column, DateTime, Enum, ForeignKey, Integer, String, Text, Numeric
+from sqlalchemy import BigInteger, Boolean, Column, Date, DateTime, Enum, ForeignKey, Index, Integer, String, Text
 from sqlalchemy.sql import func
 from database import Base
+import money
+
+def _money(cents_attribute):
+    # Money columns store integer cents (see money.py); this is their Decimal
+    # view in currency units, used by the schemas and constructors
+    def get(self):
+        cents = getattr(self, cents_attribute)
+        return None if cents is None else money.from_cents(cents)
+
+    def set(self, amount):
+        setattr(self, cents_attribute, None if amount is None else money.to_cents(amount))
+
+    return property(get, set)
 
 class User(Base):
     __tablename__ = "Users"
@@ -21,6 +34,7 @@ class UserGroup(Base):
     CreationDate = Column(DateTime, default=func.now())
     InviteCode = Column(String(20), unique=True, nullable=False)
     CreatedByUserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), nullable=False)
+    Version = Column(Integer, nullable=False, default=0)  # Bumped by every write to the group, see group_versions.py
 
 class GroupMember(Base):
     __tablename__ = "GroupMembers"
@@ -29,17 +43,27 @@ class GroupMember(Base):
     GroupID = Column(Integer, ForeignKey("UserGroups.GroupID", ondelete="CASCADE"), primary_key=True)
     IsAdmin = Column(Boolean, default=False, nullable=False)
 
+    __table_args__ = (
+        Index("ix_group_members_group", "GroupID", "UserID"),  # Members of a group
+    )
+
 class Expense(Base):
     __tablename__ = "Expenses"
     
     ExpenseID = Column(Integer, primary_key=True, index=True, autoincrement=True)
     GroupID = Column(Integer, ForeignKey("UserGroups.GroupID", ondelete="CASCADE"), nullable=False)
     PaidByUserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), nullable=False)
-    Amount = Column(Numeric(10, 2), nullable=False)
+    AmountCents = Column("Amount", BigInteger, nullable=False)
+    Amount = _money("AmountCents")
     Description = Column(String(255))
     Date = Column(DateTime, default=func.now())
     IsSettled = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("ix_expenses_group_date", "GroupID", "Date", "ExpenseID"),  # Keyset pages of group expenses
+        Index("ix_expenses_group_settled", "GroupID", "IsSettled", "ExpenseID"),  # Unsettled expenses of a group
+    )
+
 class Settlement(Base):
     __tablename__ = "Settlements"
     
@@ -47,12 +71,26 @@ class Settlement(Base):
     GroupID = Column(Integer, ForeignKey("UserGroups.GroupID", ondelete="CASCADE"), nullable=False)
     PayerUserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), nullable=False)
     ReceiverUserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), nullable=False)
-    Amount = Column(Numeric(10, 2), nullable=False)
+    AmountCents = Column("Amount", BigInteger, nullable=False)
+    Amount = _money("AmountCents")
     Date = Column(DateTime, default=func.now())
     Status = Column(Enum("Pending", "Confirmed", "Overdue", name="settlement_status"), default="Pending")
     PaymentMethod = Column(String(50))
     DueDate = Column(DateTime, nullable=True)
     PaymentDate = Column(DateTime, nullable=True)
+    BatchID = Column(String(36), nullable=True)  # Periodic settlement run that created it
+    Version = Column(Integer, nullable=False, default=0)  # Bumped by every status or amount change, see settlement_status.py
+
+    __table_args__ = (
+        # Keyset pages of group settlements, settlement history and pending settlements
+        Index("ix_settlements_group_date", "GroupID", "Date", "SettlementID"),
+        Index("ix_settlements_group_status", "GroupID", "Status"),
+        Index("ix_settlements_payer_date", "PayerUserID", "Date", "SettlementID"),
+        Index("ix_settlements_receiver_date", "ReceiverUserID", "Date", "SettlementID"),
+        Index("ix_settlements_payer_status_date", "PayerUserID", "Status", "Date", "SettlementID"),
+        Index("ix_settlements_receiver_status_date", "ReceiverUserID", "Status", "Date", "SettlementID"),
+        Index("ix_settlements_batch", "BatchID"),
+    )
 
 class Invitation(Base):
     __tablename__ = "Invitations"
@@ -75,6 +113,17 @@ class Notification(Base):
     IsRead = Column(Boolean, default=False)
     CreatedAt = Column(DateTime, default=func.now())
 
+    __table_args__ = (
+        Index("ix_notifications_user_read_created", "UserID", "IsRead", "CreatedAt", "NotificationID"),  # Keyset pages of the inbox
+        Index("ix_notifications_read_created", "IsRead", "CreatedAt", "NotificationID"),  # Retention purge
+    )
+
+class NotificationCounter(Base):
+    __tablename__ = "NotificationCounters"
+    
+    UserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), primary_key=True)
+    UnreadCount = Column(Integer, nullable=False, default=0)  # Maintained by inbox.py
+
 class SettlementPeriod(Base):
     __tablename__ = "SettlementPeriods"
     
@@ -82,5 +131,58 @@ class SettlementPeriod(Base):
     Period = Column(String(10), nullable=False, default="1m")  # e.g., "1h", "1d", "1w", "1m"
     LastSettlement = Column(DateTime, nullable=True)
     NextSettlement = Column(DateTime, nullable=True)
-    TotalPendingAmount = Column(Numeric(10, 2), default=0)  # Track total pending settlements
-    LastBatchID = Column(String(36), nullable=True)  # Track last settlement batch
\ No newline at end of file
+    TotalPendingCents = Column("TotalPendingAmount", BigInteger, default=0)  # Maintained by settlement_totals.py
+    TotalSettlementCents = Column("TotalSettlementAmount", BigInteger, nullable=False, server_default="0")  # Every status, maintained by settlement_totals.py
+    LastBatchID = Column(String(36), nullable=True)  # Last periodic settlement run
+
+    __table_args__ = (
+        Index("ix_settlement_periods_next", "NextSettlement"),  # Due groups
+    )
+
+class MemberBalance(Base):
+    __tablename__ = "MemberBalances"
+    
+    GroupID = Column(Integer, ForeignKey("UserGroups.GroupID", ondelete="CASCADE"), primary_key=True)
+    UserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), primary_key=True)
+    TotalPaidCents = Column("TotalPaid", BigInteger, nullable=False, default=0)  # Sum of expenses paid by the member
+    SettledNetCents = Column("SettledNet", BigInteger, nullable=False, default=0)  # Confirmed settlements paid minus received
+    UpdatedAt = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class SpendingRollup(Base):
+    __tablename__ = "SpendingRollups"
+    
+    GroupID = Column(Integer, ForeignKey("UserGroups.GroupID", ondelete="CASCADE"), primary_key=True)
+    Granularity = Column(String(5), primary_key=True)  # "day", "week" or "month"
+    BucketStart = Column(Date, primary_key=True)  # First day of the bucket
+    UserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), primary_key=True)  # Payer
+    TotalCents = Column(BigInteger, nullable=False, default=0)  # Maintained by analytics.py
+    ExpenseCount = Column(Integer, nullable=False, default=0)
+
+class SettlementBatch(Base):
+    __tablename__ = "SettlementBatches"
+    
+    BatchID = Column(String(36), primary_key=True)  # uuid4 of the periodic settlement run
+    GroupID = Column(Integer, ForeignKey("UserGroups.GroupID", ondelete="CASCADE"), nullable=False)
+    CreatedAt = Column(DateTime, nullable=False)
+    SettlementCount = Column(Integer, nullable=False, default=0)
+    TotalCents = Column(BigInteger, nullable=False, default=0)  # Settled by the run
+    PendingCents = Column(BigInteger, nullable=False, default=0)  # Still unpaid, maintained by settlement_totals.py
+
+    __table_args__ = (
+        Index("ix_settlement_batches_group_created", "GroupID", "CreatedAt"),
+    )
+
+class IdempotencyKey(Base):
+    __tablename__ = "IdempotencyKeys"
+    
+    UserID = Column(Integer, ForeignKey("Users.UserID", ondelete="CASCADE"), primary_key=True)
+    Key = Column(String(255), primary_key=True)  # Idempotency-Key header, unique per user
+    RequestHash = Column(String(64), nullable=False)  # SHA-256 of method, path and body
+    StatusCode = Column(Integer, nullable=True)  # None while the first request is running
+    ResponseBody = Column(Text, nullable=True)  # JSON replayed for repeats
+    CreatedAt = Column(DateTime, nullable=False)
+    ExpiresAt = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires", "ExpiresAt"),  # Sweeper
+    )
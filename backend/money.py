@@ -0,0 +1,53 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Sequence
+
+# Fixed-point money.
+#
+# Amounts are stored as BIGINT cents and all balance and split arithmetic is
+# done on plain Python ints; Decimal only appears at the API edge, where the
+# schemas accept and return amounts in currency units with two decimals.
+# Splitting an amount uses largest-remainder rounding, so the parts always add
+# up to the exact total and the extra cents go to the same members every time.
+
+
+def to_cents(amount) -> int:
+    """Convert an amount in currency units to whole cents, rounding half up"""
+    return int((Decimal(str(amount)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def quantize(amount) -> Decimal:
+    """Round an amount to the cent, as it will be stored"""
+    return from_cents(to_cents(amount))
+
+
+def allocate(total: int, weights: Sequence[int]) -> List[int]:
+    """
+    Split total cents in proportion to non-negative integer weights.
+    The parts sum to total; cents left after flooring go to the largest
+    remainders, ties to the earliest part.
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        raise ValueError("Weights must sum to a positive number")
+
+    parts, remainders = [], []
+    for weight in weights:
+        part, remainder = divmod(total * weight, weight_sum)
+        parts.append(part)
+        remainders.append(remainder)
+
+    leftover = total - sum(parts)
+    by_remainder = sorted(range(len(weights)), key=lambda i: (-remainders[i], i))
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+    return parts
+
+
+def split_equal(total: int, count: int) -> List[int]:
+    """Equal shares of total cents; the first total % count shares get one cent more"""
+    share, extra = divmod(total, count)
+    return [share + 1 if i < extra else share for i in range(count)]
@@ -0,0 +1,198 @@
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Set
+import asyncio
+import json
+import os
+import threading
+import metrics
+import schemas
+
+# Push delivery of notifications.
+#
+# Producers call publish(user_id, notification) after committing the
+# notification row; clients of GET /notifications/stream receive it as a
+# server-sent event instead of polling GET /notifications.
+#
+# The hub fans events out to the stream connections of this process. Events
+# go through a broker so several workers can share them:
+#   in-process (default) - delivered straight to this process's subscribers
+#   redis                - NOTIFICATION_BROKER_URL=redis://host:6379/0 publishes
+#                          on a Redis channel every worker is subscribed to
+#                          (needs the "redis" package)
+#
+# publish() is safe to call from any thread (threadpool handlers, settlement
+# workers); it hands the event to the hub's event loop. Each connection has a
+# bounded queue and a slow client loses its oldest events rather than growing
+# memory; it can catch up with GET /notifications.
+
+NOTIFICATION_BROKER_URL = os.getenv("NOTIFICATION_BROKER_URL", "")
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "100"))
+NOTIFICATION_STREAM_KEEPALIVE = float(os.getenv("NOTIFICATION_STREAM_KEEPALIVE", "15"))
+REDIS_CHANNEL_PREFIX = "roomiepay:notifications:"
+
+notifications_published = metrics.Counter(
+    "roomiepay_notifications_published_total",
+    "Notifications published to the stream hub"
+)
+notifications_dropped = metrics.Counter(
+    "roomiepay_notifications_dropped_total",
+    "Stream events dropped because a client's queue was full"
+)
+
+
+def notification_event(notification) -> dict:
+    """JSON-ready payload of a Notification row, as returned by GET /notifications"""
+    return schemas.Notification.model_validate(notification).model_dump(mode="json")
+
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['NotificationID']}\nevent: notification\ndata: {json.dumps(event)}\n\n"
+
+
+class InProcessBroker:
+    """Delivers events to the subscribers of this process only"""
+
+    async def start(self, deliver: Callable[[int, dict], None]):
+        self._deliver = deliver
+
+    async def publish(self, user_id: int, event: dict):
+        self._deliver(user_id, event)
+
+    async def stop(self):
+        pass
+
+
+class RedisBroker:
+    """Relays events through Redis pub/sub so every worker's hub sees them"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self._redis = None
+        self._pubsub = None
+        self._reader = None
+
+    async def start(self, deliver: Callable[[int, dict], None]):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("NOTIFICATION_BROKER_URL needs the 'redis' package (pip install redis)")
+        self._redis = redis.from_url(self.url)
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.psubscribe(REDIS_CHANNEL_PREFIX + "*")
+        self._reader = asyncio.create_task(self._read(deliver))
+
+    async def _read(self, deliver: Callable[[int, dict], None]):
+        while True:
+            try:
+                async for message in self._pubsub.listen():
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    deliver(int(channel[len(REDIS_CHANNEL_PREFIX):]), json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Notification broker connection lost: {e}")
+                await asyncio.sleep(1)
+
+    async def publish(self, user_id: int, event: dict):
+        await self._redis.publish(f"{REDIS_CHANNEL_PREFIX}{user_id}", json.dumps(event))
+
+    async def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._pubsub is not None:
+            await self._pubsub.close()
+        if self._redis is not None:
+            await self._redis.close()
+
+
+class NotificationHub:
+    def __init__(self, broker=None, queue_size: int = NOTIFICATION_QUEUE_SIZE):
+        self.broker = broker or InProcessBroker()
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+        metrics.Gauge(
+            "roomiepay_notification_stream_connections",
+            "Open notification stream connections in this worker",
+            callback=lambda: sum(len(queues) for queues in self._subscribers.values())
+        )
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.broker.start(self._deliver_local)
+
+    async def stop(self):
+        await self.broker.stop()
+        self._loop = None
+
+    def publish(self, user_id: int, event: dict):
+        """Publish one event to a user's streams; safe from any thread"""
+        loop = self._loop
+        if loop is None:
+            return  # Not serving streams, e.g. a maintenance command
+        notifications_published.inc()
+        loop.call_soon_threadsafe(self._publish_on_loop, user_id, event)
+
+    def publish_many(self, events: Iterable[dict]):
+        for event in events:
+            self.publish(event["UserID"], event)
+
+    def _publish_on_loop(self, user_id: int, event: dict):
+        task = asyncio.ensure_future(self.broker.publish(user_id, event))
+        task.add_done_callback(self._report_publish_error)
+
+    @staticmethod
+    def _report_publish_error(task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error publishing notification: {task.exception()}")
+
+    def _deliver_local(self, user_id: int, event: dict):
+        for queue in list(self._subscribers.get(user_id, ())):
+            if queue.full():
+                queue.get_nowait()
+                notifications_dropped.inc()
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self, user_id: int):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = self._subscribers.get(user_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[user_id]
+
+    async def stream(self, user_id: int, backlog: List[dict], keepalive: float = NOTIFICATION_STREAM_KEEPALIVE):
+        """Server-sent events for one connection: the backlog, then live events"""
+        async with self.subscribe(user_id) as queue:
+            yield "retry: 3000\n\n"
+            sent = set()
+            for event in backlog:
+                sent.add(event["NotificationID"])
+                yield format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event["NotificationID"] in sent:
+                    continue  # Already in the backlog
+                yield format_sse(event)
+
+
+def create_hub() -> NotificationHub:
+    if NOTIFICATION_BROKER_URL.startswith(("redis://", "rediss://", "unix://")):
+        return NotificationHub(RedisBroker(NOTIFICATION_BROKER_URL))
+    return NotificationHub()
+
+
+hub = create_hub()
@@ -0,0 +1,92 @@
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, or_
+from typing import Any, Callable, List, Optional, Tuple
+from datetime import datetime
+import base64
+import json
+import os
+
+# Keyset pagination for list endpoints.
+#
+# Lists are ordered newest first on (timestamp, id). A cursor is the opaque,
+# url-safe encoding of the last row's (timestamp, id); the next page is read
+# with "WHERE (ts, id) < cursor ORDER BY ts DESC, id DESC LIMIT n", which a
+# composite index on (..., ts, id) answers without scanning earlier pages.
+#
+# Paging is opt-in: requests with neither limit nor cursor get the full list
+# as before, because the web client reads whole lists and doesn't follow
+# cursors yet. The settlement summary, which the client only reads the total
+# of, always returns one page. The cursor for the next page is returned in
+# the X-Next-Cursor header and is absent on the last page.
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    raw = json.dumps([timestamp.isoformat() if timestamp else None, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(timestamp) if timestamp else None), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_size(limit: Optional[int], cursor: Optional[str]) -> Optional[int]:
+    """Effective page size, or None when the request is not paginated"""
+    if limit is None and cursor is None:
+        return None
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def keyset(query, timestamp_column, id_column, cursor: Optional[str], limit: Optional[int]):
+    """Order a query newest first and restrict it to the page after cursor"""
+    query = query.order_by(timestamp_column.desc(), id_column.desc())
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            timestamp_column < timestamp,
+            and_(timestamp_column == timestamp, id_column < row_id)
+        ))
+    if limit is not None:
+        # One extra row tells whether another page exists
+        query = query.limit(limit + 1)
+    return query
+
+
+def split_page(rows: List[Any], limit: Optional[int],
+               key: Callable[[Any], Tuple[datetime, int]]) -> Tuple[List[Any], Optional[str]]:
+    """Trim the look-ahead row and build the cursor of the next page"""
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(*key(page[-1]))
+
+
+def merge_pages(pages: List[List[Any]], limit: Optional[int],
+                key: Callable[[Any], Tuple[datetime, int]]) -> List[Any]:
+    """
+    Merge rows from several keyset queries over the same table (e.g. one per
+    side of an OR), dropping duplicates, newest first.
+    """
+    merged = {}
+    for rows in pages:
+        for row in rows:
+            merged.setdefault(key(row)[1], row)
+    ordered = sorted(merged.values(), key=lambda row: (key(row)[0] or datetime.min, key(row)[1]), reverse=True)
+    return ordered if limit is None else ordered[:limit + 1]
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
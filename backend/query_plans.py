@@ -0,0 +1,292 @@
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from typing import List, NamedTuple
+from datetime import date, datetime
+import models
+import pagination
+
+# EXPLAIN-based check of the hot queries.
+#
+# HOT_QUERIES mirrors the queries the endpoints and background jobs in
+# backend.py, ledger.py, inbox.py, analytics.py and membership.py run on every
+# request or run, with sample parameters. check_query_plans() asks the
+# database for each plan and reports the tables read with a full table or
+# index scan. Run it against a database with production-like row counts: on
+# near-empty tables MySQL may legitimately prefer a scan.
+
+SAMPLE_ID = 1
+SAMPLE_PAGE_SIZE = pagination.DEFAULT_PAGE_SIZE
+
+
+def _page(statement, timestamp_column, id_column):
+    return statement.order_by(timestamp_column.desc(), id_column.desc()).limit(SAMPLE_PAGE_SIZE + 1)
+
+
+def _group_expenses():
+    statement = select(models.Expense, models.User)\
+        .join(models.User, models.User.UserID == models.Expense.PaidByUserID)\
+        .join(models.GroupMember,
+              (models.GroupMember.GroupID == models.Expense.GroupID) &
+              (models.GroupMember.UserID == models.User.UserID))\
+        .where(models.Expense.GroupID == SAMPLE_ID, models.GroupMember.GroupID == SAMPLE_ID)
+    return _page(statement, models.Expense.Date, models.Expense.ExpenseID)
+
+
+def _pending_settlements(user_column):
+    statement = select(models.Settlement).where(user_column == SAMPLE_ID, models.Settlement.Status == "Pending")
+    return _page(statement, models.Settlement.Date, models.Settlement.SettlementID)
+
+
+def _settlement_history(user_column):
+    statement = select(models.Settlement).where(user_column == SAMPLE_ID)
+    return _page(statement, models.Settlement.Date, models.Settlement.SettlementID)
+
+
+def _group_settlements():
+    statement = select(models.Settlement).where(models.Settlement.GroupID == SAMPLE_ID)
+    return _page(statement, models.Settlement.Date, models.Settlement.SettlementID)
+
+
+def _unread_notifications():
+    statement = select(models.Notification).where(
+        models.Notification.UserID == SAMPLE_ID,
+        models.Notification.IsRead == False
+    )
+    return _page(statement, models.Notification.CreatedAt, models.Notification.NotificationID)
+
+
+def _user_group_ids():
+    return select(models.GroupMember.GroupID).where(models.GroupMember.UserID == SAMPLE_ID).scalar_subquery()
+
+
+def _dashboard_recent_expenses():
+    return select(models.Expense, models.User.Name)\
+        .join(models.User, models.User.UserID == models.Expense.PaidByUserID)\
+        .join(models.GroupMember,
+              (models.GroupMember.GroupID == models.Expense.GroupID) &
+              (models.GroupMember.UserID == models.Expense.PaidByUserID))\
+        .where(models.Expense.GroupID.in_(_user_group_ids()))\
+        .order_by(models.Expense.Date.desc(), models.Expense.ExpenseID.desc())\
+        .limit(SAMPLE_PAGE_SIZE)
+
+
+def _dashboard_last_activity():
+    return select(models.Expense.GroupID, func.max(models.Expense.Date))\
+        .where(models.Expense.GroupID.in_(_user_group_ids()))\
+        .group_by(models.Expense.GroupID)
+
+
+def _dashboard_group_sizes():
+    return select(models.GroupMember.GroupID, func.count(models.GroupMember.UserID), func.sum(models.MemberBalance.TotalPaidCents))\
+        .outerjoin(models.MemberBalance,
+                   (models.MemberBalance.GroupID == models.GroupMember.GroupID) &
+                   (models.MemberBalance.UserID == models.GroupMember.UserID))\
+        .where(models.GroupMember.GroupID.in_(_user_group_ids()))\
+        .group_by(models.GroupMember.GroupID)
+
+
+def _mark_notifications_read():
+    return update(models.Notification)\
+        .where(
+            models.Notification.UserID == SAMPLE_ID,
+            models.Notification.IsRead == False,
+            models.Notification.CreatedAt <= datetime(2000, 1, 1)
+        )\
+        .values(IsRead=True)
+
+
+def _purgeable_notifications():
+    return select(models.Notification.NotificationID)\
+        .where(models.Notification.IsRead == True, models.Notification.CreatedAt < datetime(2000, 1, 1))\
+        .order_by(models.Notification.CreatedAt, models.Notification.NotificationID)\
+        .limit(SAMPLE_PAGE_SIZE)
+
+
+def _expired_idempotency_keys():
+    return select(models.IdempotencyKey.ExpiresAt)\
+        .where(models.IdempotencyKey.ExpiresAt <= datetime(2000, 1, 1))\
+        .order_by(models.IdempotencyKey.ExpiresAt)\
+        .offset(SAMPLE_PAGE_SIZE - 1)\
+        .limit(1)
+
+
+def _user_groups():
+    return select(models.UserGroup)\
+        .join(models.GroupMember)\
+        .where(models.GroupMember.UserID == SAMPLE_ID)
+
+
+def _user_memberships():
+    return select(models.GroupMember.GroupID, models.GroupMember.IsAdmin)\
+        .where(models.GroupMember.UserID == SAMPLE_ID)
+
+
+def _group_member_ids():
+    return select(models.GroupMember.UserID).where(models.GroupMember.GroupID == SAMPLE_ID)
+
+
+def _group_balances():
+    return select(models.User.UserID, models.User.Name, models.MemberBalance.TotalPaidCents, models.MemberBalance.SettledNetCents)\
+        .join(models.GroupMember, models.GroupMember.UserID == models.User.UserID)\
+        .outerjoin(models.MemberBalance,
+                   (models.MemberBalance.GroupID == models.GroupMember.GroupID) &
+                   (models.MemberBalance.UserID == models.GroupMember.UserID))\
+        .where(models.GroupMember.GroupID == SAMPLE_ID)
+
+
+def _confirmed_settlement_totals():
+    return select(models.Settlement.PayerUserID, func.sum(models.Settlement.AmountCents))\
+        .where(models.Settlement.GroupID == SAMPLE_ID, models.Settlement.Status == "Confirmed")\
+        .group_by(models.Settlement.PayerUserID)
+
+
+def _unsettled_expense_totals():
+    return select(models.Expense.PaidByUserID, func.sum(models.Expense.AmountCents), func.max(models.Expense.ExpenseID))\
+        .where(models.Expense.GroupID == SAMPLE_ID, models.Expense.IsSettled == False)\
+        .group_by(models.Expense.PaidByUserID)
+
+
+def _mark_expenses_settled():
+    return update(models.Expense)\
+        .where(
+            models.Expense.GroupID == SAMPLE_ID,
+            models.Expense.IsSettled == False,
+            models.Expense.ExpenseID <= SAMPLE_ID
+        )\
+        .values(IsSettled=True)
+
+
+def _analytics_rollups():
+    return select(models.SpendingRollup.BucketStart, models.SpendingRollup.UserID,
+                  models.SpendingRollup.TotalCents, models.SpendingRollup.ExpenseCount)\
+        .where(
+            models.SpendingRollup.GroupID == SAMPLE_ID,
+            models.SpendingRollup.Granularity == "month",
+            models.SpendingRollup.BucketStart >= date(2000, 1, 1),
+            models.SpendingRollup.BucketStart <= date(2003, 1, 1)
+        )
+
+
+def _analytics_fallback():
+    day = func.date(models.Expense.Date)
+    return select(models.Expense.PaidByUserID, day, func.sum(models.Expense.AmountCents), func.count(models.Expense.ExpenseID))\
+        .where(
+            models.Expense.GroupID == SAMPLE_ID,
+            models.Expense.Date >= datetime(2000, 1, 1),
+            models.Expense.Date < datetime(2003, 1, 1)
+        )\
+        .group_by(models.Expense.PaidByUserID, day)
+
+
+def _settlement_batches():
+    return select(models.SettlementBatch)\
+        .where(models.SettlementBatch.GroupID == SAMPLE_ID)\
+        .order_by(models.SettlementBatch.CreatedAt.desc())\
+        .limit(SAMPLE_PAGE_SIZE)
+
+
+def _pending_totals_rebuild():
+    return select(models.Settlement.BatchID, func.sum(models.Settlement.AmountCents))\
+        .where(
+            models.Settlement.GroupID == SAMPLE_ID,
+            models.Settlement.Status.in_(("Pending", "Overdue"))
+        )\
+        .group_by(models.Settlement.BatchID)
+
+
+def _due_settlement_periods():
+    return select(models.SettlementPeriod.GroupID)\
+        .where(models.SettlementPeriod.NextSettlement <= datetime(2000, 1, 1))
+
+
+def _user_by_email():
+    return select(models.User.UserID).where(models.User.Email == "user@example.com")
+
+
+class HotQuery(NamedTuple):
+    name: str
+    build: object
+
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("GET /groups/{group_id}/expenses", _group_expenses),
+    HotQuery("GET /users/{user_id}/pending_settlements (payer)", lambda: _pending_settlements(models.Settlement.PayerUserID)),
+    HotQuery("GET /users/{user_id}/pending_settlements (receiver)", lambda: _pending_settlements(models.Settlement.ReceiverUserID)),
+    HotQuery("GET /settlements/history (payer)", lambda: _settlement_history(models.Settlement.PayerUserID)),
+    HotQuery("GET /settlements/history (receiver)", lambda: _settlement_history(models.Settlement.ReceiverUserID)),
+    HotQuery("GET /groups/{group_id}/settlements", _group_settlements),
+    HotQuery("GET /notifications", _unread_notifications),
+    HotQuery("PUT /notifications/read", _mark_notifications_read),
+    HotQuery("notification retention: purgeable rows", _purgeable_notifications),
+    HotQuery("idempotency sweeper: expired keys", _expired_idempotency_keys),
+    HotQuery("GET /groups", _user_groups),
+    HotQuery("GET /me/dashboard: recent expenses", _dashboard_recent_expenses),
+    HotQuery("GET /me/dashboard: last activity", _dashboard_last_activity),
+    HotQuery("GET /me/dashboard: group sizes and totals", _dashboard_group_sizes),
+    HotQuery("membership check", _user_memberships),
+    HotQuery("group member ids", _group_member_ids),
+    HotQuery("GET /groups/{group_id}/balances", _group_balances),
+    HotQuery("GET /groups/{group_id}/analytics", _analytics_rollups),
+    HotQuery("GET /groups/{group_id}/analytics: SQL fallback", _analytics_fallback),
+    HotQuery("GET /groups/{group_id}/settlement-batches", _settlement_batches),
+    HotQuery("ledger rebuild: confirmed settlements", _confirmed_settlement_totals),
+    HotQuery("settlements rebuild: unpaid totals", _pending_totals_rebuild),
+    HotQuery("periodic settlement: unsettled totals", _unsettled_expense_totals),
+    HotQuery("periodic settlement: mark expenses settled", _mark_expenses_settled),
+    HotQuery("scheduler: due periods", _due_settlement_periods),
+    HotQuery("login / token lookup by email", _user_by_email),
+]
+
+
+class PlanResult(NamedTuple):
+    name: str
+    full_scans: List[str]
+    plan: List[str]
+
+
+def _compile(connection: Connection, statement) -> str:
+    return str(statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True}))
+
+
+def explain(connection: Connection, statement) -> List[dict]:
+    sql = _compile(connection, statement)
+    prefix = "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    result = connection.exec_driver_sql(prefix + sql)
+    return [dict(row._mapping) for row in result]
+
+
+def full_scans(dialect_name: str, plan: List[dict]) -> List[str]:
+    """Tables a plan reads with a full table or full index scan"""
+    scans = []
+    for row in plan:
+        if dialect_name == "sqlite":
+            detail = row.get("detail", "")
+            # "SCAN t" / "SCAN t USING INDEX ..." read the whole table or index;
+            # "SEARCH t USING INDEX ..." is a seek
+            if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail:
+                scans.append(detail[len("SCAN "):])
+        else:
+            access_type = (row.get("type") or "").upper()
+            if access_type in ("ALL", "INDEX"):
+                scans.append(f"{row.get('table')} ({access_type})")
+    return scans
+
+
+def _format_plan(dialect_name: str, plan: List[dict]) -> List[str]:
+    if dialect_name == "sqlite":
+        return [row.get("detail", "") for row in plan]
+    return [
+        f"{row.get('table')}: type={row.get('type')} key={row.get('key')} rows={row.get('rows')} {row.get('Extra') or ''}".rstrip()
+        for row in plan
+    ]
+
+
+def check_query_plans(db: Session) -> List[PlanResult]:
+    connection = db.connection()
+    dialect_name = connection.dialect.name
+    results = []
+    for query in HOT_QUERIES:
+        plan = explain(connection, query.build())
+        results.append(PlanResult(query.name, full_scans(dialect_name, plan), _format_plan(dialect_name, plan)))
+    return results
@@ -0,0 +1,326 @@
+"""
+RoomiePay maintenance commands.
+
+Usage:
+    python roomiepay.py ledger rebuild [--group GROUP_ID]
+    python roomiepay.py ledger verify [--group GROUP_ID]
+    python roomiepay.py analytics rebuild [--group GROUP_ID]
+    python roomiepay.py analytics verify [--group GROUP_ID]
+    python roomiepay.py settlements rebuild [--group GROUP_ID]
+    python roomiepay.py settlements verify [--group GROUP_ID]
+    python roomiepay.py notifications rebuild
+    python roomiepay.py notifications verify
+    python roomiepay.py notifications purge [--days DAYS] [--batch-size N]
+    python roomiepay.py idempotency purge [--batch-size N]
+    python roomiepay.py db init
+    python roomiepay.py db upgrade [--to VERSION]
+    python roomiepay.py db status
+    python roomiepay.py db explain
+"""
+import argparse
+import sys
+
+
+def ledger_rebuild(args):
+    import ledger
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for group_id in ledger.group_ids(db, args.group):
+            totals = ledger.rebuild_group(db, group_id)
+            db.commit()
+            print(f"Rebuilt ledger for group {group_id} ({len(totals)} members)")
+    finally:
+        db.close()
+    return 0
+
+
+def ledger_verify(args):
+    import ledger
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        failures = 0
+        for group_id in ledger.group_ids(db, args.group):
+            mismatches = ledger.verify_group(db, group_id)
+            for mismatch in mismatches:
+                print(f"Group {group_id}, user {mismatch['UserID']}: "
+                      f"expected {mismatch['expected']}, stored {mismatch['stored']}")
+            failures += len(mismatches)
+        print("Ledger OK" if not failures else f"{failures} ledger rows out of sync")
+    finally:
+        db.close()
+    return 1 if failures else 0
+
+
+def analytics_rebuild(args):
+    import analytics
+    import ledger
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for group_id in ledger.group_ids(db, args.group):
+            rows = analytics.rebuild_group(db, group_id)
+            db.commit()
+            print(f"Rebuilt spending rollups for group {group_id} ({rows} rows)")
+    finally:
+        db.close()
+    return 0
+
+
+def analytics_verify(args):
+    import analytics
+    import ledger
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        failures = 0
+        for group_id in ledger.group_ids(db, args.group):
+            mismatches = analytics.verify_group(db, group_id)
+            for mismatch in mismatches:
+                print(f"Group {group_id}, bucket {mismatch['Bucket']}: "
+                      f"expected {mismatch['expected']}, stored {mismatch['stored']}")
+            failures += len(mismatches)
+        print("Spending rollups OK" if not failures else f"{failures} rollup rows out of sync")
+    finally:
+        db.close()
+    return 1 if failures else 0
+
+
+def settlements_rebuild(args):
+    import ledger
+    import money
+    import settlement_totals
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        for group_id in ledger.group_ids(db, args.group):
+            pending = settlement_totals.rebuild_group(db, group_id)
+            total = settlement_totals.rebuild_total(db, group_id)
+            db.commit()
+            print(f"Rebuilt settlement totals for group {group_id} ({money.from_cents(pending)} pending of {money.from_cents(total)})")
+    finally:
+        db.close()
+    return 0
+
+
+def settlements_verify(args):
+    import ledger
+    import settlement_totals
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        failures = 0
+        for group_id in ledger.group_ids(db, args.group):
+            mismatches = settlement_totals.verify_group(db, group_id)
+            for mismatch in mismatches:
+                print(f"Group {group_id}, {mismatch['Total']}: expected {mismatch['expected']}, stored {mismatch['stored']}")
+            failures += len(mismatches)
+        print("Settlement totals OK" if not failures else f"{failures} settlement totals out of sync")
+    finally:
+        db.close()
+    return 1 if failures else 0
+
+
+def notifications_rebuild(args):
+    import inbox
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        users = inbox.rebuild_counters(db)
+        db.commit()
+        print(f"Rebuilt unread counters for {users} users")
+    finally:
+        db.close()
+    return 0
+
+
+def notifications_verify(args):
+    import inbox
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        mismatches = inbox.verify_counters(db)
+        for mismatch in mismatches:
+            print(f"User {mismatch['UserID']}: expected {mismatch['expected']}, stored {mismatch['stored']}")
+        print("Unread counters OK" if not mismatches else f"{len(mismatches)} unread counters out of sync")
+    finally:
+        db.close()
+    return 1 if mismatches else 0
+
+
+def notifications_purge(args):
+    import inbox
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        days = inbox.NOTIFICATION_RETENTION_DAYS if args.days is None else args.days
+        batch_size = args.batch_size or inbox.NOTIFICATION_RETENTION_BATCH
+        purged = inbox.purge_read_notifications(db, days, batch_size)
+        print(f"Purged {purged} read notifications older than {days:g} days")
+    finally:
+        db.close()
+    return 0
+
+
+def idempotency_purge(args):
+    import idempotency
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        purged = idempotency.purge_expired_keys(db, args.batch_size or idempotency.IDEMPOTENCY_SWEEP_BATCH)
+        print(f"Purged {purged} expired idempotency keys")
+    finally:
+        db.close()
+    return 0
+
+
+def db_init(args):
+    import database
+    import migrations
+
+    if not database.DATABASE_URL:
+        database.create_database()
+    migrations.upgrade(database.get_engine())
+    print("Database initialized")
+    return 0
+
+
+def db_upgrade(args):
+    import migrations
+    from database import get_engine
+
+    applied = migrations.upgrade(get_engine(), target=args.to)
+    if not applied:
+        print("Schema is up to date")
+    return 0
+
+
+def db_status(args):
+    import migrations
+    from database import get_engine
+
+    with get_engine().connect() as connection:
+        version = migrations.current_version(connection)
+    print(f"Schema version {version} (latest {migrations.LATEST_VERSION})")
+    for migration in migrations.MIGRATIONS:
+        if migration.version > version:
+            print(f"  pending {migration.version}: {migration.name}")
+    return 0 if version >= migrations.LATEST_VERSION else 1
+
+
+def db_explain(args):
+    import query_plans
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        results = query_plans.check_query_plans(db)
+    finally:
+        db.close()
+
+    failures = 0
+    for result in results:
+        status = "FULL SCAN" if result.full_scans else "ok"
+        print(f"[{status}] {result.name}")
+        for line in result.plan:
+            print(f"    {line}")
+        failures += bool(result.full_scans)
+    print("All hot queries use indexes" if not failures else f"{failures} queries use a full scan")
+    return 1 if failures else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="roomiepay", description="RoomiePay maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ledger_parser = commands.add_parser("ledger", help="Maintain the materialized balance ledger")
+    ledger_commands = ledger_parser.add_subparsers(dest="action", required=True)
+
+    rebuild = ledger_commands.add_parser("rebuild", help="Recompute ledger rows from expenses and settlements")
+    rebuild.add_argument("--group", type=int, help="Only rebuild this group")
+    rebuild.set_defaults(func=ledger_rebuild)
+
+    verify = ledger_commands.add_parser("verify", help="Compare ledger rows against a full recomputation")
+    verify.add_argument("--group", type=int, help="Only verify this group")
+    verify.set_defaults(func=ledger_verify)
+
+    analytics_parser = commands.add_parser("analytics", help="Maintain the spending analytics rollups")
+    analytics_commands = analytics_parser.add_subparsers(dest="action", required=True)
+
+    rebuild = analytics_commands.add_parser("rebuild", help="Recompute the rollups from the expenses")
+    rebuild.add_argument("--group", type=int, help="Only rebuild this group")
+    rebuild.set_defaults(func=analytics_rebuild)
+
+    verify = analytics_commands.add_parser("verify", help="Compare the rollups against a full recomputation")
+    verify.add_argument("--group", type=int, help="Only verify this group")
+    verify.set_defaults(func=analytics_verify)
+
+    settlements_parser = commands.add_parser("settlements", help="Maintain the settlement totals")
+    settlements_commands = settlements_parser.add_subparsers(dest="action", required=True)
+
+    rebuild = settlements_commands.add_parser("rebuild", help="Recompute the pending and settlement totals from the settlements")
+    rebuild.add_argument("--group", type=int, help="Only rebuild this group")
+    rebuild.set_defaults(func=settlements_rebuild)
+
+    verify = settlements_commands.add_parser("verify", help="Compare the pending and settlement totals against the settlements")
+    verify.add_argument("--group", type=int, help="Only verify this group")
+    verify.set_defaults(func=settlements_verify)
+
+    notifications_parser = commands.add_parser("notifications", help="Maintain the notification inbox")
+    notifications_commands = notifications_parser.add_subparsers(dest="action", required=True)
+
+    rebuild = notifications_commands.add_parser("rebuild", help="Recompute the unread counters from the notifications")
+    rebuild.set_defaults(func=notifications_rebuild)
+
+    verify = notifications_commands.add_parser("verify", help="Compare the unread counters against the notifications")
+    verify.set_defaults(func=notifications_verify)
+
+    purge = notifications_commands.add_parser("purge", help="Delete old read notifications in batches")
+    purge.add_argument("--days", type=float, default=None, help="Retention age (default NOTIFICATION_RETENTION_DAYS)")
+    purge.add_argument("--batch-size", type=int, default=None, help="Rows per transaction (default NOTIFICATION_RETENTION_BATCH)")
+    purge.set_defaults(func=notifications_purge)
+
+    idempotency_parser = commands.add_parser("idempotency", help="Maintain the idempotency keys of write requests")
+    idempotency_commands = idempotency_parser.add_subparsers(dest="action", required=True)
+
+    purge = idempotency_commands.add_parser("purge", help="Delete expired idempotency keys in batches")
+    purge.add_argument("--batch-size", type=int, default=None, help="Rows per transaction (default IDEMPOTENCY_SWEEP_BATCH)")
+    purge.set_defaults(func=idempotency_purge)
+
+    db_parser = commands.add_parser("db", help="Manage the database schema")
+    db_commands = db_parser.add_subparsers(dest="action", required=True)
+
+    init = db_commands.add_parser("init", help="Create the database if needed and apply all migrations")
+    init.set_defaults(func=db_init)
+
+    upgrade = db_commands.add_parser("upgrade", help="Apply pending schema migrations")
+    upgrade.add_argument("--to", type=int, help="Stop after this migration version")
+    upgrade.set_defaults(func=db_upgrade)
+
+    status = db_commands.add_parser("status", help="Show the schema version and pending migrations")
+    status.set_defaults(func=db_status)
+
+    explain = db_commands.add_parser("explain", help="Check that the hot queries use indexes (EXPLAIN)")
+    explain.set_defaults(func=db_explain)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
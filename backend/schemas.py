@@ -1,7 +1,11 @@
-from pydantic import BaseModel, EmailStr, constr
-from typing import Optional, List, Dict
-from datetime import datetime
+from pydantic import AfterValidator, BaseModel, EmailStr, constr
+from typing import Annotated, Literal, Optional, List, Dict
+from datetime import date, datetime
 from decimal import Decimal
+import money
+
+# Amounts in currency units, rounded to the cent they are stored as
+Money = Annotated[Decimal, AfterValidator(money.quantize)]
 
 class UserBase(BaseModel):
     Name: str
@@ -40,7 +44,7 @@ class Group(GroupBase):
 
 class ExpenseCreate(BaseModel):
     GroupID: int
-    Amount: Decimal
+    Amount: Money
     Description: str
     PaidByUserID: Optional[int] = None  # Make PaidByUserID optional
 
@@ -62,6 +66,18 @@ class ExpenseResponse(Expense):
     class Config:
         from_attributes = True
 
+class ExpenseImportError(BaseModel):
+    Row: int
+    LastRow: Optional[int] = None  # Set when a whole batch of rows failed
+    Error: str
+
+class ExpenseImportResult(BaseModel):
+    GroupID: int
+    Imported: int
+    Failed: int
+    Errors: List[ExpenseImportError]
+    ErrorsTruncated: bool = False
+
 class TimeFilterParams(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
@@ -71,7 +87,7 @@ class SettlementBase(BaseModel):
     GroupID: int
     PayerUserID: int
     ReceiverUserID: int
-    Amount: Decimal
+    Amount: Money
     PaymentMethod: Optional[str] = None
     DueDate: Optional[datetime] = None
 
@@ -82,6 +98,7 @@ class Settlement(SettlementBase):
     SettlementID: int
     Date: datetime
     Status: str
+    BatchID: Optional[str] = None  # Periodic settlement run that created it
 
     class Config:
         from_attributes = True
@@ -91,7 +108,7 @@ class DetailedSettlement(BaseModel):
     GroupID: int
     PayerUserID: int
     ReceiverUserID: int
-    Amount: Decimal
+    Amount: Money
     Status: str
     Date: datetime
     DueDate: datetime
@@ -105,9 +122,24 @@ class DetailedSettlement(BaseModel):
 
 class SettlementSummary(BaseModel):
     Period: str
-    TotalAmount: Decimal
+    TotalAmount: Money
     Settlements: List[Settlement]
 
+class SettlementBatch(BaseModel):
+    BatchID: str
+    GroupID: int
+    CreatedAt: datetime
+    SettlementCount: int
+    Total: Money  # Settled by the run
+    Pending: Money  # Still unpaid
+
+class PendingSettlementSummary(BaseModel):
+    GroupID: int
+    TotalPending: Money
+    LastSettlement: Optional[datetime] = None
+    NextSettlement: Optional[datetime] = None
+    LastBatch: Optional[SettlementBatch] = None
+
 class InvitationBase(BaseModel):
     GroupID: int
     RecipientEmail: EmailStr
@@ -135,18 +167,54 @@ class TokenData(BaseModel):
 class Balance(BaseModel):
     UserID: int
     Name: str
-    OwesAmount: Decimal
-    IsOwedAmount: Decimal
-    NetBalance: Decimal
+    OwesAmount: Money
+    IsOwedAmount: Money
+    NetBalance: Money
 
 class GroupBalance(BaseModel):
     GroupID: int
     GroupName: str
     Members: List[Balance]
 
+class AnalyticsBucket(BaseModel):
+    BucketStart: date  # First day of the day, week (Monday) or month
+    Total: Money
+    ExpenseCount: int
+    Members: Dict[int, Money]  # Spend per paying UserID
+
+class GroupAnalytics(BaseModel):
+    GroupID: int
+    Granularity: str
+    Start: Optional[date] = None  # First bucket of the requested range
+    End: Optional[date] = None  # Last bucket of the requested range
+    Total: Money
+    Buckets: List[AnalyticsBucket]
+
 class SplitExpense(ExpenseCreate):
-    SplitType: str = "EQUAL"  # EQUAL or PERCENTAGE
-    Splits: Optional[Dict[int, float]] = None  # UserID to percentage/amount mapping
+    SplitType: Literal["EQUAL", "PERCENTAGE", "EXACT", "SHARES"] = "EQUAL"
+    Splits: Optional[Dict[int, Decimal]] = None  # UserID to participation, percentage, amount or shares
+
+class DashboardGroup(Group):
+    MemberCount: int
+    NetBalance: Money  # The current user's balance in the group, negative when they owe
+    LastActivity: Optional[datetime] = None  # Date of the latest expense
+
+class DashboardExpense(BaseModel):
+    ExpenseID: int
+    GroupID: int
+    GroupName: str
+    PaidByUserID: int
+    PaidByName: str
+    Amount: Money
+    Description: str
+    Date: datetime
+    IsSettled: bool
+
+class Dashboard(BaseModel):
+    Groups: List[DashboardGroup]
+    RecentExpenses: List[DashboardExpense]
+    PendingSettlements: List[DetailedSettlement]
+    UnreadNotifications: int
 
 class NotificationBase(BaseModel):
     UserID: int
@@ -161,6 +229,13 @@ class Notification(NotificationBase):
     class Config:
         from_attributes = True
 
+class NotificationsRead(BaseModel):
+    NotificationIDs: Optional[List[int]] = None  # Mark these notifications as read
+    Before: Optional[datetime] = None  # Or every notification created up to this time
+
+class UnreadCount(BaseModel):
+    UnreadCount: int
+
 class SettlementPeriod(BaseModel):
     GroupID: int
     Period: str  # "1h", "1d", "1w", "1m" for hour, day, week, month
@@ -168,4 +243,4 @@ class SettlementPeriod(BaseModel):
     NextSettlement: Optional[datetime] = None
 
 class PaymentProcess(BaseModel):
-    amount: Decimal
\ No newline at end of file
+    amount: Money
\ No newline at end of file
@@ -1,13 +1,22 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from dataclasses import dataclass
+from collections import OrderedDict
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
+from sqlalchemy import event
 from database import get_db
 import models
+import metrics
+import logging
 import os
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -25,6 +34,84 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# bcrypt runs in a dedicated, bounded worker pool so a burst of logins never
+# blocks the event loop. Requests beyond the queue limit are rejected with 503.
+PASSWORD_POOL_KIND = os.getenv("PASSWORD_POOL_KIND", "thread").lower()  # "thread" or "process"
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", str(PASSWORD_POOL_WORKERS * 8)))
+PASSWORD_POOL_RETRY_AFTER = os.getenv("PASSWORD_POOL_RETRY_AFTER", "1")
+
+_password_pool = None
+_password_pool_lock = threading.Lock()
+_password_in_flight = 0
+
+password_hash_seconds = metrics.Histogram(
+    "roomiepay_password_hash_seconds",
+    "Time to hash or verify a password, including time queued for a worker",
+    labels=("operation",),
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.5, 5.0)
+)
+password_pool_rejections = metrics.Counter(
+    "roomiepay_password_pool_rejections_total",
+    "Password operations rejected because the worker pool queue was full",
+    labels=("operation",)
+)
+metrics.Gauge(
+    "roomiepay_password_pool_in_flight",
+    "Password operations queued or running",
+    callback=lambda: _password_in_flight
+)
+metrics.Gauge(
+    "roomiepay_password_pool_queue_depth",
+    "Password operations waiting for a free worker",
+    callback=lambda: max(_password_in_flight - PASSWORD_POOL_WORKERS, 0)
+)
+
+def _get_password_pool():
+    global _password_pool
+    if _password_pool is None:
+        with _password_pool_lock:
+            if _password_pool is None:
+                if PASSWORD_POOL_KIND == "process":
+                    _password_pool = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+                else:
+                    _password_pool = ThreadPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, thread_name_prefix="password")
+    return _password_pool
+
+async def _run_password_operation(operation: str, func, *args):
+    global _password_in_flight
+    with _password_pool_lock:
+        if _password_in_flight >= PASSWORD_POOL_WORKERS + PASSWORD_POOL_MAX_QUEUE:
+            password_pool_rejections.inc(operation=operation)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": PASSWORD_POOL_RETRY_AFTER},
+            )
+        _password_in_flight += 1
+
+    start = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_password_pool(), func, *args)
+    finally:
+        password_hash_seconds.observe(time.perf_counter() - start, operation=operation)
+        with _password_pool_lock:
+            _password_in_flight -= 1
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_password_operation("verify", verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_password_operation("hash", get_password_hash, password)
+
+def shutdown_password_pool():
+    global _password_pool
+    with _password_pool_lock:
+        if _password_pool is not None:
+            _password_pool.shutdown(wait=False, cancel_futures=True)
+            _password_pool = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -35,8 +122,102 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    print(f"Verifying token: {token[:10]}...")
+# Token checks are logged at DEBUG on the "roomiepay.auth" logger, so they
+# stay out of the request path unless that logger is switched to DEBUG
+auth_logger = logging.getLogger("roomiepay.auth")
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Lightweight, cacheable snapshot of the authenticated user"""
+    UserID: int
+    Name: str
+    Email: str
+    Phone: Optional[str] = None
+    JoinDate: Optional[datetime] = None
+
+class TokenUserCache:
+    """
+    LRU cache of token -> CurrentUser with a TTL. Entries never outlive the
+    token's own expiry, and every entry of a user can be dropped at once.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # token -> (expires_at, CurrentUser)
+        self._tokens_by_user = {}  # UserID -> set of tokens
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[CurrentUser]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= now:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, user: CurrentUser, token_expiry: Optional[float] = None):
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        if token_expiry is not None:
+            expires_at = min(expires_at, time.monotonic() + (token_expiry - time.time()))
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (expires_at, user)
+            self._tokens_by_user.setdefault(user.UserID, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, token: str):
+        _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user.UserID)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user.UserID]
+
+token_user_cache = TokenUserCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("AUTH_CACHE_TTL", "60"))
+)
+
+def invalidate_user_cache(user_id: int):
+    """Drop cached auth entries of a user, e.g. after changing their record"""
+    token_user_cache.invalidate_user(user_id)
+
+# Any ORM update or delete of a user invalidates their cached tokens
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user_cache(target.UserID)
+
+def resolve_current_user(token: str, db: Session) -> CurrentUser:
+    """Authenticate a bearer token, raising 401 when it is invalid"""
+    cached = token_user_cache.get(token)
+    if cached is not None:
+        return cached
+    
+    auth_logger.debug("Verifying token: %s...", token[:10])
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -45,16 +226,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        print(f"Token email: {email}")
+        auth_logger.debug("Token email: %s", email)
         if email is None:
             raise credentials_exception
     except JWTError as e:
-        print(f"JWT Error: {str(e)}")
+        auth_logger.debug("JWT Error: %s", e)
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.Email == email).first()
+    user = db.query(models.User.UserID, models.User.Name, models.User.Email, models.User.Phone, models.User.JoinDate)\
+        .filter(models.User.Email == email).first()
     if user is None:
-        print(f"No user found for email: {email}")
+        auth_logger.debug("No user found for email: %s", email)
         raise credentials_exception
-    print(f"Found user: {user.UserID} ({user.Name})")
-    return user
\ No newline at end of file
+    auth_logger.debug("Found user: %s (%s)", user.UserID, user.Name)
+    
+    current_user = CurrentUser(
+        UserID=user.UserID,
+        Name=user.Name,
+        Email=user.Email,
+        Phone=user.Phone,
+        JoinDate=user.JoinDate
+    )
+    token_user_cache.put(token, current_user, payload.get("exp"))
+    return current_user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return resolve_current_user(token, db)
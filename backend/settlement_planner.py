@@ -0,0 +1,206 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, insert, update
+from typing import Dict, List, NamedTuple, Optional
+from decimal import Decimal
+from datetime import datetime
+import heapq
+import os
+import models
+import money
+import settlement_totals
+import settlement_status
+
+# Settlement planning for finalize-splits.
+#
+# Balances are planned as integer cents (see money.py), so the planner never
+# compares Decimals against float thresholds and every plan settles the group
+# down to the exact cent. Two planners are available:
+#   - greedy_plan: repeatedly matches the largest debtor with the largest
+#     creditor using two max-heaps, at most n - 1 transfers in O(n log n).
+#   - exact_plan: the minimum number of transfers, found by splitting the
+#     group into the largest number of independent zero-sum subsets. This is
+#     exponential in the number of participants, so it is only used for small
+#     groups (EXACT_MAX_PARTICIPANTS).
+
+EXACT_MAX_PARTICIPANTS = int(os.getenv("SETTLEMENT_EXACT_MAX_PARTICIPANTS", "12"))
+
+class Transfer(NamedTuple):
+    PayerUserID: int
+    ReceiverUserID: int
+    Cents: int
+
+    @property
+    def Amount(self) -> Decimal:
+        return money.from_cents(self.Cents)
+
+
+def greedy_plan(cents: Dict[int, int]) -> List[Transfer]:
+    # Python only has a min-heap, so amounts are pushed negated
+    debtors = [(amount, user_id) for user_id, amount in cents.items() if amount < 0]
+    creditors = [(-amount, user_id) for user_id, amount in cents.items() if amount > 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        debt, debtor_id = heapq.heappop(debtors)
+        credit, creditor_id = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        transfers.append(Transfer(debtor_id, creditor_id, amount))
+
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+
+    return transfers
+
+
+def _zero_sum_subsets(participants: List[int], cents: Dict[int, int]) -> List[List[int]]:
+    # best[mask] is the largest number of disjoint zero-sum subsets that the
+    # participants in mask can be split into
+    n = len(participants)
+    full = (1 << n) - 1
+    amounts = [cents[user_id] for user_id in participants]
+
+    totals = [0] * (full + 1)
+    best = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low_bit = (mask & -mask).bit_length() - 1
+        totals[mask] = totals[mask & (mask - 1)] + amounts[low_bit]
+        closes_subset = 1 if totals[mask] == 0 else 0
+        best[mask] = max(best[mask ^ (1 << i)] for i in range(n) if mask >> i & 1) + closes_subset
+
+    # Walk back from the full set; the removal order has a zero prefix sum at
+    # every subset boundary
+    order = []
+    mask = full
+    while mask:
+        closes_subset = 1 if totals[mask] == 0 else 0
+        for i in range(n):
+            if mask >> i & 1 and best[mask] == best[mask ^ (1 << i)] + closes_subset:
+                order.append(participants[i])
+                mask ^= 1 << i
+                break
+    order.reverse()
+
+    subsets, current, running = [], [], 0
+    for user_id in order:
+        current.append(user_id)
+        running += cents[user_id]
+        if running == 0:
+            subsets.append(current)
+            current = []
+    if current:
+        subsets.append(current)
+    return subsets
+
+
+def exact_plan(cents: Dict[int, int]) -> List[Transfer]:
+    participants = sorted(user_id for user_id, amount in cents.items() if amount != 0)
+    if len(participants) > EXACT_MAX_PARTICIPANTS:
+        raise ValueError(
+            f"Exact planning supports at most {EXACT_MAX_PARTICIPANTS} participants, got {len(participants)}"
+        )
+
+    # A zero-sum subset of k people can always be settled with k - 1 transfers
+    transfers = []
+    for subset in _zero_sum_subsets(participants, cents):
+        transfers.extend(greedy_plan({user_id: cents[user_id] for user_id in subset}))
+    return transfers
+
+
+def plan_settlements(cents: Dict[int, int], exact: Optional[bool] = None) -> List[Transfer]:
+    """
+    Plan the transfers that settle a group's net balances in cents, which
+    must sum to zero (ledger.get_member_net_cents).
+    With exact=None the exact planner is used whenever the group is small enough.
+    """
+    participants = sum(1 for amount in cents.values() if amount != 0)
+    if exact is None:
+        exact = participants <= EXACT_MAX_PARTICIPANTS
+    return exact_plan(cents) if exact else greedy_plan(cents)
+
+
+def persist_plan(db: Session, group_id: int, transfers: List[Transfer], due_date: datetime) -> Dict[tuple, models.Settlement]:
+    """
+    Write a plan inside the caller's transaction: pending settlements that
+    already exist for a (payer, receiver) pair are updated in one executemany
+    (raising SettlementConflict if any of them changed since they were read),
+    new pairs are inserted in one multi-row INSERT, and the pending totals
+    follow the changed amounts. Returns the persisted settlements keyed by
+    (payer, receiver).
+    The caller commits.
+    """
+    # DATETIME columns drop microseconds; keep due_date comparable after the write
+    due_date = due_date.replace(microsecond=0)
+
+    pending = db.query(models.Settlement.SettlementID, models.Settlement.PayerUserID, models.Settlement.ReceiverUserID,
+                       models.Settlement.AmountCents, models.Settlement.BatchID, models.Settlement.Version)\
+        .filter(
+            models.Settlement.GroupID == group_id,
+            models.Settlement.Status == "Pending"
+        ).order_by(models.Settlement.SettlementID).all()
+    pending_by_pair = {}
+    for settlement_id, payer_id, receiver_id, amount_cents, batch_id, version in pending:
+        pending_by_pair.setdefault((payer_id, receiver_id), (settlement_id, amount_cents, batch_id, version))
+
+    # Pending total changes, per batch of the updated settlements
+    updates, inserts, deltas = [], [], {}
+    for transfer in transfers:
+        pair = (transfer.PayerUserID, transfer.ReceiverUserID)
+        if pair in pending_by_pair:
+            settlement_id, amount_cents, batch_id, version = pending_by_pair[pair]
+            updates.append({
+                "b_id": settlement_id,
+                "b_version": version,
+                "b_amount": transfer.Cents,
+                "b_due_date": due_date
+            })
+            deltas[batch_id] = deltas.get(batch_id, 0) + transfer.Cents - amount_cents
+        else:
+            inserts.append({
+                "GroupID": group_id,
+                "PayerUserID": transfer.PayerUserID,
+                "ReceiverUserID": transfer.ReceiverUserID,
+                "AmountCents": transfer.Cents,
+                "DueDate": due_date,
+                "Status": "Pending"
+            })
+
+    if updates:
+        # Only while still pending at the Version read; bumping it makes
+        # payments of the old amount that are in flight conflict
+        settlements = models.Settlement.__table__
+        updated = db.execute(
+            update(settlements)
+                .where(
+                    settlements.c.SettlementID == bindparam("b_id"),
+                    settlements.c.Version == bindparam("b_version"),
+                    settlements.c.Status == "Pending"
+                )
+                .values(Amount=bindparam("b_amount"), DueDate=bindparam("b_due_date"), Version=settlements.c.Version + 1),
+            updates
+        ).rowcount
+        if updated != len(updates):
+            raise settlement_status.SettlementConflict("Pending settlements were changed by another request")
+    if inserts:
+        db.execute(insert(models.Settlement), inserts)
+        deltas[None] = deltas.get(None, 0) + sum(row["AmountCents"] for row in inserts)
+    for batch_id, cents in deltas.items():
+        settlement_totals.adjust_pending(db, group_id, cents, batch_id, total_cents=cents)
+
+    pairs = {(transfer.PayerUserID, transfer.ReceiverUserID) for transfer in transfers}
+    persisted = {}
+    if pairs:
+        rows = db.query(models.Settlement)\
+            .filter(
+                models.Settlement.GroupID == group_id,
+                models.Settlement.Status == "Pending",
+                models.Settlement.DueDate == due_date
+            ).order_by(models.Settlement.SettlementID).all()
+        for settlement in rows:
+            pair = (settlement.PayerUserID, settlement.ReceiverUserID)
+            if pair in pairs:
+                persisted.setdefault(pair, settlement)
+    return persisted
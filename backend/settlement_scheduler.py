@@ -0,0 +1,200 @@
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Optional
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import heapq
+import os
+import threading
+import time
+import models
+import metrics
+from database import run_blocking
+
+# Due-time scheduler for periodic settlements.
+#
+# Instead of polling SettlementPeriods every minute, the next due time of
+# every group is kept in an in-memory min-heap. The scheduler sleeps until the
+# earliest one, runs each due group through the process callback (which uses
+# its own session and transaction and returns the group's new due time) and
+# pushes it back. Changing a period calls schedule(), which wakes the loop if
+# the new time is earlier than what it is sleeping for.
+#
+# Due groups are independent, so they are settled concurrently on a pool of
+# SETTLEMENT_WORKERS threads while the loop keeps watching the heap.
+#
+# Heap entries are never removed in place; an entry is stale when it no
+# longer matches the group's current due time in _due, and is skipped. The
+# heap is reloaded from the database every SETTLEMENT_SCHEDULER_RESYNC seconds
+# to pick up periods changed by other workers.
+
+SCHEDULER_RESYNC_SECONDS = float(os.getenv("SETTLEMENT_SCHEDULER_RESYNC", "300"))
+SCHEDULER_RETRY_SECONDS = float(os.getenv("SETTLEMENT_SCHEDULER_RETRY", "60"))
+SETTLEMENT_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", "4"))
+
+PERIOD_UNITS = {
+    'h': lambda n: timedelta(hours=n),
+    'd': lambda n: timedelta(days=n),
+    'w': lambda n: timedelta(weeks=n),
+    'm': lambda n: timedelta(days=n * 30),
+}
+
+settlement_runs = metrics.Counter(
+    "roomiepay_settlement_runs_total",
+    "Periodic settlement runs of a single group",
+    labels=("result",)
+)
+settlement_run_lag_seconds = metrics.Histogram(
+    "roomiepay_settlement_run_lag_seconds",
+    "Delay between a group's due time and the start of its settlement run",
+    buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+)
+
+
+def next_settlement_time(period: str, now: datetime) -> datetime:
+    """Due time of the next settlement for a period like '1h', '2d', '1w' or '1m'"""
+    return now + PERIOD_UNITS[period[-1]](int(period[:-1]))
+
+
+class SettlementScheduler:
+    def __init__(self, process_group: Callable[[int], Optional[datetime]]):
+        # process_group(group_id) settles one group and returns its next due time
+        self.process_group = process_group
+        self._heap = []  # (due time, GroupID)
+        self._due: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopped = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks = set()
+        self._running = set()  # GroupIDs being settled right now
+
+        metrics.Gauge(
+            "roomiepay_settlement_groups_scheduled",
+            "Groups with a scheduled periodic settlement",
+            callback=lambda: len(self._due)
+        )
+
+    def load(self, db: Session):
+        """Replace the schedule with the due times stored in SettlementPeriods"""
+        rows = db.query(models.SettlementPeriod.GroupID, models.SettlementPeriod.NextSettlement)\
+            .filter(models.SettlementPeriod.NextSettlement != None)\
+            .all()
+        with self._lock:
+            self._due = {group_id: next_settlement for group_id, next_settlement in rows}
+            self._heap = [(next_settlement, group_id) for group_id, next_settlement in self._due.items()]
+            heapq.heapify(self._heap)
+        self._wake()
+
+    def schedule(self, group_id: int, due: Optional[datetime]):
+        """Set (or with None, clear) the due time of a group; safe from any thread"""
+        with self._lock:
+            if due is None:
+                self._due.pop(group_id, None)
+                return
+            self._due[group_id] = due
+            heapq.heappush(self._heap, (due, group_id))
+            earliest = self._heap[0][0] == due
+        if earliest:
+            self._wake()
+
+    def __len__(self):
+        return len(self._due)
+
+    def _wake(self):
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _peek(self) -> Optional[datetime]:
+        with self._lock:
+            while self._heap:
+                due, group_id = self._heap[0]
+                if self._due.get(group_id) == due:
+                    return due
+                heapq.heappop(self._heap)
+            return None
+
+    def _pop_due(self, now: datetime):
+        due_groups = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, group_id = heapq.heappop(self._heap)
+                if self._due.get(group_id) == due:
+                    del self._due[group_id]
+                    if group_id in self._running:
+                        # Re-added by a resync; the running settlement reschedules it
+                        continue
+                    self._running.add(group_id)
+                    due_groups.append((group_id, due))
+        return due_groups
+
+    async def _reload(self, load_schedule: Callable[[], None]):
+        try:
+            await run_blocking(load_schedule)
+        except Exception as e:
+            print(f"Error loading settlement schedule: {e}")
+
+    async def run(self, load_schedule: Callable[[], None]):
+        """
+        Scheduler loop; load_schedule() must call load() with a fresh session.
+        Runs until stop() is called.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await self._reload(load_schedule)
+        next_resync = time.monotonic() + SCHEDULER_RESYNC_SECONDS
+
+        while not self._stopped:
+            self._wakeup.clear()
+            if time.monotonic() >= next_resync:
+                await self._reload(load_schedule)
+                next_resync = time.monotonic() + SCHEDULER_RESYNC_SECONDS
+                continue
+
+            now = datetime.utcnow()
+            due_groups = self._pop_due(now)
+            if not due_groups:
+                # Sleep until the earliest due group, a resync, or a wake-up
+                timeout = next_resync - time.monotonic()
+                earliest = self._peek()
+                if earliest is not None:
+                    timeout = min(timeout, (earliest - now).total_seconds())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for group_id, due in due_groups:
+                task = asyncio.create_task(self._settle(group_id, due))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    def _process(self, group_id: int, due: datetime) -> Optional[datetime]:
+        settlement_run_lag_seconds.observe(max((datetime.utcnow() - due).total_seconds(), 0))
+        return self.process_group(group_id)
+
+    async def _settle(self, group_id: int, due: datetime):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=SETTLEMENT_WORKERS, thread_name_prefix="settlement")
+        try:
+            next_due = await self._loop.run_in_executor(self._executor, self._process, group_id, due)
+            settlement_runs.inc(result="ok")
+        except Exception as e:
+            # Retry this group later without holding up the others
+            print(f"Error settling group {group_id}: {e}")
+            settlement_runs.inc(result="error")
+            next_due = datetime.utcnow() + timedelta(seconds=SCHEDULER_RETRY_SECONDS)
+        with self._lock:
+            self._running.discard(group_id)
+            current = self._due.get(group_id)
+        # Keep a later due time set by set_settlement_period while this ran
+        if current is None or current <= due:
+            self.schedule(group_id, next_due)
+
+    def stop(self):
+        self._stopped = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._wake()
@@ -0,0 +1,48 @@
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
+import models
+import ledger
+import settlement_totals
+
+# Settlement status transitions.
+#
+# A status change is one conditional UPDATE that only matches the settlement
+# while it is still unpaid and at the Version the request read, and bumps the
+# Version. Concurrent requests for the same settlement don't block each other
+# on row locks: exactly one UPDATE matches, and the others see a row count of
+# 0 and report a conflict without touching the ledger, the pending totals or
+# the notifications. Anything else that rewrites an unpaid settlement (e.g.
+# finalize-splits changing its amount) bumps the Version too.
+
+
+class SettlementConflict(Exception):
+    """A settlement was changed by a concurrent request"""
+
+
+def confirm(db: Session, settlement: models.Settlement, payment_date: Optional[datetime] = None) -> bool:
+    """
+    Mark a settlement read by this request as Confirmed and book it in the
+    ledger and pending totals. Returns False when another request changed it
+    first. The caller commits.
+    """
+    values = {
+        models.Settlement.Status: "Confirmed",
+        models.Settlement.Version: models.Settlement.Version + 1
+    }
+    if payment_date:
+        values[models.Settlement.PaymentDate] = payment_date
+
+    updated = db.query(models.Settlement)\
+        .filter(
+            models.Settlement.SettlementID == settlement.SettlementID,
+            models.Settlement.Version == settlement.Version,
+            models.Settlement.Status.in_(settlement_totals.UNPAID_STATUSES)
+        ).update(values, synchronize_session=False)
+    if not updated:
+        return False
+
+    # Book the amount as read, which the Version guarantees is still current
+    settlement_totals.record_paid(db, settlement)
+    ledger.record_confirmed_settlement(db, settlement)
+    return True
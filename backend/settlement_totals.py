@@ -0,0 +1,209 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, select, update
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
+import uuid
+import models
+import money
+
+# Live pending-settlement totals.
+#
+# SettlementPeriods.TotalPendingAmount holds the cents of a group's unpaid
+# (Pending or Overdue) settlements. Every write path that creates a
+# settlement, changes a pending amount or confirms a payment adjusts it in the
+# same transaction as the write, like the MemberBalances ledger, so the
+# pending summary is one primary key read instead of a scan of Settlements.
+# SettlementPeriods.TotalSettlementAmount is maintained the same way for all
+# of the group's settlements, paid or not, and serves the settlement summary.
+# Groups without a settlement period get a row with no NextSettlement, which
+# the scheduler ignores.
+#
+# Every periodic settlement run that settles expenses is a batch: its
+# settlements carry the BatchID, SettlementBatches keeps what the run created
+# and how much of it is still unpaid, and the period remembers the last one.
+
+UNPAID_STATUSES = ("Pending", "Overdue")
+
+
+def new_batch_id() -> str:
+    return str(uuid.uuid4())
+
+
+def adjust_pending(db: Session, group_id: int, cents: int, batch_id: Optional[str] = None, total_cents: int = 0):
+    """
+    Add cents (negative when paid) to the group's pending total and to its
+    batch, and total_cents (created or re-priced settlements) to its total
+    """
+    if not cents and not total_cents:
+        return
+    # Relative UPDATE so concurrent writers never lose each other's increments
+    updated = db.query(models.SettlementPeriod)\
+        .filter(models.SettlementPeriod.GroupID == group_id)\
+        .update({
+            models.SettlementPeriod.TotalPendingCents: func.coalesce(models.SettlementPeriod.TotalPendingCents, 0) + cents,
+            models.SettlementPeriod.TotalSettlementCents: models.SettlementPeriod.TotalSettlementCents + total_cents
+        }, synchronize_session=False)
+    if not updated:
+        db.add(models.SettlementPeriod(GroupID=group_id, NextSettlement=None, TotalPendingCents=cents,
+                                       TotalSettlementCents=total_cents))
+        db.flush()
+
+    if batch_id and cents:
+        db.query(models.SettlementBatch)\
+            .filter(models.SettlementBatch.BatchID == batch_id)\
+            .update({
+                models.SettlementBatch.PendingCents: models.SettlementBatch.PendingCents + cents
+            }, synchronize_session=False)
+
+
+def record_created(db: Session, group_id: int, amounts: Iterable[int]):
+    """Add new pending settlements, by amount in cents; call before committing"""
+    total = sum(amounts)
+    adjust_pending(db, group_id, total, total_cents=total)
+
+
+def record_paid(db: Session, settlement: models.Settlement):
+    """Take a settlement that is being confirmed off the pending totals"""
+    if settlement.Status in UNPAID_STATUSES:
+        adjust_pending(db, settlement.GroupID, -settlement.AmountCents, settlement.BatchID)
+
+
+def record_batch(db: Session, period: models.SettlementPeriod, batch_id: str, created_at: datetime,
+                 amounts: List[int]) -> models.SettlementBatch:
+    """
+    Store the totals of a periodic settlement run whose settlements were
+    inserted with batch_id, and make it the period's last batch.
+    """
+    total = sum(amounts)
+    batch = models.SettlementBatch(
+        BatchID=batch_id,
+        GroupID=period.GroupID,
+        CreatedAt=created_at,
+        SettlementCount=len(amounts),
+        TotalCents=total,
+        PendingCents=total
+    )
+    db.add(batch)
+    adjust_pending(db, period.GroupID, total, total_cents=total)
+    period.LastBatchID = batch_id
+    return batch
+
+
+def compute_group(db, group_id: int) -> Dict[Optional[str], int]:
+    """
+    Unpaid cents of a group straight from Settlements, per BatchID (None for
+    settlements outside a batch). Works on a Session or a Connection.
+    """
+    rows = db.execute(
+        select(models.Settlement.BatchID, func.sum(models.Settlement.AmountCents))
+            .where(
+                models.Settlement.GroupID == group_id,
+                models.Settlement.Status.in_(UNPAID_STATUSES)
+            )
+            .group_by(models.Settlement.BatchID)
+    ).all()
+    return {batch_id: int(cents) for batch_id, cents in rows}
+
+
+def compute_total(db, group_id: int) -> int:
+    """Cents of all of a group's settlements straight from Settlements"""
+    return db.execute(
+        select(func.coalesce(func.sum(models.Settlement.AmountCents), 0))
+            .where(models.Settlement.GroupID == group_id)
+    ).scalar()
+
+
+def rebuild_group(db, group_id: int) -> int:
+    """Recompute the pending totals of a group and its batches; returns the pending cents"""
+    pending = compute_group(db, group_id)
+    total = sum(pending.values())
+
+    updated = db.execute(
+        update(models.SettlementPeriod.__table__)
+            .where(models.SettlementPeriod.GroupID == group_id)
+            .values(TotalPendingAmount=total)
+    ).rowcount
+    if not updated and total:
+        db.execute(insert(models.SettlementPeriod.__table__).values(GroupID=group_id, Period="1m", TotalPendingAmount=total))
+
+    db.execute(
+        update(models.SettlementBatch.__table__)
+            .where(models.SettlementBatch.GroupID == group_id)
+            .values(PendingCents=0)
+    )
+    for batch_id, cents in pending.items():
+        if batch_id is not None:
+            db.execute(
+                update(models.SettlementBatch.__table__)
+                    .where(models.SettlementBatch.BatchID == batch_id)
+                    .values(PendingCents=cents)
+            )
+    return total
+
+
+def rebuild_total(db, group_id: int) -> int:
+    """Recompute the settlement total of a group; returns it in cents"""
+    total = compute_total(db, group_id)
+    updated = db.execute(
+        update(models.SettlementPeriod.__table__)
+            .where(models.SettlementPeriod.GroupID == group_id)
+            .values(TotalSettlementAmount=total)
+    ).rowcount
+    if not updated and total:
+        db.execute(insert(models.SettlementPeriod.__table__).values(GroupID=group_id, Period="1m", TotalSettlementAmount=total))
+    return total
+
+
+def verify_group(db: Session, group_id: int) -> List[dict]:
+    """Return the stored totals of a group that disagree with Settlements"""
+    expected = compute_group(db, group_id)
+    mismatches = []
+
+    stored = db.query(models.SettlementPeriod.TotalPendingCents, models.SettlementPeriod.TotalSettlementCents)\
+        .filter(models.SettlementPeriod.GroupID == group_id)\
+        .first()
+    stored_pending, stored_total = (stored[0] or 0, stored[1] or 0) if stored else (0, 0)
+    if stored_pending != sum(expected.values()):
+        mismatches.append({"GroupID": group_id, "BatchID": None, "Total": "pending total",
+                           "expected": sum(expected.values()), "stored": stored_pending})
+    expected_total = compute_total(db, group_id)
+    if stored_total != expected_total:
+        mismatches.append({"GroupID": group_id, "BatchID": None, "Total": "settlement total",
+                           "expected": expected_total, "stored": stored_total})
+
+    for batch_id, pending_cents in db.query(models.SettlementBatch.BatchID, models.SettlementBatch.PendingCents)\
+            .filter(models.SettlementBatch.GroupID == group_id).all():
+        if pending_cents != expected.get(batch_id, 0):
+            mismatches.append({"GroupID": group_id, "BatchID": batch_id, "Total": f"batch {batch_id}",
+                               "expected": expected.get(batch_id, 0), "stored": pending_cents})
+    return mismatches
+
+
+def batch_summary(batch: models.SettlementBatch) -> dict:
+    return {
+        "BatchID": batch.BatchID,
+        "GroupID": batch.GroupID,
+        "CreatedAt": batch.CreatedAt,
+        "SettlementCount": batch.SettlementCount,
+        "Total": money.from_cents(batch.TotalCents),
+        "Pending": money.from_cents(batch.PendingCents)
+    }
+
+
+def pending_summary(db: Session, group_id: int) -> dict:
+    """The group's pending total and last batch, read from the aggregate rows"""
+    period = db.query(models.SettlementPeriod)\
+        .filter(models.SettlementPeriod.GroupID == group_id)\
+        .first()
+    last_batch = None
+    if period and period.LastBatchID:
+        last_batch = db.query(models.SettlementBatch)\
+            .filter(models.SettlementBatch.BatchID == period.LastBatchID)\
+            .first()
+    return {
+        "GroupID": group_id,
+        "TotalPending": money.from_cents(period.TotalPendingCents or 0) if period else money.from_cents(0),
+        "LastSettlement": period.LastSettlement if period else None,
+        "NextSettlement": period.NextSettlement if period else None,
+        "LastBatch": batch_summary(last_batch) if last_batch else None
+    }
@@ -0,0 +1,197 @@
+"""
+Stress test settlement confirmation under concurrent requests.
+
+Creates a group with pending settlements and fires many requests at each of
+them at once from a pool of threads, mixing PUT /settlements/{id}/confirm by
+the receiver and POST /settlements/{id}/process-payment by the payer. Every
+thread calls the ASGI app on its own event loop, like separate workers sharing
+the database. Checks that each settlement was confirmed exactly once: one 200
+per settlement and 409 (or 400 for a payment that finds it already confirmed)
+for every other request, one payment notification per
+successful payment, Version 1 on every settlement, and ledger and pending
+totals that match a full recomputation. Exits with status 1 otherwise.
+
+Runs against a temporary SQLite database unless DATABASE_URL is set; point it
+at a scratch MySQL database to exercise real row-level concurrency.
+
+Usage:
+    python stress_settlement_confirm.py [--settlements 5] [--requests 200] [--threads 64]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress.db"))
+os.environ.setdefault("SECRET_KEY", "stress")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("AUTH_LOG_REQUESTS", "0")
+
+
+def call(app, method, path, token, body=None):
+    """Run one request through the ASGI app on this thread's own event loop; returns the status"""
+    payload = json.dumps(body).encode() if body is not None else b""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"stress"),
+            (b"authorization", f"Bearer {token}".encode()),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+        "client": ("127.0.0.1", 0),
+        "server": ("stress", 80),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # The client never disconnects
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    asyncio.run(app(scope, receive, send))
+    return status[0]
+
+
+def setup(settlements):
+    import models
+    import settlement_totals
+    from database import SessionLocal
+
+    db = SessionLocal()
+    suffix = int(time.time() * 1000)
+    payer = models.User(Name="payer", Email=f"payer{suffix}@example.com", Password="x")
+    receiver = models.User(Name="receiver", Email=f"receiver{suffix}@example.com", Password="x")
+    db.add_all([payer, receiver])
+    db.flush()
+    group = models.UserGroup(GroupName="stress", InviteCode=f"S{suffix}"[-10:], CreatedByUserID=receiver.UserID)
+    db.add(group)
+    db.flush()
+    db.add_all([models.GroupMember(UserID=user.UserID, GroupID=group.GroupID) for user in (payer, receiver)])
+
+    rows = [models.Settlement(GroupID=group.GroupID, PayerUserID=payer.UserID, ReceiverUserID=receiver.UserID,
+                              Amount=f"{10 + i}.01", DueDate=datetime.utcnow() + timedelta(days=7))
+            for i in range(settlements)]
+    db.add_all(rows)
+    settlement_totals.record_created(db, group.GroupID, [row.AmountCents for row in rows])
+    db.commit()
+    result = (group.GroupID, (payer.UserID, payer.Email), (receiver.UserID, receiver.Email),
+              [(row.SettlementID, str(row.Amount)) for row in rows])
+    db.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settlements", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200, help="Concurrent requests per settlement")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    import database
+    import migrations
+    with contextlib.redirect_stdout(io.StringIO()):
+        migrations.upgrade(database.get_engine())
+        import backend
+    import ledger
+    import models
+    import settlement_totals
+    from security import create_access_token
+
+    group_id, payer, receiver, settlements = setup(args.settlements)
+    tokens = {user_id: create_access_token({"sub": email}, timedelta(minutes=30)) for user_id, email in (payer, receiver)}
+    payer_id, receiver_id = payer[0], receiver[0]
+
+    requests = []
+    for settlement_id, amount in settlements:
+        for i in range(args.requests):
+            if i % 2:
+                requests.append((settlement_id, "POST", f"/settlements/{settlement_id}/process-payment",
+                                 tokens[payer_id], {"amount": amount}))
+            else:
+                requests.append((settlement_id, "PUT", f"/settlements/{settlement_id}/confirm",
+                                 tokens[receiver_id], None))
+    random.Random(args.seed).shuffle(requests)
+
+    results = []
+    results_lock = threading.Lock()
+    start = threading.Barrier(args.threads)
+
+    def worker(batch):
+        start.wait()
+        for settlement_id, method, path, token, body in batch:
+            status = call(backend.app, method, path, token, body)
+            with results_lock:
+                results.append((settlement_id, method, status))
+
+    threads = [threading.Thread(target=worker, args=(requests[i::args.threads],)) for i in range(args.threads)]
+    began = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+
+    statuses = Counter(status for _, _, status in results)
+    print(f"{len(results)} requests on {args.settlements} settlements from {args.threads} threads in {elapsed:.2f}s: "
+          + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+
+    failures = []
+    wins = Counter(settlement_id for settlement_id, _, status in results if status == 200)
+    paid = sum(1 for _, method, status in results if status == 200 and method == "POST")
+    for settlement_id, _ in settlements:
+        if wins[settlement_id] != 1:
+            failures.append(f"settlement {settlement_id} was confirmed {wins[settlement_id]} times")
+    unexpected = {status: count for status, count in statuses.items() if status not in (200, 400, 409)}
+    if unexpected:
+        failures.append(f"unexpected statuses {unexpected}")
+
+    db = database.SessionLocal()
+    try:
+        rows = db.query(models.Settlement).filter(models.Settlement.GroupID == group_id).all()
+        for row in rows:
+            if row.Status != "Confirmed" or row.Version != 1:
+                failures.append(f"settlement {row.SettlementID} ended {row.Status} at version {row.Version}")
+        notifications = db.query(models.Notification)\
+            .filter(models.Notification.UserID == receiver_id, models.Notification.Type == "PAYMENT_RECEIVED")\
+            .count()
+        if notifications != paid:
+            failures.append(f"{notifications} payment notifications for {paid} payments")
+        failures += [f"ledger out of sync: {mismatch}" for mismatch in ledger.verify_group(db, group_id)]
+        failures += [f"pending totals out of sync: {mismatch}" for mismatch in settlement_totals.verify_group(db, group_id)]
+    finally:
+        db.close()
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("Every settlement was confirmed exactly once" if not failures else f"{len(failures)} failures")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+from datetime import timedelta
+
+import pytest
+
+# The modules read their settings on import; every test run gets its own SQLite database
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db"))
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import database
+    import migrations
+    with contextlib.redirect_stdout(io.StringIO()):
+        migrations.upgrade(database.get_engine())
+        import backend
+    return backend.app
+
+
+@pytest.fixture
+def client(app):
+    from fastapi.testclient import TestClient
+    # Not entered as a context manager, so the scheduler and background jobs don't start
+    return TestClient(app)
+
+
+@pytest.fixture
+def db(app):
+    from database import SessionLocal
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def make_group(db):
+    """Create a group of new users; returns (GroupID, [(UserID, auth headers)])"""
+    import ledger
+    import models
+    from security import create_access_token
+
+    def make(size):
+        run = next(_ids)
+        users = [models.User(Name=f"user{run}-{i}", Email=f"user{run}-{i}@example.com", Password="x")
+                 for i in range(size)]
+        db.add_all(users)
+        db.flush()
+        group = models.UserGroup(GroupName=f"group{run}", InviteCode=f"TEST{run}", CreatedByUserID=users[0].UserID)
+        db.add(group)
+        db.flush()
+        for user in users:
+            db.add(models.GroupMember(UserID=user.UserID, GroupID=group.GroupID, IsAdmin=user is users[0]))
+            ledger.ensure_member(db, group.GroupID, user.UserID)
+        db.commit()
+        members = [
+            (user.UserID, {"Authorization": "Bearer " + create_access_token({"sub": user.Email}, timedelta(minutes=30))})
+            for user in users
+        ]
+        return group.GroupID, members
+    return make
@@ -0,0 +1,65 @@
+from datetime import date, datetime
+
+import pytest
+
+import analytics
+import models
+import money
+
+
+@pytest.fixture
+def spending_group(db, make_group):
+    group_id, members = make_group(2)
+    payments = [
+        (members[0][0], datetime(2024, 1, 28, 23, 30), 1000),  # Sunday
+        (members[1][0], datetime(2024, 1, 29, 8), 250),  # Monday, next week
+        (members[0][0], datetime(2024, 1, 31, 12), 333),
+        (members[0][0], datetime(2024, 2, 1, 9), 1),
+        (members[1][0], datetime(2024, 3, 15, 18), 4200),
+    ]
+    expenses = [models.Expense(GroupID=group_id, PaidByUserID=user_id, AmountCents=cents, Description="test",
+                               Date=day, IsSettled=False)
+                for user_id, day, cents in payments]
+    db.add_all(expenses)
+    analytics.record_expenses(db, [(group_id, e.PaidByUserID, e.Date, e.AmountCents) for e in expenses])
+    db.commit()
+    return group_id, [user_id for user_id, _ in members]
+
+
+QUERIES = [
+    {"granularity": "day"},
+    {"granularity": "week"},
+    {"granularity": "month"},
+    {"granularity": "week", "start": date(2024, 1, 30), "end": date(2024, 2, 29)},
+    {"granularity": "day", "end": date(2024, 1, 31)},
+]
+
+
+def test_rollups_match_the_sql_fallback(db, spending_group):
+    group_id, user_ids = spending_group
+    queries = QUERIES + [{"granularity": "month", "user_id": user_ids[0]}]
+    from_rollups = [analytics.group_spending(db, group_id, **query) for query in queries]
+    assert analytics.verify_group(db, group_id) == []
+
+    # Without rollup rows the group is aggregated from Expenses instead
+    db.query(models.SpendingRollup).filter(models.SpendingRollup.GroupID == group_id).delete()
+    db.commit()
+    from_expenses = [analytics.group_spending(db, group_id, **query) for query in queries]
+
+    assert from_rollups == from_expenses
+
+
+def test_buckets_and_totals(db, spending_group):
+    group_id, user_ids = spending_group
+
+    weeks = analytics.group_spending(db, group_id, "week")
+    months = analytics.group_spending(db, group_id, "month", start=date(2024, 1, 15), end=date(2024, 2, 1))
+
+    assert [(b["BucketStart"], b["ExpenseCount"]) for b in weeks["Buckets"]] == [
+        (date(2024, 1, 22), 1), (date(2024, 1, 29), 3), (date(2024, 3, 11), 1)
+    ]
+    assert (months["Start"], months["End"]) == (date(2024, 1, 1), date(2024, 2, 1))
+    assert [b["Total"] for b in months["Buckets"]] == [money.from_cents(1583), money.from_cents(1)]
+    assert months["Buckets"][0]["Members"] == {
+        user_ids[0]: money.from_cents(1333), user_ids[1]: money.from_cents(250)
+    }
@@ -0,0 +1,33 @@
+import expense_import
+import models
+
+
+def _csv(rows):
+    return "Amount,Description\n" + "".join(f"{amount},{description}\n" for amount, description in rows)
+
+
+def test_failed_batch_is_reported_and_other_batches_are_kept(client, db, make_group, monkeypatch):
+    group_id, members = make_group(2)
+    monkeypatch.setattr(expense_import, "IMPORT_BATCH_SIZE", 2)
+    write_batch = expense_import.write_batch
+    calls = []
+
+    def failing_second_batch(db, group_id, rows):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise RuntimeError("database went away")
+        return write_batch(db, group_id, rows)
+    monkeypatch.setattr(expense_import, "write_batch", failing_second_batch)
+
+    body = _csv([("1.00", "a"), ("2.00", "b"), ("0", "invalid"), ("3.00", "c"), ("4.00", "d"), ("5.00", "e")])
+    response = client.post(f"/groups/{group_id}/expenses/import", content=body,
+                           headers={**members[0][1], "Content-Type": "text/csv"})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["Imported"], result["Failed"]) == (3, 3)
+    assert {"Row": 4, "LastRow": 5, "Error": "Batch not imported: database went away"} in result["Errors"]
+    assert {"Row": 3, "LastRow": None, "Error": "Amount must be greater than zero"} in result["Errors"]
+
+    committed = db.query(models.Expense.Description).filter(models.Expense.GroupID == group_id).all()
+    assert sorted(description for description, in committed) == ["a", "b", "e"]
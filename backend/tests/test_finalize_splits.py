@@ -0,0 +1,55 @@
+import ledger
+import settlement_planner
+
+
+def _uneven_group(db, make_group, size):
+    group_id, members = make_group(size)
+    # Everyone paid a different amount, so every member ends up with a balance
+    for i, (user_id, _) in enumerate(members):
+        ledger.record_expense(db, group_id, user_id, (i + 1) * 1000 + i)
+    db.commit()
+    return group_id, members
+
+
+def test_exact_plan_on_large_group_is_rejected_with_the_limit(client, db, make_group):
+    size = settlement_planner.EXACT_MAX_PARTICIPANTS + 2
+    group_id, members = _uneven_group(db, make_group, size)
+    assert sum(1 for m in ledger.get_member_net_cents(db, group_id) if m["NetCents"]) > settlement_planner.EXACT_MAX_PARTICIPANTS
+
+    response = client.post(f"/groups/{group_id}/finalize-splits", json={"exact": True}, headers=members[0][1])
+
+    assert response.status_code == 400
+    assert str(settlement_planner.EXACT_MAX_PARTICIPANTS) in response.json()["detail"]
+
+
+def test_large_group_uses_greedy_plan_by_default(client, db, make_group):
+    size = settlement_planner.EXACT_MAX_PARTICIPANTS + 2
+    group_id, members = _uneven_group(db, make_group, size)
+
+    response = client.post(f"/groups/{group_id}/finalize-splits", json={"force_create": True}, headers=members[0][1])
+
+    assert response.status_code == 200
+    assert 0 < len(response.json()) <= size - 1
+
+
+def test_exact_must_be_a_bool(client, db, make_group):
+    group_id, members = _uneven_group(db, make_group, 3)
+
+    response = client.post(f"/groups/{group_id}/finalize-splits", json={"exact": "yes"}, headers=members[0][1])
+
+    assert response.status_code == 400
+
+
+def test_exact_plan_on_small_group(client, db, make_group):
+    group_id, members = _uneven_group(db, make_group, 4)
+
+    response = client.post(f"/groups/{group_id}/finalize-splits", json={"exact": True, "force_create": True}, headers=members[0][1])
+
+    assert response.status_code == 200
+    owed = {m["UserID"]: m["NetCents"] for m in ledger.get_member_net_cents(db, group_id)}
+    settled = {user_id: 0 for user_id in owed}
+    for transfer in response.json():
+        cents = round(float(transfer["Amount"]) * 100)
+        settled[transfer["PayerUserID"]] += cents
+        settled[transfer["ReceiverUserID"]] -= cents
+    assert all(owed[user_id] + settled[user_id] == 0 for user_id in owed)
@@ -0,0 +1,58 @@
+import group_versions
+import ledger
+
+
+def _balances(client, group_id, member, etag=None):
+    headers = dict(member[1])
+    if etag:
+        headers["If-None-Match"] = etag
+    return client.get(f"/groups/{group_id}/balances", headers=headers)
+
+
+def test_unchanged_group_answers_304(client, make_group):
+    group_id, members = make_group(2)
+    first = _balances(client, group_id, members[0])
+    etag = first.headers["ETag"]
+
+    second = _balances(client, group_id, members[0], etag)
+    other_user = _balances(client, group_id, members[1], etag)
+
+    assert first.status_code == 200
+    assert (second.status_code, second.content, second.headers["ETag"]) == (304, b"", etag)
+    assert other_user.status_code == 200 and other_user.headers["ETag"] != etag
+
+
+def test_repeated_get_is_served_from_the_cache(client, make_group, monkeypatch):
+    group_id, members = make_group(2)
+    calls = []
+    get_member_balances = ledger.get_member_balances
+
+    def counting_balances(db, gid):
+        calls.append(gid)
+        return get_member_balances(db, gid)
+
+    monkeypatch.setattr(ledger, "get_member_balances", counting_balances)
+
+    first = _balances(client, group_id, members[0])
+    second = _balances(client, group_id, members[0])
+
+    assert first.json() == second.json()
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert calls == [group_id]
+
+
+def test_write_bumps_the_version_and_invalidates(client, db, make_group):
+    group_id, members = make_group(2)
+    before = _balances(client, group_id, members[0])
+    version = group_versions.current_version(db, group_id)
+
+    response = client.post("/expenses", json={"GroupID": group_id, "Amount": "8.00", "Description": "test"},
+                           headers=members[0][1])
+    assert response.status_code == 200
+    db.expire_all()
+    after = _balances(client, group_id, members[0], before.headers["ETag"])
+
+    assert group_versions.current_version(db, group_id) == version + 1
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert {float(member["NetBalance"]) for member in after.json()["Members"]} == {4.00, -4.00}
@@ -0,0 +1,69 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+
+import idempotency
+import models
+import notification_hub
+
+
+def _settlement(group_id, members, amount="7.50"):
+    return {"GroupID": group_id, "PayerUserID": members[1][0], "ReceiverUserID": members[0][0], "Amount": amount}
+
+
+def test_retry_replays_the_stored_response(client, db, make_group):
+    group_id, members = make_group(2)
+    headers = {**members[1][1], idempotency.IDEMPOTENCY_HEADER: "retry-1"}
+
+    first = client.post("/settlements", json=_settlement(group_id, members), headers=headers)
+    retry = client.post("/settlements", json=_settlement(group_id, members), headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers[idempotency.REPLAYED_HEADER] == "true"
+    assert retry.json() == first.json()
+    assert db.query(models.Settlement).filter(models.Settlement.GroupID == group_id).count() == 1
+
+
+def test_write_claim_and_response_are_committed_together(app, db, make_group, monkeypatch):
+    group_id, members = make_group(2)
+    headers = {**members[1][1], idempotency.IDEMPOTENCY_HEADER: "crash-1"}
+
+    # Fail after the handler has committed its write, while storing the response
+    def crash(body):
+        raise RuntimeError("worker died")
+    monkeypatch.setattr(idempotency, "jsonable_encoder", crash)
+    crashed = TestClient(app, raise_server_exceptions=False).post("/settlements", json=_settlement(group_id, members), headers=headers)
+
+    assert crashed.status_code == 500
+    assert db.query(models.Settlement).filter(models.Settlement.GroupID == group_id).count() == 0
+    assert db.query(models.IdempotencyKey).filter(models.IdempotencyKey.Key == "crash-1").count() == 0
+
+    monkeypatch.undo()
+    retry = TestClient(app).post("/settlements", json=_settlement(group_id, members), headers=headers)
+
+    assert retry.status_code == 200
+    assert idempotency.REPLAYED_HEADER not in retry.headers
+    stored = db.query(models.IdempotencyKey).filter(models.IdempotencyKey.Key == "crash-1").one()
+    assert stored.StatusCode == 200
+
+
+def test_payment_notification_is_pushed_only_after_the_commit(app, db, make_group, monkeypatch):
+    group_id, members = make_group(2)
+    payer, receiver = members[1], members[0]
+    settlement = TestClient(app).post("/settlements", json=_settlement(group_id, members), headers=payer[1]).json()
+    pushed = []
+    monkeypatch.setattr(notification_hub.hub, "publish", lambda user_id, event: pushed.append((user_id, event)))
+    path = f"/settlements/{settlement['SettlementID']}/process-payment"
+    headers = {**payer[1], idempotency.IDEMPOTENCY_HEADER: "pay-1"}
+
+    # Storing the response fails, so the payment is rolled back and nothing is pushed
+    def crash(body):
+        raise RuntimeError("worker died")
+    monkeypatch.setattr(idempotency, "jsonable_encoder", crash)
+    crashed = TestClient(app, raise_server_exceptions=False).post(path, json={"amount": "7.50"}, headers=headers)
+    assert crashed.status_code == 500
+    assert pushed == []
+
+    monkeypatch.setattr(idempotency, "jsonable_encoder", jsonable_encoder)
+    paid = TestClient(app).post(path, json={"amount": "7.50"}, headers=headers)
+    assert paid.status_code == 200
+    assert [(user_id, event["Type"]) for user_id, event in pushed] == [(receiver[0], "PAYMENT_RECEIVED")]
@@ -0,0 +1,35 @@
+import inbox
+import models
+
+
+def _counter(db, user_id):
+    db.expire_all()
+    return db.get(models.NotificationCounter, user_id)
+
+
+def test_unread_count_get_does_not_write(client, db, make_group):
+    _, members = make_group(1)
+    user_id, headers = members[0]
+
+    response = client.get("/notifications/unread-count", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["UnreadCount"] == 0
+    assert _counter(db, user_id) is None
+
+
+def test_counter_is_created_and_adjusted(client, db, make_group):
+    _, members = make_group(1)
+    user_id, headers = members[0]
+    notifications = [models.Notification(UserID=user_id, Message=f"test {i}", Type="TEST") for i in range(3)]
+    db.add_all(notifications)
+    inbox.record_created(db, [user_id] * 3)
+    db.commit()
+    assert _counter(db, user_id).UnreadCount == 3
+
+    response = client.put("/notifications/read", json={"NotificationIDs": [notifications[0].NotificationID]},
+                          headers=headers)
+
+    assert response.json()["Updated"] == 1
+    assert client.get("/notifications/unread-count", headers=headers).json()["UnreadCount"] == 2
+    assert inbox.verify_counters(db) == []
@@ -0,0 +1,63 @@
+import ledger
+import migrations
+import models
+
+
+def _add_expense(client, group_id, payer, amount):
+    response = client.post("/expenses", json={"GroupID": group_id, "Amount": amount, "Description": "test"},
+                           headers=payer[1])
+    assert response.status_code == 200
+
+
+def _ledger_rows(db, group_id):
+    db.expire_all()
+    return db.query(models.MemberBalance).filter(models.MemberBalance.GroupID == group_id).count()
+
+
+def test_balances_get_does_not_write(client, db, make_group):
+    group_id, members = make_group(3)
+    _add_expense(client, group_id, members[0], "9.00")
+    # A member without a ledger row counts as zero instead of triggering a rebuild
+    db.query(models.MemberBalance)\
+        .filter(models.MemberBalance.GroupID == group_id, models.MemberBalance.UserID == members[2][0])\
+        .delete(synchronize_session=False)
+    db.commit()
+
+    response = client.get(f"/groups/{group_id}/balances", headers=members[0][1])
+    groups = client.get("/groups", headers=members[2][1])
+
+    assert response.status_code == 200
+    assert groups.status_code == 200
+    nets = {member["UserID"]: float(member["NetBalance"]) for member in response.json()["Members"]}
+    assert nets == {members[0][0]: 6.00, members[1][0]: -3.00, members[2][0]: -3.00}
+    assert _ledger_rows(db, group_id) == 2
+
+
+def test_upsert_creates_and_increments_rows(db, make_group):
+    group_id, members = make_group(2)
+    user_id = members[1][0]
+    db.query(models.MemberBalance)\
+        .filter(models.MemberBalance.GroupID == group_id, models.MemberBalance.UserID == user_id)\
+        .delete(synchronize_session=False)
+
+    ledger.record_expense(db, group_id, user_id, 500)
+    ledger.record_expense(db, group_id, user_id, 250)
+    ledger.ensure_member(db, group_id, user_id)
+    db.commit()
+
+    row = db.get(models.MemberBalance, (group_id, user_id))
+    assert (row.TotalPaidCents, row.SettledNetCents) == (750, 0)
+
+
+def test_backfill_migration_rebuilds_missing_rows(client, db, make_group):
+    group_id, members = make_group(2)
+    _add_expense(client, group_id, members[1], "4.00")
+    db.query(models.MemberBalance).filter(models.MemberBalance.GroupID == group_id).delete(synchronize_session=False)
+    db.commit()
+    assert ledger.verify_group(db, group_id) != []
+
+    with db.get_bind().begin() as connection:
+        migrations._backfill_member_balances(connection)
+
+    assert ledger.verify_group(db, group_id) == []
+    assert _ledger_rows(db, group_id) == 2
@@ -0,0 +1,61 @@
+from sqlalchemy import event
+
+import membership
+import models
+
+
+def test_cache_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(membership.time, "monotonic", lambda: now[0])
+    cache = membership.MembershipCache(max_size=2, ttl_seconds=60)
+
+    cache.put(1, {10: True})
+    now[0] += 59
+    assert cache.get(1) == {10: True}
+    now[0] += 1
+    assert cache.get(1) is None
+
+
+def test_cache_evicts_least_recently_used():
+    cache = membership.MembershipCache(max_size=2, ttl_seconds=60)
+    cache.put(1, {})
+    cache.put(2, {})
+    cache.get(1)
+    cache.put(3, {})
+
+    assert cache.get(2) is None
+    assert cache.get(1) == {} and cache.get(3) == {}
+
+
+def test_cached_membership_skips_the_database(db, make_group):
+    group_id, members = make_group(1)
+    user_id = members[0][0]
+    membership.load_memberships(db, user_id, refresh=True)
+    statements = []
+
+    def listener(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        assert membership.is_member(db, user_id, group_id, admin=True)
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+
+    assert statements == []
+
+
+def test_negative_answer_is_rechecked_against_the_database(db, make_group):
+    group_id, _ = make_group(1)
+    own_group_id, others = make_group(1)
+    user_id = others[0][0]
+    assert not membership.is_member(db, user_id, group_id)
+    assert group_id not in membership.membership_cache.get(user_id)
+
+    # Joined through another worker, so this worker's cache wasn't invalidated
+    db.add(models.GroupMember(UserID=user_id, GroupID=group_id, IsAdmin=False))
+    db.commit()
+
+    assert membership.is_member(db, user_id, group_id)
+    assert not membership.is_member(db, user_id, group_id, admin=True)
+    assert membership.membership_cache.get(user_id) == {own_group_id: True, group_id: False}
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import analytics
+import ledger
+import migrations
+import models
+import settlement_totals
+
+
+def test_backfills_match_the_live_aggregates(client, db, make_group):
+    group_id, members = make_group(2)
+    payer, receiver = members[1], members[0]
+    for amount, day in (("10.00", datetime(2024, 1, 31, 9)), ("2.50", datetime(2024, 2, 1, 18))):
+        response = client.post("/expenses", json={"GroupID": group_id, "Amount": amount, "Description": "test"},
+                               headers=payer[1])
+        assert response.status_code == 200
+        db.query(models.Expense).filter(models.Expense.ExpenseID == response.json()["ExpenseID"])\
+            .update({models.Expense.Date: day}, synchronize_session=False)
+        db.commit()
+    for amount in ("3.00", "1.25"):
+        response = client.post("/settlements", json={
+            "GroupID": group_id, "PayerUserID": payer[0], "ReceiverUserID": receiver[0], "Amount": amount
+        }, headers=payer[1])
+        assert response.status_code == 200
+    # Forget everything the write paths maintained
+    db.query(models.SpendingRollup).filter(models.SpendingRollup.GroupID == group_id).delete(synchronize_session=False)
+    db.query(models.MemberBalance).filter(models.MemberBalance.GroupID == group_id).delete(synchronize_session=False)
+    db.query(models.SettlementPeriod).filter(models.SettlementPeriod.GroupID == group_id).delete(synchronize_session=False)
+    db.commit()
+
+    with db.get_bind().begin() as connection:
+        migrations._create_spending_rollups(connection)
+        migrations._create_settlement_batches(connection)
+        migrations._add_settlement_totals(connection)
+        migrations._backfill_member_balances(connection)
+
+    db.expire_all()
+    assert analytics.verify_group(db, group_id) == []
+    assert settlement_totals.verify_group(db, group_id) == []
+    assert ledger.verify_group(db, group_id) == []
+    assert db.query(models.SpendingRollup).filter(models.SpendingRollup.GroupID == group_id).count() == 5  # 2 days, 1 week, 2 months
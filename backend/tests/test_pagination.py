@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import models
+import pagination
+
+
+def _walk(client, url, headers, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get(url, params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get(pagination.NEXT_CURSOR_HEADER)
+        if not cursor:
+            return pages
+
+
+def test_cursor_round_trip_and_validation():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert pagination.decode_cursor(pagination.encode_cursor(timestamp, 42)) == (timestamp, 42)
+
+    with pytest.raises(HTTPException) as invalid:
+        pagination.decode_cursor("not-a-cursor")
+    assert invalid.value.status_code == 400
+    assert pagination.page_size(None, None) is None
+    assert pagination.page_size(None, "cursor") == pagination.DEFAULT_PAGE_SIZE
+    with pytest.raises(HTTPException):
+        pagination.page_size(pagination.MAX_PAGE_SIZE + 1, None)
+
+
+def test_pages_break_timestamp_ties_by_id(client, db, make_group):
+    _, members = make_group(1)
+    user_id, headers = members[0]
+    # Same timestamp for all, so only the id orders them
+    created = datetime(2024, 1, 1, 10, 0, 0)
+    notifications = [models.Notification(UserID=user_id, Message=f"test {i}", Type="TEST", CreatedAt=created)
+                     for i in range(5)]
+    db.add_all(notifications)
+    db.commit()
+    ids = sorted((n.NotificationID for n in notifications), reverse=True)
+
+    pages = _walk(client, "/notifications", headers, 2)
+    unpaged = client.get("/notifications", headers=headers)
+
+    assert [[n["NotificationID"] for n in page] for page in pages] == [ids[0:2], ids[2:4], ids[4:]]
+    assert [n["NotificationID"] for n in unpaged.json()] == ids
+    assert pagination.NEXT_CURSOR_HEADER not in unpaged.headers
+
+
+def test_pending_settlement_pages_merge_both_sides(client, db, make_group):
+    group_id, members = make_group(3)
+    user_id, headers = members[0]
+    start = datetime(2024, 3, 1)
+    settlements = []
+    for i in range(7):
+        # Alternate between paying and receiving, one hour apart
+        payer, receiver = (user_id, members[1][0]) if i % 2 else (members[2][0], user_id)
+        settlements.append(models.Settlement(GroupID=group_id, PayerUserID=payer, ReceiverUserID=receiver,
+                                             AmountCents=100 + i, Status="Pending",
+                                             Date=start + timedelta(hours=i), DueDate=start + timedelta(days=7)))
+    db.add_all(settlements)
+    db.commit()
+
+    pages = _walk(client, f"/users/{user_id}/pending_settlements", headers, 3)
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert [s["SettlementID"] for page in pages for s in page] == \
+        [s.SettlementID for s in reversed(settlements)]
@@ -0,0 +1,64 @@
+import ledger
+import models
+import settlement_status
+import settlement_totals
+from database import SessionLocal
+
+
+def _pending_settlement(client, make_group, amount="25.00"):
+    group_id, members = make_group(2)
+    payer, receiver = members[1], members[0]
+    response = client.post("/settlements", json={
+        "GroupID": group_id, "PayerUserID": payer[0], "ReceiverUserID": receiver[0], "Amount": amount
+    }, headers=payer[1])
+    assert response.status_code == 200
+    return group_id, response.json()["SettlementID"], payer, receiver
+
+
+def _totals(db, group_id, payer_id):
+    db.expire_all()
+    settled = db.query(models.MemberBalance.SettledNetCents)\
+        .filter(models.MemberBalance.GroupID == group_id, models.MemberBalance.UserID == payer_id)\
+        .scalar()
+    pending = db.query(models.SettlementPeriod.TotalPendingCents)\
+        .filter(models.SettlementPeriod.GroupID == group_id)\
+        .scalar()
+    return settled, pending
+
+
+def test_second_confirmation_is_rejected_and_books_nothing(client, db, make_group):
+    group_id, settlement_id, payer, receiver = _pending_settlement(client, make_group)
+    assert _totals(db, group_id, payer[0]) == (0, 2500)
+
+    first = client.put(f"/settlements/{settlement_id}/confirm", headers=receiver[1])
+    second = client.put(f"/settlements/{settlement_id}/confirm", headers=receiver[1])
+    payment = client.post(f"/settlements/{settlement_id}/process-payment", json={"amount": "25.00"}, headers=payer[1])
+
+    assert (first.status_code, second.status_code, payment.status_code) == (200, 409, 400)
+    assert _totals(db, group_id, payer[0]) == (2500, 0)
+    assert ledger.verify_group(db, group_id) == []
+    assert settlement_totals.verify_group(db, group_id) == []
+
+
+def test_racing_confirmations_of_the_same_read_book_once(client, db, make_group):
+    group_id, settlement_id, payer, _ = _pending_settlement(client, make_group)
+
+    # Both requests read the settlement while it was still pending
+    sessions = [SessionLocal(), SessionLocal()]
+    try:
+        reads = [session.get(models.Settlement, settlement_id) for session in sessions]
+        results = []
+        for session, settlement in zip(sessions, reads):
+            confirmed = settlement_status.confirm(session, settlement)
+            if confirmed:
+                session.commit()
+            else:
+                session.rollback()
+            results.append(confirmed)
+    finally:
+        for session in sessions:
+            session.close()
+
+    assert results == [True, False]
+    assert _totals(db, group_id, payer[0]) == (2500, 0)
+    assert ledger.verify_group(db, group_id) == []
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import backend
+import ledger
+import models
+import notification_hub
+
+
+def _due_group(db, make_group, shared_user_id=None):
+    group_id, members = make_group(2)
+    if shared_user_id:
+        db.add(models.GroupMember(UserID=shared_user_id, GroupID=group_id))
+        ledger.ensure_member(db, group_id, shared_user_id)
+    db.add(models.Expense(GroupID=group_id, PaidByUserID=members[0][0], Amount="30.00", Description="rent",
+                          Date=datetime.utcnow(), IsSettled=False))
+    db.add(models.SettlementPeriod(GroupID=group_id, Period="1w", NextSettlement=datetime.utcnow() - timedelta(minutes=1)))
+    db.commit()
+    return group_id, members
+
+
+def test_each_run_pushes_only_its_own_notifications(db, make_group, monkeypatch):
+    first_group, first_members = _due_group(db, make_group)
+    shared_user_id = first_members[1][0]
+    second_group, second_members = _due_group(db, make_group, shared_user_id)
+    published = []
+    monkeypatch.setattr(notification_hub.hub, "publish_many", lambda events: published.append(list(events)))
+
+    # Both runs land in the same second, and the shared member owes in both groups
+    frozen = datetime.utcnow().replace(microsecond=0)
+    monkeypatch.setattr(backend, "datetime", type("frozen_datetime", (datetime,), {"utcnow": staticmethod(lambda: frozen)}))
+    backend.settle_due_group(first_group)
+    backend.settle_due_group(second_group)
+
+    first_run, second_run = published
+    assert [event["UserID"] for event in first_run] == [shared_user_id]
+    assert sorted(event["UserID"] for event in second_run) == sorted([shared_user_id, second_members[1][0]])
+    ids = [event["NotificationID"] for run in published for event in run]
+    assert len(ids) == len(set(ids)) == db.query(models.Notification)\
+        .filter(models.Notification.Type == "SETTLEMENT_DUE", models.Notification.CreatedAt == frozen).count()
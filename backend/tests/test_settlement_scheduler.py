@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+import models
+import settlement_scheduler
+from database import SessionLocal
+
+
+def test_stale_heap_entries_are_skipped():
+    scheduler = settlement_scheduler.SettlementScheduler(lambda group_id: None)
+    now = datetime.utcnow()
+    scheduler.schedule(1, now + timedelta(hours=1))
+    scheduler.schedule(1, now - timedelta(minutes=1))  # Moved earlier; the first entry is stale
+    scheduler.schedule(2, now - timedelta(minutes=2))
+    scheduler.schedule(2, None)  # Cleared
+    scheduler.schedule(3, now + timedelta(minutes=5))
+
+    assert scheduler._pop_due(now) == [(1, now - timedelta(minutes=1))]
+    assert scheduler._peek() == now + timedelta(minutes=5)
+    assert len(scheduler) == 1
+
+
+def _run(scheduler, load_schedule, until, timeout=5):
+    async def main():
+        task = asyncio.create_task(scheduler.run(load_schedule))
+        try:
+            await asyncio.wait_for(until(), timeout)
+        finally:
+            scheduler.stop()
+            await asyncio.wait_for(task, timeout)
+    asyncio.run(main())
+
+
+def test_schedule_wakes_the_sleeping_loop():
+    processed = threading.Event()
+    scheduler = settlement_scheduler.SettlementScheduler(lambda group_id: processed.set())
+
+    async def schedule_then_wait():
+        # The loop is asleep on an empty heap until the next resync, minutes away
+        await asyncio.sleep(0.1)
+        threading.Thread(target=scheduler.schedule, args=(7, datetime.utcnow())).start()
+        while not processed.is_set():
+            await asyncio.sleep(0.01)
+
+    _run(scheduler, lambda: None, schedule_then_wait)
+    assert processed.is_set()
+
+
+def test_resync_picks_up_periods_set_by_other_workers(db, make_group, monkeypatch):
+    monkeypatch.setattr(settlement_scheduler, "SCHEDULER_RESYNC_SECONDS", 0.1)
+    group_id, _ = make_group(1)
+    processed = []
+    scheduler = settlement_scheduler.SettlementScheduler(lambda gid: processed.append(gid))
+
+    def load_schedule():
+        session = SessionLocal()
+        try:
+            scheduler.load(session)
+        finally:
+            session.close()
+
+    async def add_period_then_wait():
+        await asyncio.sleep(0.05)
+        # Written by another worker, so this scheduler is never told about it
+        db.add(models.SettlementPeriod(GroupID=group_id, Period="1w",
+                                       NextSettlement=datetime.utcnow() - timedelta(seconds=1)))
+        db.commit()
+        while group_id not in processed:
+            await asyncio.sleep(0.01)
+
+    try:
+        _run(scheduler, load_schedule, add_period_then_wait)
+    finally:
+        db.query(models.SettlementPeriod).filter(models.SettlementPeriod.GroupID == group_id).delete()
+        db.commit()
+    assert group_id in processed
+
+
+def test_due_groups_are_settled_concurrently():
+    # Each run waits for the other, so settling them one at a time never finishes
+    barrier = threading.Barrier(2, timeout=5)
+    processed = []
+
+    def process_group(group_id):
+        barrier.wait()
+        processed.append(group_id)
+
+    scheduler = settlement_scheduler.SettlementScheduler(process_group)
+    scheduler.schedule(1, datetime.utcnow())
+    scheduler.schedule(2, datetime.utcnow())
+
+    async def wait_for_both():
+        while len(processed) < 2:
+            await asyncio.sleep(0.01)
+
+    _run(scheduler, lambda: None, wait_for_both)
+    assert sorted(processed) == [1, 2]
+
+
+def test_running_group_is_not_started_again_by_a_resync():
+    scheduler = settlement_scheduler.SettlementScheduler(lambda group_id: None)
+    now = datetime.utcnow()
+    scheduler.schedule(1, now)
+    assert scheduler._pop_due(now) == [(1, now)]
+
+    scheduler.schedule(1, now)  # What a resync does while the run is in progress
+    assert scheduler._pop_due(now) == []
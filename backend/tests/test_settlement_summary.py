@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import models
+import pagination
+import settlement_totals
+
+
+def _create(client, group_id, payer, receiver, amount):
+    response = client.post("/settlements", json={
+        "GroupID": group_id,
+        "PayerUserID": payer[0],
+        "ReceiverUserID": receiver[0],
+        "Amount": amount
+    }, headers=payer[1])
+    assert response.status_code == 200
+    return response.json()["SettlementID"]
+
+
+def test_summary_total_covers_every_status(client, db, make_group):
+    group_id, members = make_group(2)
+    payer, receiver = members[1], members[0]
+    settlement_id = _create(client, group_id, payer, receiver, "12.34")
+    _create(client, group_id, payer, receiver, "0.66")
+    assert client.put(f"/settlements/{settlement_id}/confirm", headers=receiver[1]).status_code == 200
+
+    response = client.get(f"/groups/{group_id}/settlements/summary", headers=payer[1])
+
+    assert response.status_code == 200
+    assert float(response.json()["TotalAmount"]) == 13.00
+    assert len(response.json()["Settlements"]) == 2
+    assert settlement_totals.verify_group(db, group_id) == []
+
+
+def test_date_filtered_summary_total(client, db, make_group):
+    group_id, members = make_group(2)
+    _create(client, group_id, members[1], members[0], "5.00")
+
+    future = (datetime.utcnow() + timedelta(days=1)).isoformat()
+    past = (datetime.utcnow() - timedelta(days=1)).isoformat()
+    later = client.get(f"/groups/{group_id}/settlements/summary", params={"start_date": future}, headers=members[0][1])
+    recent = client.get(f"/groups/{group_id}/settlements/summary", params={"start_date": past}, headers=members[0][1])
+
+    assert (float(later.json()["TotalAmount"]), later.json()["Settlements"]) == (0, [])
+    assert float(recent.json()["TotalAmount"]) == 5.00
+
+
+def test_summary_lists_one_page_of_settlements(client, db, make_group, monkeypatch):
+    monkeypatch.setattr(pagination, "DEFAULT_PAGE_SIZE", 2)
+    group_id, members = make_group(2)
+    ids = [_create(client, group_id, members[1], members[0], f"{i}.00") for i in range(1, 4)]
+    for i, settlement_id in enumerate(ids):
+        db.query(models.Settlement).filter(models.Settlement.SettlementID == settlement_id)\
+            .update({models.Settlement.Date: datetime(2024, 1, 1) + timedelta(minutes=i)})
+    db.commit()
+
+    first = client.get(f"/groups/{group_id}/settlements/summary", headers=members[0][1])
+    cursor = first.headers[pagination.NEXT_CURSOR_HEADER]
+    rest = client.get(f"/groups/{group_id}/settlements/summary", params={"cursor": cursor}, headers=members[0][1])
+
+    assert float(first.json()["TotalAmount"]) == 6.00
+    assert [s["SettlementID"] for s in first.json()["Settlements"]] == ids[:0:-1]
+    assert [s["SettlementID"] for s in rest.json()["Settlements"]] == ids[:1]
+    assert pagination.NEXT_CURSOR_HEADER not in rest.headers
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { getGroups, createGroup, joinGroup } from '../services/api';
+import { getDashboard, createGroup, joinGroup } from '../services/api';
 
 const Dashboard = () => {
     const [groups, setGroups] = useState([]);
@@ -19,8 +19,8 @@ const Dashboard = () => {
 
     const loadGroups = async () => {
         try {
-            const response = await getGroups();
-            setGroups(response.data);
+            const response = await getDashboard();
+            setGroups(response.data.Groups);
         } catch (error) {
             console.error('Failed to load groups:', error);
             setError('Failed to load groups');
@@ -100,10 +100,6 @@ const Dashboard = () => {
         }).format(date);
     };
 
-    const getRandomMemberCount = () => {
-        return Math.floor(Math.random() * 10) + 2; // Random number between 2-12
-    };
-
     return (
         <div className="min-h-screen bg-gradient-to-br from-cyan-50 via-teal-50 to-emerald-50 p-6">
             <div className="max-w-7xl mx-auto">
@@ -200,9 +196,8 @@ const Dashboard = () => {
                 ) : (
                     <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
                         {groups.map((group) => {
-                            const memberCount = getRandomMemberCount(); // In real app, get from API
-                            const lastActive = new Date(); // In real app, get from API
-                            lastActive.setDate(lastActive.getDate() - Math.floor(Math.random() * 10));
+                            const memberCount = group.MemberCount;
+                            const lastActive = group.LastActivity || group.CreationDate;
                             
                             return (
                                 <div 
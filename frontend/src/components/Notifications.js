@@ -5,7 +5,7 @@ import CheckCircleIcon from '@mui/icons-material/CheckCircle';
 import WarningIcon from '@mui/icons-material/Warning';
 import InfoIcon from '@mui/icons-material/Info';
 import PaymentIcon from '@mui/icons-material/Payment';
-import { getNotifications, markNotificationRead, confirmSettlement } from '../services/api';
+import { getNotifications, markNotificationRead, markNotificationsRead, getUnreadCount, confirmSettlement, openNotificationStream } from '../services/api';
 import { motion, AnimatePresence } from 'framer-motion';
 
 const Notifications = () => {
@@ -16,14 +16,24 @@ const Notifications = () => {
     const [paymentMethod, setPaymentMethod] = useState('');
     const [paymentProcessing, setPaymentProcessing] = useState(false);
     const [notificationSuccess, setNotificationSuccess] = useState(false);
+    const [unreadCount, setUnreadCount] = useState(0);
     const notificationRef = useRef(null);
     const bellIconRef = useRef(null);
 
     useEffect(() => {
         loadNotifications();
-        // Poll for new notifications every minute
-        const interval = setInterval(loadNotifications, 60000);
-        return () => clearInterval(interval);
+        // New notifications are pushed by the server instead of polled
+        const stream = openNotificationStream();
+        stream.addEventListener('notification', (event) => {
+            const notification = JSON.parse(event.data);
+            notification.Message = notification.Message.replace(/\$(\d+(\.\d{1,2})?)/g, '₹$1');
+            setNotifications(prev => [
+                notification,
+                ...prev.filter(n => n.NotificationID !== notification.NotificationID)
+            ]);
+            loadUnreadCount();
+        });
+        return () => stream.close();
     }, []);
 
     // Add click event listener to document for handling outside clicks
@@ -45,7 +55,17 @@ const Notifications = () => {
         };
     }, [notificationRef, bellIconRef]);
 
+    const loadUnreadCount = async () => {
+        try {
+            const response = await getUnreadCount();
+            setUnreadCount(response.data.UnreadCount);
+        } catch (error) {
+            console.error('Failed to load unread count:', error);
+        }
+    };
+
     const loadNotifications = async () => {
+        loadUnreadCount();
         try {
             const response = await getNotifications();
             
@@ -96,6 +116,18 @@ const Notifications = () => {
         }
     };
 
+    const markAllAsRead = async () => {
+        try {
+            await markNotificationsRead(notifications.map(n => n.NotificationID));
+            loadNotifications();
+            
+            setNotificationSuccess(true);
+            setTimeout(() => setNotificationSuccess(false), 2000);
+        } catch (error) {
+            console.error('Failed to mark notifications as read:', error);
+        }
+    };
+
     const handlePayment = async () => {
         if (!paymentMethod.trim()) return;
         
@@ -145,8 +177,6 @@ const Notifications = () => {
         }
     };
 
-    const unreadCount = notifications.filter(n => !n.IsRead).length;
-
     // Animation variants for the bell icon
     const bellAnimation = {
         initial: { rotate: 0 },
@@ -279,6 +309,14 @@ const Notifications = () => {
                                         <CheckCircleIcon className="text-white" fontSize="small" />
                                     </motion.div>
                                 )}
+                                {notifications.length > 0 && (
+                                    <button 
+                                        onClick={markAllAsRead}
+                                        className="text-white text-xs hover:bg-white/20 rounded-full px-2 py-1 transition-colors"
+                                    >
+                                        Mark all read
+                                    </button>
+                                )}
                                 <button 
                                     onClick={() => setShowNotifications(false)}
                                     className="text-white hover:bg-white/20 rounded-full p-1 transition-colors"
@@ -61,6 +61,10 @@ export const joinGroup = (inviteCode) =>
 export const getGroups = () => 
     api.get('/groups');
 
+// Groups with balances, recent expenses, pending settlements and unread count in one request
+export const getDashboard = () =>
+    api.get('/me/dashboard');
+
 export const addExpense = (expenseData) => {
     // Log the headers being sent
     const token = localStorage.getItem('token');
@@ -101,9 +105,19 @@ export const setSettlementPeriod = (groupId, period) =>
 export const getNotifications = () =>
     api.get('/notifications');
 
+// Server-sent events with new notifications; EventSource can't send headers
+export const openNotificationStream = () =>
+    new EventSource(`${API_URL}/notifications/stream?token=${encodeURIComponent(localStorage.getItem('token'))}`);
+
 export const markNotificationRead = (notificationId) =>
     api.put(`/notifications/${notificationId}/read`);
 
+export const markNotificationsRead = (notificationIds) =>
+    api.put('/notifications/read', { NotificationIDs: notificationIds });
+
+export const getUnreadCount = () =>
+    api.get('/notifications/unread-count');
+
 export const getUnpaidSettlements = (userId) =>
     api.get(`/users/${userId}/pending_settlements`);
 